@@ -1,7 +1,18 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, messagebox, filedialog
 import os
+import queue
+import threading
+import der_fleet
 import opender_opendss_integration
+import dss_session
+from bus_index import BusIndex
+from scenario import Scenario
+from result_cache import ResultCache
+
+class SimulationCancelled(Exception):
+    # Raised from the step callback to stop a run when the Cancel button is pressed
+    pass
 
 class SimulationApp:
     def __init__(self, root):
@@ -45,10 +56,14 @@ class SimulationApp:
         ################################################################################################################
 
         # Feeder Data
+        # Buses of the feeder, to validate and complete the DER bus without compiling it
+        self.bus_index = BusIndex.cached()
+
         ttk.Label(self.der_frame, text="DER Bus").grid(row=1, column=0, sticky="w")
-        self.bus_entry = ttk.Entry(self.der_frame, width=15)
+        self.bus_entry = ttk.Combobox(self.der_frame, width=15)
         self.bus_entry.insert(0, 'l3104830')
         self.bus_entry.grid(row=2, column=0, sticky="w")
+        self.bus_entry.bind("<KeyRelease>", self.complete_bus)
 
         ttk.Label(self.der_frame, text="Rated Voltage (kV)").grid(row=1, column=1, sticky="w")
         self.v_rated_entry = ttk.Entry(self.der_frame, width=15)
@@ -133,8 +148,53 @@ class SimulationApp:
         self.export_button = ttk.Button(root, text="Export Data", command=self.export_csv)
         self.export_button.grid(row=3, column=0, padx=10, pady=10, sticky="ew")
 
+        # Export format of the "Export Data" button
+        self.format_frame = ttk.Frame(root)
+        self.format_frame.grid(row=4, column=0, padx=10, pady=(0, 10), sticky="ew")
+        ttk.Label(self.format_frame, text="Export Format").grid(row=0, column=0, sticky="w")
+        self.format_mapping = {
+            "CSV": "csv",
+            "Compressed NumPy (NPZ)": "npz",
+            "Parquet": "parquet"
+        }
+        self.format_combobox = ttk.Combobox(self.format_frame, values=list(self.format_mapping.keys()),
+                                            state="readonly")
+        self.format_combobox.grid(row=0, column=1, padx=10, sticky="ew")
+        self.format_combobox.set("CSV")
+        self.format_frame.grid_columnconfigure(1, weight=1)
+
+        # Live view of the DER traces while the simulation runs
+        self.live_view_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.format_frame, text="Live View", variable=self.live_view_var).grid(row=1, column=0,
+                                                                                              columnspan=2, sticky="w")
+
+        # Co-simulation of a fleet of DERs read from a CSV file, with the simulation settings above
+        self.fleet_button = ttk.Button(self.format_frame, text="Export Fleet Data...", command=self.export_fleet)
+        self.fleet_button.grid(row=2, column=0, columnspan=2, pady=(10, 0), sticky="ew")
+
+        # Progress of the running simulation
+        self.progress_frame = ttk.Frame(root)
+        self.progress_frame.grid(row=5, column=0, padx=10, pady=(0, 10), sticky="ew")
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode="determinate")
+        self.progress_bar.grid(row=0, column=0, sticky="ew")
+        self.cancel_button = ttk.Button(self.progress_frame, text="Cancel", command=self.cancel_run, state="disabled")
+        self.cancel_button.grid(row=0, column=1, padx=(10, 0))
+        self.status_label = ttk.Label(self.progress_frame, text="Ready")
+        self.status_label.grid(row=1, column=0, columnspan=2, sticky="w")
+        self.progress_frame.grid_columnconfigure(0, weight=1)
+
+        # Simulations run in a worker thread and report back through a queue polled by the main loop
+        self.worker = None
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.live_plot = None
+
+        # Results of the scenarios already simulated, so repeated runs return at once
+        self.cache = ResultCache()
+
         # Initialize variables
         self.der_enabled = True
+        self.session = None  # OpenDSS session compiled on the first run
         self.configure_der()
 
     # Function to access the internal value instead of the displayed text
@@ -200,23 +260,189 @@ class SimulationApp:
         else:
             self.q_constant_entry.config(state='disabled')
 
+    def complete_bus(self, event):
+        # Offer the buses that start with the text typed in the DER bus entry
+        self.bus_entry.config(values=self.bus_index.complete(self.bus_entry.get()))
+
+    def check_bus(self, scenario):
+        # Show an error and return False when the DER bus is not a bus of the feeder
+        if not scenario.DER:
+            return True
+
+        message = self.bus_index.validate(scenario.bus)
+        if message:
+            messagebox.showerror("Invalid DER bus", message)
+            return False
+        return True
+
     def plot_graphs(self):
         # Function to save the DER configuration to a txt file
-        self.save_der_config()
+        scenario = self.get_scenario()
+        if not self.check_bus(scenario):
+            return
+        self.save_der_config(scenario)
 
-        # Function to plot graphs
-        opender_opendss_integration.data_processing(True)
-        pass
+        # Function to plot graphs from the results in memory, without exporting them
+        self.start_run(scenario, plot=True)
 
     def export_csv(self):
         # Function to save the DER configuration to a txt file
-        self.save_der_config()
-
-        # Function to export data to CSV
-        opender_opendss_integration.data_processing(False)
-        pass
-
-    def save_der_config(self):
+        scenario = self.get_scenario()
+        if not self.check_bus(scenario):
+            return
+        self.save_der_config(scenario)
+
+        # Function to export data in the selected format
+        export_format = self.format_mapping[self.format_combobox.get()]
+        self.start_run(scenario, export=True, export_format=export_format)
+
+    def export_fleet(self):
+        # Function to co-simulate the DERs of a fleet file (see der_fleet.load_fleet()) with the
+        # simulation settings of the entries and export the results to docs/data_fleet
+        file_path = filedialog.askopenfilename(title="Fleet File", filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        try:
+            fleet = der_fleet.load_fleet(file_path)
+        except Exception as error:
+            messagebox.showerror("Fleet file", str(error))
+            return
+
+        export_format = self.format_mapping[self.format_combobox.get()]
+        self.start_run(self.get_scenario(), export=True, export_format=export_format, fleet=fleet)
+
+    def start_run(self, scenario, plot=False, export=False, export_format='csv', fleet=None):
+        # Run the scenario, or with fleet the co-simulation of its units, in a worker thread; the
+        # buttons stay disabled until it finishes
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.plot_button.config(state="disabled")
+        self.export_button.config(state="disabled")
+        self.fleet_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.progress_bar.config(value=0, maximum=1)
+        self.status_label.config(text="Compiling feeder..." if self.session is None else "Running...")
+        self.cancel_event.clear()
+
+        # The live view is created here, on the main thread, and fed with the samples of the worker
+        self.live_plot = None
+        if self.live_view_var.get() and scenario.DER and fleet is None:
+            import live_plot
+            self.live_plot = live_plot.LivePlot(self.der_mode_combobox.get())
+
+        self.worker = threading.Thread(target=self.run_worker, args=(scenario, plot, export, export_format, fleet),
+                                       daemon=True)
+        self.worker.start()
+        self.root.after(100, self.poll_worker)
+
+    def run_worker(self, scenario, plot, export, export_format, fleet=None):
+        # Worker thread: simulate and report progress, results and errors to the main thread.
+        # Plots are not drawn here, Tkinter and Matplotlib must only be used from the main thread.
+        try:
+            if fleet is not None:
+                result = der_fleet.fleet_feeder(scenario.simulation_time, scenario.number_steps, scenario.npts,
+                                                fleet, self.get_session(), export=export,
+                                                export_format=export_format, step_callback=self.on_step)
+                self.messages.put(('done', result, False))
+                return
+            result = opender_opendss_integration.run_scenario(scenario.as_der_data(), False, self.get_session(),
+                                                              export=export, export_format=export_format,
+                                                              step_callback=self.on_step, cache=self.cache)
+            self.messages.put(('done', result, plot))
+        except SimulationCancelled:
+            self.messages.put(('cancelled',))
+        except Exception as error:
+            self.messages.put(('error', error))
+
+    def on_step(self, i, npts, sample):
+        # Step callback of the simulation, called from the worker thread
+        if self.cancel_event.is_set():
+            raise SimulationCancelled()
+        self.messages.put(('progress', i, npts, sample))
+
+    def poll_worker(self):
+        # Apply the messages of the worker thread and keep polling until the run finishes
+        finished = None
+        progress = None
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                progress = message
+                if self.live_plot is not None:
+                    self.live_plot(*message[1:])
+            else:
+                finished = message
+
+        if progress is not None:
+            self.progress_bar.config(value=progress[1] + 1, maximum=progress[2])
+            self.status_label.config(text=f"Point {progress[1] + 1} of {progress[2]}")
+
+        if finished is None:
+            self.root.after(100, self.poll_worker)
+            return
+
+        self.plot_button.config(state="normal")
+        self.export_button.config(state="normal")
+        self.fleet_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+
+        if self.live_plot is not None:
+            self.live_plot.close()
+
+        if finished[0] == 'done':
+            result, plot = finished[1], finished[2]
+            self.status_label.config(text="Done (cached results)" if getattr(result, 'cached', False) else "Done")
+            if plot:
+                result.plot()
+        elif finished[0] == 'cancelled':
+            self.progress_bar.config(value=0)
+            self.status_label.config(text="Cancelled")
+        else:
+            self.status_label.config(text="Error")
+            messagebox.showerror("Simulation error", str(finished[1]))
+
+    def cancel_run(self):
+        # Ask the worker thread to stop at the end of the current point
+        self.cancel_event.set()
+        self.status_label.config(text="Cancelling...")
+
+    def get_scenario(self):
+        # Scenario described by the current entries
+        if self.sim_type_var.get() == '1':
+            simulation_time = 3600
+            number_steps = 0
+        else:
+            simulation_time = self.sim_time_entry.get()
+            number_steps = self.steps_entry.get()
+
+        return Scenario(simulation_time=simulation_time,
+                        number_steps=number_steps,
+                        pts_per_steps=self.points_entry.get(),
+                        DER=self.use_der_var.get(),
+                        bus=self.bus_entry.get(),
+                        V_rated=self.v_rated_entry.get(),
+                        line=self.line_entry.get(),
+                        control_mode=self.get_der_mode_value(),
+                        S_rated=self.s_rated_entry.get(),
+                        PF_rated=self.pf_rated_entry.get(),
+                        CONST_Q=self.q_constant_entry.get(),
+                        normal_op_CAT=self.cat_normal.get(),
+                        abnormal_op_CAT=self.cat_abnormal.get())
+
+    def get_session(self):
+        # Compile the feeder on the first run and reuse it for the following ones
+        if self.session is None:
+            self.session = dss_session.FeederSession()
+
+            # The compiled feeder also gives the base and phases of every bus
+            self.bus_index = BusIndex.cached(self.session)
+        return self.session
+
+    def save_der_config(self, scenario):
         # Path to the 'docs' directory
         docs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'docs')
 
@@ -227,24 +453,7 @@ class SimulationApp:
         file_path = os.path.join(docs_dir, 'DER.txt')
 
         # Write variables to the DER.txt file
-        with open(file_path, 'w') as f:
-            if self.sim_type_var.get() == '1':
-                f.write(f"simulation_time 3600\n")
-                f.write(f"number_steps 0\n")
-            else:
-                f.write(f"simulation_time {self.sim_time_entry.get()}\n")
-                f.write(f"number_steps {self.steps_entry.get()}\n")
-            f.write(f"pts_per_steps {self.points_entry.get()}\n")
-            f.write(f"DER {self.use_der_var.get()}\n")
-            f.write(f"bus {self.bus_entry.get()}\n")
-            f.write(f"V_rated {self.v_rated_entry.get()}\n")
-            f.write(f"line {self.line_entry.get()}\n")
-            f.write(f"control_mode {self.get_der_mode_value()}\n")
-            f.write(f"S_rated {self.s_rated_entry.get()}\n")
-            f.write(f"PF_rated {self.pf_rated_entry.get()}\n")
-            f.write(f"CONST_Q {self.q_constant_entry.get()}\n")
-            f.write(f"normal_op_CAT {self.cat_normal.get()}\n")
-            f.write(f"abnormal_op_CAT {self.cat_abnormal.get()}\n")
+        scenario.save(file_path)
 
         print(f"File saved at: {file_path}")
 
@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# The benchmarks import the simulation modules from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import data_export_plot
+import dss_controls
+import dss_session
+import opender_opendss_integration
+from scenario import Scenario
+
+# Stored results of a reference run, compared against by default
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+CONTROL_MODES = ['constant_pf', 'volt_var', 'watt_var', 'constant_var', 'volt_watt']
+
+# Simulation sizes as (number_steps, pts_per_steps); zero steps is the 24-hour mode
+SIZES = [(0, 24), (7, 10), (7, 30), (15, 30)]
+QUICK_SIZES = [(0, 24), (7, 10)]
+
+def scenario_cases(modes, sizes):
+    # Name and scenario of each feeder() benchmark
+    cases = {}
+    for number_steps, pts_per_steps in sizes:
+        for control_mode in modes:
+            if number_steps == 0:
+                cases[f'feeder/{control_mode}/24h'] = Scenario(simulation_time=3600, number_steps=0,
+                                                               control_mode=control_mode)
+            else:
+                cases[f'feeder/{control_mode}/{number_steps}x{pts_per_steps}'] = Scenario(
+                    number_steps=number_steps, pts_per_steps=pts_per_steps, control_mode=control_mode)
+    return cases
+
+def latency_stats(durations):
+    # Percentiles (ms) and rate (1/s) of a list of durations in seconds
+    durations = np.asarray(durations) * 1000
+    return {'count': int(durations.size),
+            'p50_ms': float(np.percentile(durations, 50)),
+            'p90_ms': float(np.percentile(durations, 90)),
+            'p99_ms': float(np.percentile(durations, 99)),
+            'max_ms': float(durations.max()),
+            'per_s': float(1000 / durations.mean())}
+
+def bench_scenario(session, scenario, repeat):
+    # Per-step latency and total time of full feeder() runs on a compiled session. The latency of
+    # a step is the time between two step callbacks, so the first point of each run (which also
+    # covers the reset and setup of the session) is only included in the total.
+    step_times = []
+    totals = []
+    last = [0.0]
+
+    def on_step(i, npts, sample):
+        now = time.perf_counter()
+        if i > 0:
+            step_times.append(now - last[0])
+        last[0] = now
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = opender_opendss_integration.run_scenario(scenario.as_der_data(), plot=False, session=session,
+                                                          export=False, plot_circuit=False, step_callback=on_step)
+        totals.append(time.perf_counter() - start)
+
+    stats = latency_stats(step_times)
+    stats['total_s'] = float(np.median(totals))
+    stats['points_per_s'] = float(len(result.data) / stats['total_s'])
+    return stats, result
+
+def bench_solve(session, n):
+    # Solution of one point of the daily simulation left by the last scenario
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        session.dss.solution.solve()
+        durations.append(time.perf_counter() - start)
+    return latency_stats(durations)
+
+def bench_readout(session, n):
+    # Readout of the DER terminal measurements
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        opender_opendss_integration.read_der_terminal(session.dss, 'PVSystem.PV')
+        durations.append(time.perf_counter() - start)
+    return latency_stats(durations)
+
+def bench_controls(session, n):
+    # Per-step settings written with text commands and with dss_controls.FeederControls
+    controls = dss_controls.FeederControls(session.dss, ['PV'])
+    cases = {'text/loadmult': lambda k: session.dss.text(f'set loadmult={1 + k * 1e-6}'),
+             'controls/loadmult': lambda k: controls.set_load_mult(1 + k * 1e-6),
+             'controls/activate_pv': lambda k: controls.activate_pv('PV'),
+             'controls/pv_setpoints': lambda k: controls.set_pv('PV', 1 - k * 1e-6, k * 1e-3)}
+
+    results = {}
+    for name, write in cases.items():
+        durations = []
+        for k in range(n):
+            start = time.perf_counter()
+            write(k)
+            durations.append(time.perf_counter() - start)
+        results[f'opendss/{name}'] = latency_stats(durations)
+    return results
+
+def bench_der_run(control_mode, n):
+    # OpenDER update and run with fixed measurements
+    S_rated = 2E6
+    der_obj, title = opender_opendss_integration.create_der(S_rated, 0.92, 12.47, control_mode, 0.3, 'B', 'III')
+    V = [7200.0, 7200.0, 7200.0]
+    Theta = [0.0, -2 * np.pi / 3, 2 * np.pi / 3]
+
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        der_obj.update_der_input(v=V, theta=Theta, p_dc_w=S_rated * 0.92)
+        der_obj.run()
+        der_obj.get_der_output('I_pu')
+        durations.append(time.perf_counter() - start)
+    return latency_stats(durations)
+
+def bench_export(data, rows, repeat):
+    # Write and read times of the results, repeated up to the given number of rows, in each format
+    data = pd.concat([data] * int(np.ceil(rows / len(data))), ignore_index=True).iloc[:rows]
+
+    cases = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for export_format in data_export_plot.EXPORT_FORMATS:
+            write_times = []
+            read_times = []
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    file_path = data_export_plot.write_data(data, os.path.join(tmp_dir, 'data'), export_format)
+                    write_times.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    data_export_plot.read_data(file_path)
+                    read_times.append(time.perf_counter() - start)
+            except ImportError as error:
+                print(f"Skipping {export_format}: {error}")
+                continue
+
+            cases[f'export/{export_format}/write/{rows}'] = latency_stats(write_times)
+            cases[f'export/{export_format}/read/{rows}'] = latency_stats(read_times)
+
+    return cases
+
+def run_benchmarks(modes, sizes, repeat=3, samples=200, export_rows=100000):
+    # Run every benchmark on one compiled feeder and return {name: statistics}
+    results = {}
+
+    start = time.perf_counter()
+    session = dss_session.FeederSession()
+    results['session/compile'] = {'count': 1, 'total_s': time.perf_counter() - start}
+
+    # Warm-up run, not measured
+    opender_opendss_integration.run_scenario(Scenario(number_steps=1, pts_per_steps=5).as_der_data(), plot=False,
+                                             session=session, export=False, plot_circuit=False)
+
+    last_result = None
+    for name, scenario in scenario_cases(modes, sizes).items():
+        results[name], last_result = bench_scenario(session, scenario, repeat)
+
+    results['opendss/solve'] = bench_solve(session, samples)
+    results['opendss/read_der_terminal'] = bench_readout(session, samples)
+    results.update(bench_controls(session, samples))
+    for control_mode in modes:
+        results[f'opender/run/{control_mode}'] = bench_der_run(control_mode, samples)
+    results.update(bench_export(last_result.data, export_rows, repeat))
+
+    return results
+
+def compare(results, baselines, tolerance):
+    # Compare the median latency (or total time) of each benchmark with its baseline and
+    # return the names of the benchmarks slower than baseline * (1 + tolerance)
+    regressions = []
+    print(f"\n{'benchmark':<36}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}{'baseline':>10}{'ratio':>8}")
+    for name, stats in results.items():
+        key = 'p50_ms' if 'p50_ms' in stats else 'total_s'
+        reference = baselines.get(name, {}).get(key)
+        ratio = stats[key] / reference if reference else float('nan')
+        flag = ''
+        if reference and ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  <-- slower'
+        print(f"{name:<36}{stats.get('p50_ms', float('nan')):>10.2f}{stats.get('p99_ms', float('nan')):>10.2f}"
+              f"{stats.get('total_s', float('nan')):>10.2f}{reference or float('nan'):>10.2f}{ratio:>8.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the OpenDSS/OpenDER co-simulation hot path.')
+    parser.add_argument('--quick', action='store_true', help='only volt_var and the two smallest sizes, one repeat')
+    parser.add_argument('--modes', nargs='+', choices=CONTROL_MODES, help='control modes to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario (default: 3)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baselines', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against the baselines before failing (default: 0.25)')
+    args = parser.parse_args()
+
+    modes = args.modes or (['volt_var'] if args.quick else CONTROL_MODES)
+    sizes = QUICK_SIZES if args.quick else SIZES
+    repeat = 1 if args.quick else args.repeat
+
+    # Paths are resolved before OpenDSS changes the working directory to the feeder folder
+    output = os.path.abspath(args.output) if args.output else None
+
+    results = run_benchmarks(modes, sizes, repeat)
+    report = {'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                          'cpus': os.cpu_count()},
+              'metadata': data_export_plot.run_metadata(),
+              'results': results}
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"File saved at: {output}")
+
+    if args.save_baselines:
+        with open(BASELINES, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"File saved at: {BASELINES}")
+        return
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES, 'r') as f:
+            baselines = json.load(f)['results']
+
+    regressions = compare(results, baselines, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmarks slower than the baselines: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
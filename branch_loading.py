@@ -0,0 +1,76 @@
+import numpy as np
+
+class BranchLoading:
+    # Loading of every line and transformer of the feeder from the node voltages of a solution,
+    # without activating each element: the currents into the first terminal are its rows of the
+    # primitive admittance matrix times the voltages of its terminals. Elements are grouped by
+    # their number of conductors so each group is a single matrix product. The admittances are
+    # read once, except those of the elements in variable (the regulators), read at every call
+    # because they change with the tap.
+    def __init__(self, dss, variable=()):
+        node_index = {node.lower(): k for k, node in enumerate(dss.circuit.y_node_order)}
+        ground = len(node_index)
+
+        groups = {}
+        for element_class, names in (('Line', dss.lines.names), ('Transformer', dss.transformers.names)):
+            for name in names:
+                dss.circuit.set_active_element(f'{element_class}.{name}')
+                if not dss.cktelement.is_enabled or dss.cktelement.norm_amps <= 0:
+                    continue
+
+                conductors = dss.cktelement.num_conductors
+                nodes = dss.cktelement.node_order
+                index = []
+                for terminal, bus in enumerate(dss.cktelement.bus_names):
+                    bus = bus.split('.')[0].lower()
+                    for node in nodes[terminal * conductors:(terminal + 1) * conductors]:
+                        index.append(ground if node == 0 else node_index[f'{bus}.{node}'])
+
+                groups.setdefault((conductors, len(index)), []).append(
+                    (f'{element_class}.{name}', self.admittance(dss), index, dss.cktelement.norm_amps))
+
+        self.names = []
+        self.groups = []
+        self.variable = []
+        variable = {f'transformer.{name.lower()}' for name in variable}
+        for elements in groups.values():
+            for row, element in enumerate(elements):
+                if element[0].lower() in variable:
+                    self.variable.append((element[0], len(self.groups), row))
+            self.names.extend(element[0] for element in elements)
+            self.groups.append((np.array([element[1] for element in elements]),
+                                np.array([element[2] for element in elements], dtype=np.int64),
+                                np.array([element[3] for element in elements])))
+        self.names = np.array(self.names)
+
+    @staticmethod
+    def admittance(dss):
+        # Rows of the primitive admittance matrix of the active element for its first terminal
+        conductors = dss.cktelement.num_conductors
+        y_prim = np.asarray(dss.cktelement.y_prim)
+        y_prim = y_prim[0::2] + 1j * y_prim[1::2]
+        size = int(np.sqrt(len(y_prim)))
+        return y_prim.reshape(size, size)[:conductors]
+
+    def currents(self, dss):
+        # Node voltages of the present solution (the ground node last) and, for each group, the
+        # complex currents into the conductors of the first terminal of its elements
+        for name, group, row in self.variable:
+            dss.circuit.set_active_element(name)
+            self.groups[group][0][row] = self.admittance(dss)
+
+        v = np.asarray(dss.circuit.y_node_varray)
+        v = np.append(v[0::2] + 1j * v[1::2], 0)  # The last entry is the ground node
+        return v, [np.einsum('kij,kj->ki', y_prim, v[index]) for y_prim, index, norm_amps in self.groups]
+
+    def loading(self, dss):
+        # Highest conductor current of each element over its normal rating, in the order of names
+        v, currents = self.currents(dss)
+        return np.concatenate([np.abs(i).max(axis=1) / norm_amps
+                               for i, (y_prim, index, norm_amps) in zip(currents, self.groups)])
+
+    def powers(self, dss):
+        # Complex power (kW + j kvar) into the first terminal of each element, in the order of names
+        v, currents = self.currents(dss)
+        return np.concatenate([(v[index[:, :i.shape[1]]] * np.conj(i)).sum(axis=1) / 1000
+                               for i, (y_prim, index, norm_amps) in zip(currents, self.groups)])
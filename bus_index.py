@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import data_export_plot
+import result_cache
+
+# Offsets (feet, the units of Buscoords.dss) from the primary bus of a service transformer given by
+# AddBusXY.py to its secondary buses without coordinates: transformer bus, then load bus
+TRANSFORMER_OFFSET = (5.0, 0.0)
+LOAD_OFFSET = (45.0, 40.0)
+
+# Line-to-line base (kV) above which a bus without coordinates is a primary bus, left to manual
+# inspection by AddBusXY.py rather than placed next to another bus
+PRIMARY_KV = 0.5
+
+def read_buscoords(file_path):
+    # Bus names and coordinates of an OpenDSS Buscoords file ("name, x, y" or "name x y" per line,
+    # with // and ! comments)
+    names = []
+    coordinates = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.split('//')[0].split('!')[0].replace(',', ' ').split()
+            if len(line) >= 3:
+                names.append(line[0])
+                coordinates.append((float(line[1]), float(line[2])))
+    return names, np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+
+def buscoords_file(dss_file=None):
+    # Buscoords file loaded by a master file: the file given to its Buscoords command, or
+    # Buscoords.dss next to it
+    if dss_file is None:
+        dss_file = result_cache.default_dss_file()
+
+    feeder_dir = os.path.dirname(os.path.abspath(dss_file))
+    with open(dss_file, 'r') as f:
+        for line in f:
+            line = line.split('//')[0].split('!')[0].split()
+            if len(line) >= 2 and line[0].lower() == 'buscoords':
+                return os.path.join(feeder_dir, line[1])
+    return os.path.join(feeder_dir, 'Buscoords.dss')
+
+class BusIndex:
+    # Buses of the feeder in compact arrays: name, coordinates (NaN where the bus has none) and,
+    # when built from a compiled feeder, the line-to-neutral base (kV) and the number of nodes
+    # (NaN and 0 otherwise). Names are looked up in a dictionary, prefixes in the sorted lower-case
+    # names, and coordinates in a uniform grid of about one bus per cell: the buses sorted by cell
+    # with the start of each cell, so nearest() and within() only visit the cells around the query.
+    # cached() keeps the arrays in 'docs/bus_index', so they are read once per feeder.
+    def __init__(self, names, x, y, kv_base=None, num_nodes=None):
+        self.names = np.asarray(names, dtype=str)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.kv_base = np.full(len(self.names), np.nan) if kv_base is None else np.asarray(kv_base, np.float64)
+        self.num_nodes = np.zeros(len(self.names), np.int64) if num_nodes is None else np.asarray(num_nodes, np.int64)
+
+        lower = np.char.lower(self.names)
+        self.ids = {name: k for k, name in enumerate(lower.tolist())}
+        self.sorted_ids = np.argsort(lower, kind='stable')
+        self.sorted_names = lower[self.sorted_ids]
+
+        # Uniform grid over the buses with coordinates
+        located = np.flatnonzero(~np.isnan(self.x) & ~np.isnan(self.y))
+        if len(located):
+            self.x0, self.y0 = self.x[located].min(), self.y[located].min()
+            width = max(self.x[located].max() - self.x0, self.y[located].max() - self.y0, 1.0)
+            self.grid = max(int(np.sqrt(len(located))), 1)
+            self.cell = width / self.grid * (1 + 1e-9)
+        else:
+            self.x0 = self.y0 = 0.0
+            self.grid, self.cell = 1, 1.0
+        cells = self.cells(self.x[located], self.y[located])
+        order = np.argsort(cells, kind='stable')
+        self.cell_ids = located[order]
+        self.cell_start = np.searchsorted(cells[order], np.arange(self.grid * self.grid + 1))
+
+    @classmethod
+    def from_buscoords(cls, file_path=None):
+        # Buses listed in a Buscoords file (by default the one of the default feeder), without
+        # compiling the feeder
+        if file_path is None:
+            file_path = buscoords_file()
+        names, coordinates = read_buscoords(file_path)
+        return cls(names, coordinates[:, 0], coordinates[:, 1])
+
+    @classmethod
+    def from_session(cls, session):
+        # Every bus of a compiled feeder session, with its coordinates, base and number of nodes
+        dss = session.dss
+        names = dss.circuit.buses_names
+        x = np.full(len(names), np.nan)
+        y = np.full(len(names), np.nan)
+        kv_base = np.zeros(len(names))
+        num_nodes = np.zeros(len(names), np.int64)
+        for k, name in enumerate(names):
+            dss.circuit.set_active_bus_i(k)
+            if dss.bus.coord_defined:
+                x[k], y[k] = dss.bus.x, dss.bus.y
+            kv_base[k] = dss.bus.kv_base
+            num_nodes[k] = dss.bus.num_nodes
+        return cls(names, x, y, kv_base, num_nodes)
+
+    def save(self, file_path):
+        # Uncompressed NPZ file, written under a temporary name and then renamed so that readers
+        # never see an incomplete file
+        tmp_path = f'{file_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, names=self.names, x=self.x, y=self.y, kv_base=self.kv_base, num_nodes=self.num_nodes)
+        os.replace(tmp_path, file_path)
+        print(f"File saved at: {file_path}")
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(data['names'], data['x'], data['y'], data['kv_base'], data['num_nodes'])
+
+    @classmethod
+    def cached(cls, session=None, dss_file=None):
+        # Bus index of the session's feeder (the default feeder without session). The index of the
+        # compiled feeder is built once from a session and then reused while the feeder scripts do
+        # not change; until then, the index of the Buscoords file is used, without compiling.
+        if session is not None:
+            dss_file = session.dss_file
+        code = result_cache.cached_digest(os.path.abspath(__file__))
+
+        cache_dir = data_export_plot.docs_path('bus_index')
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Only the feeder scripts matter, not the simulation code in the fingerprint
+        feeder = {name: digest for name, digest in result_cache.feeder_fingerprint(dss_file).items()
+                  if not name.endswith('.py')}
+        content = {'feeder': feeder, 'code': code}
+        key = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+        file_path = os.path.join(cache_dir, f'{key}.npz')
+        if os.path.exists(file_path):
+            return cls.load(file_path)
+
+        if session is not None:
+            index = cls.from_session(session)
+        else:
+            coordinates_file = buscoords_file(dss_file)
+            content = {'buscoords': result_cache.cached_digest(coordinates_file), 'code': code}
+            key = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+            file_path = os.path.join(cache_dir, f'{key}_buscoords.npz')
+            if os.path.exists(file_path):
+                return cls.load(file_path)
+            index = cls.from_buscoords(coordinates_file)
+
+        index.save(file_path)
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name.lower() in self.ids
+
+    def index(self, name):
+        try:
+            return self.ids[name.lower()]
+        except KeyError:
+            raise KeyError(f'Bus {name} is not a bus of the feeder') from None
+
+    def lookup(self, names):
+        # Index of each name, -1 for the names that are not buses of the feeder
+        return np.array([self.ids.get(name.lower(), -1) for name in names], dtype=np.int64)
+
+    def complete(self, prefix, limit=20):
+        # Names of the buses that start with prefix (case-insensitive), in alphabetical order
+        prefix = prefix.strip().lower()
+        start = np.searchsorted(self.sorted_names, prefix, side='left')
+        end = np.searchsorted(self.sorted_names, prefix + '\uffff', side='left')
+        return self.names[self.sorted_ids[start:min(end, start + limit)]].tolist()
+
+    def validate(self, name, phases=3):
+        # Error message for a DER bus entry, empty when the bus exists and, if the number of nodes
+        # is known, has at least the given number of phases
+        name = name.strip().split('.')[0]  # Without the nodes, e.g. l3104830.1.2.3
+        if name not in self:
+            # Buses that share the longest prefix with the entry
+            suggestions = []
+            for length in range(len(name), 0, -1):
+                suggestions = self.complete(name[:length], 5)
+                if suggestions:
+                    break
+            message = f'Bus {name} is not a bus of the feeder.'
+            if suggestions:
+                message += f' Similar buses: {", ".join(suggestions)}'
+            return message
+
+        num_nodes = self.num_nodes[self.index(name)]
+        if 0 < num_nodes < phases:
+            return f'Bus {name} has {num_nodes} node(s); a {phases}-phase DER needs a {phases}-phase bus.'
+        return ''
+
+    def cells(self, x, y):
+        # Grid cell of each point, points outside the grid in the nearest border cell
+        cx = np.clip(((np.asarray(x) - self.x0) // self.cell).astype(np.int64), 0, self.grid - 1)
+        cy = np.clip(((np.asarray(y) - self.y0) // self.cell).astype(np.int64), 0, self.grid - 1)
+        return cy * self.grid + cx
+
+    def cell_buses(self, cx_min, cy_min, cx_max, cy_max):
+        # Buses in a rectangle of cells (inclusive), clipped to the grid
+        cx_min, cy_min = max(cx_min, 0), max(cy_min, 0)
+        cx_max, cy_max = min(cx_max, self.grid - 1), min(cy_max, self.grid - 1)
+        if cx_min > cx_max or cy_min > cy_max:
+            return np.empty(0, dtype=np.int64)
+        rows = [self.cell_ids[self.cell_start[cy * self.grid + cx_min]:self.cell_start[cy * self.grid + cx_max + 1]]
+                for cy in range(cy_min, cy_max + 1)]
+        return np.concatenate(rows)
+
+    def nearest(self, x, y, k=1):
+        # Indices and distances of the k buses closest to (x, y), closest first. The cells are
+        # visited in square rings around the cell of the point until no cell left can be closer.
+        cell = int(self.cells(x, y))
+        cx, cy = cell % self.grid, cell // self.grid
+
+        # A point outside the grid is searched from its nearest border cell
+        outside = np.hypot(x - np.clip(x, self.x0, self.x0 + self.grid * self.cell),
+                           y - np.clip(y, self.y0, self.y0 + self.grid * self.cell))
+
+        found = np.empty(0, dtype=np.int64)
+        for ring in range(self.grid):
+            if ring == 0:
+                ring_buses = self.cell_buses(cx, cy, cx, cy)
+            else:
+                ring_buses = np.concatenate([
+                    self.cell_buses(cx - ring, cy - ring, cx + ring, cy - ring),
+                    self.cell_buses(cx - ring, cy + ring, cx + ring, cy + ring),
+                    self.cell_buses(cx - ring, cy - ring + 1, cx - ring, cy + ring - 1),
+                    self.cell_buses(cx + ring, cy - ring + 1, cx + ring, cy + ring - 1)])
+            found = np.concatenate([found, ring_buses])
+
+            # Buses beyond this ring are at least ring cells away from the point
+            if len(found) >= k:
+                distance = np.hypot(self.x[found] - x, self.y[found] - y)
+                if np.partition(distance, k - 1)[k - 1] <= ring * self.cell - outside:
+                    break
+        else:
+            distance = np.hypot(self.x[found] - x, self.y[found] - y)
+
+        order = np.argsort(distance, kind='stable')[:k]
+        return found[order], distance[order]
+
+    def within(self, x_min, y_min, x_max, y_max):
+        # Indices of the buses inside a rectangle, in ascending order
+        cx_min, cy_min = ((np.array([x_min, y_min]) - [self.x0, self.y0]) // self.cell).astype(np.int64)
+        cx_max, cy_max = ((np.array([x_max, y_max]) - [self.x0, self.y0]) // self.cell).astype(np.int64)
+        candidates = self.cell_buses(int(cx_min), int(cy_min), int(cx_max), int(cy_max))
+        inside = ((self.x[candidates] >= x_min) & (self.x[candidates] <= x_max)
+                  & (self.y[candidates] >= y_min) & (self.y[candidates] <= y_max))
+        return np.sort(candidates[inside])
+
+    def missing_coordinates(self):
+        # Coordinates for the buses without them, as AddBusXY.py derived them: a service transformer
+        # bus (x...) or load bus (sx...) is placed next to its primary bus (l...), and the other
+        # buses, returned separately, need coordinates by manual inspection. Primary buses (base
+        # above PRIMARY_KV) always need them; without the bases (an index of the Buscoords file
+        # only) every bus is taken by its name.
+        secondary = []
+        manual = []
+        for k in np.flatnonzero(np.isnan(self.x) | np.isnan(self.y)):
+            name = str(self.names[k])
+            primary = self.ids.get('l' + name.lower().strip('sxabc'))
+            if self.kv_base[k] * np.sqrt(3) > PRIMARY_KV or primary is None or np.isnan(self.x[primary]):
+                manual.append(name)
+                continue
+            dx, dy = LOAD_OFFSET if 'sx' in name.lower() else TRANSFORMER_OFFSET
+            secondary.append((name, float(self.x[primary] + dx), float(self.y[primary] + dy)))
+        return secondary, manual
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the bus index of the feeder and look up buses.')
+    parser.add_argument('buses', nargs='*',
+                        help='bus names or prefixes to look up')
+    parser.add_argument('--compile', action='store_true',
+                        help='compile the feeder to index every bus with its base and nodes '
+                             '(default: the buses of the Buscoords file)')
+    args = parser.parse_args()
+
+    session = None
+    if args.compile:
+        import dss_session
+        session = dss_session.FeederSession()
+    index = BusIndex.cached(session)
+    print(f"{len(index)} buses indexed")
+
+    for name in args.buses:
+        if name in index:
+            k = index.index(name)
+            neighbours, distance = index.nearest(index.x[k], index.y[k], 4)
+            print(f"{index.names[k]}: x={index.x[k]} y={index.y[k]} kV={index.kv_base[k]:g} "
+                  f"nodes={index.num_nodes[k]} nearest: {', '.join(index.names[neighbours[1:]])}")
+        else:
+            print(index.validate(name))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,117 @@
 import numpy as np
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
-from tkinter import Label, Entry, Button, Toplevel
+import json
+import datetime
+from importlib import metadata as package_metadata
+from downsampling import DownsampledLines, status_codes
+from dss_controls import power_factor
 
-def csv_data_without_der(t_data, va_data, vb_data, vc_data, V_rated):
+# File extension of each export format. The binary formats store every column with its own
+# type, the Status column as integer codes with a category table and the run metadata.
+EXPORT_FORMATS = {'csv': '.csv', 'npz': '.npz', 'parquet': '.parquet'}
+
+def docs_path(file_name):
+    # Path to the 'docs' folder next to this module, independent of the current directory
+    # (OpenDSS changes it to the feeder folder when compiling)
+    docs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'docs')
+
+    # Check if the 'docs' folder exists; if not, create it
+    if not os.path.exists(docs_dir):
+        os.makedirs(docs_dir)
+
+    return os.path.join(docs_dir, file_name)
+
+def package_versions():
+    # Installed versions of the packages that produce the results
+    versions = {}
+    for package in ['opender', 'py-dss-interface', 'numpy', 'pandas']:
+        try:
+            versions[package] = package_metadata.version(package)
+        except package_metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+def run_metadata(scenario=None):
+    # Metadata stored with binary exports: creation time, package versions and the simulated scenario
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'versions': package_versions(),
+            'scenario': scenario}
+
+def json_value(value):
+    # Convert NumPy scalars (e.g. from scenarios loaded with pandas) for json.dumps
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def write_data(df, file_path, export_format='csv', scenario=None):
+    # Write the results to file_path (without extension) in the selected format and return the full path
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export_format must be one of {', '.join(EXPORT_FORMATS)}")
+
+    file_path = file_path + EXPORT_FORMATS[export_format]
+
+    if export_format == 'csv':
+        df.to_csv(file_path, index=False)
+    elif export_format == 'npz':
+        # One array per column; text columns are stored as codes plus a category table
+        arrays = {'__metadata__': np.array(json.dumps(run_metadata(scenario), default=json_value))}
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if values.dtype.kind in 'OUS' or isinstance(df[column].dtype, pd.CategoricalDtype):
+                categories, codes = np.unique(values.astype(str), return_inverse=True)
+                arrays[column] = codes.astype(np.min_scalar_type(len(categories)))
+                arrays[f'{column}.categories'] = categories
+            else:
+                arrays[column] = values
+        np.savez_compressed(file_path, **arrays)
+    else:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("The parquet export format requires pyarrow (pip install pyarrow)")
+
+        # Text columns become dictionary-encoded columns and the metadata goes into the schema
+        df = df.astype({column: 'category' for column in df.columns if df[column].dtype.kind in 'OUS'})
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[b'opender_ui'] = json.dumps(run_metadata(scenario), default=json_value).encode()
+        pq.write_table(table.replace_schema_metadata(schema_metadata), file_path, compression='zstd')
+
+    return file_path
+
+def read_data(file_path):
+    # Load results written by write_data() and return them with their metadata (empty for CSV files)
+    extension = os.path.splitext(file_path)[1].lower()
+
+    if extension == '.npz':
+        with np.load(file_path) as archive:
+            metadata = json.loads(str(archive['__metadata__']))
+            data = {}
+            for column in archive.files:
+                if column == '__metadata__' or column.endswith('.categories'):
+                    continue
+                if f'{column}.categories' in archive.files:
+                    data[column] = pd.Categorical.from_codes(archive[column], archive[f'{column}.categories'])
+                else:
+                    data[column] = archive[column]
+        return pd.DataFrame(data), metadata
+
+    if extension == '.parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading parquet files requires pyarrow (pip install pyarrow)")
+
+        # Memory-map the file instead of reading it into a buffer first
+        table = pq.read_table(file_path, memory_map=True)
+        metadata = json.loads((table.schema.metadata or {}).get(b'opender_ui', b'{}'))
+        return table.to_pandas(), metadata
+
+    return pd.read_csv(file_path), {}
+
+def data_without_der(t_data, va_data, vb_data, vc_data, V_rated):
     # Normalize voltage data by the rated voltage
     va_data = va_data / (V_rated * 1E3 / np.sqrt(3))
     vb_data = vb_data / (V_rated * 1E3 / np.sqrt(3))
@@ -21,36 +128,33 @@ def csv_data_without_der(t_data, va_data, vb_data, vc_data, V_rated):
         'Vm (pu)': vm_data
     }
 
-    df = pd.DataFrame(data)
-
-    # Path to the directory two levels up from the current folder
-    two_levels_up = os.path.abspath(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    docs_dir = os.path.join(two_levels_up, 'docs')  # Path to the 'docs' folder two levels up
+    return pd.DataFrame(data)
 
-    # Check if the 'docs' folder exists; if not, create it
-    if not os.path.exists(docs_dir):
-        os.makedirs(docs_dir)
+def csv_data_without_der(t_data, va_data, vb_data, vc_data, V_rated, export_format='csv', scenario=None):
+    # Create a DataFrame with the data
+    df = data_without_der(t_data, va_data, vb_data, vc_data, V_rated)
 
-    # Full path to the CSV file
-    csv_path = os.path.join(docs_dir, 'data_without_DER.csv')
+    # Export the DataFrame to the 'docs' directory
+    file_path = write_data(df, docs_path('data_without_DER'), export_format, scenario)
 
-    # Export the DataFrame to the CSV file in the 'docs' directory
-    df.to_csv(csv_path, index=False)
+    print(f"File saved at: {file_path}")
 
-    print(f"File saved at: {csv_path}")
+    return df
 
-def csv_data_with_der(t_data, p_data, q_data, vm_data, va_data, vb_data, vc_data, status_data, i_data, i_angle_data, control_mode):
-    # Extract current and angle data
-    ia_data = [sublist[0] for sublist in i_data]
-    ib_data = [sublist[1] for sublist in i_data]
-    ic_data = [sublist[2] for sublist in i_data]
+def data_with_der(t_data, p_data, q_data, vm_data, va_data, vb_data, vc_data, status_data, i_data, i_angle_data):
+    # Extract current and angle data (one row of three phases per point)
+    i_data = np.asarray(i_data)
+    ia_data = i_data[:, 0]
+    ib_data = i_data[:, 1]
+    ic_data = i_data[:, 2]
 
-    ia_angle_data = [sublist[0] for sublist in i_angle_data]
-    ib_angle_data = [sublist[1] for sublist in i_angle_data]
-    ic_angle_data = [sublist[2] for sublist in i_angle_data]
+    i_angle_data = np.asarray(i_angle_data)
+    ia_angle_data = i_angle_data[:, 0]
+    ib_angle_data = i_angle_data[:, 1]
+    ic_angle_data = i_angle_data[:, 2]
 
-    # Calculate power factor
-    pf_data = np.cos(np.arctan2(np.array(q_data), np.array(p_data)))
+    # Calculate power factor, negative when absorbing as sent to the PVSystem
+    pf_data = power_factor(p_data, q_data)
 
     # Create a DataFrame with the data
     data = {
@@ -71,40 +175,68 @@ def csv_data_with_der(t_data, p_data, q_data, vm_data, va_data, vb_data, vc_data
         'Status': status_data
     }
 
-    df = pd.DataFrame(data)
+    # The columns are used as they are, so results recorded in a memory-mapped file are not copied
+    return pd.DataFrame(data, copy=False)
+
+def csv_data_with_der(t_data, p_data, q_data, vm_data, va_data, vb_data, vc_data, status_data, i_data, i_angle_data, control_mode,
+                      export_format='csv', scenario=None):
+    # Create a DataFrame with the data
+    df = data_with_der(t_data, p_data, q_data, vm_data, va_data, vb_data, vc_data, status_data, i_data, i_angle_data)
 
-    # Path to the directory two levels up from the current folder
-    two_levels_up = os.path.abspath(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    docs_dir = os.path.join(two_levels_up, 'docs')  # Path to the 'docs' folder two levels up
+    # Export the DataFrame to the 'docs' directory
+    file_path = write_data(df, docs_path(f'data_{control_mode}'), export_format, scenario)
 
-    # Check if the 'docs' folder exists; if not, create it
-    if not os.path.exists(docs_dir):
-        os.makedirs(docs_dir)
+    print(f"File saved at: {file_path}")
+
+    return df
+
+def csv_data_fleet(results, names, buses, export_format='csv', scenario=None, file_path=None):
+    # Arrange the fleet results with one row per time step and DER, and write them to file_path
+    # (without extension; docs/data_fleet by default)
+    npts, n_ders = results['P (pu)'].shape
+
+    # Calculate power factor, negative when absorbing as sent to the PVSystems
+    pf_data = power_factor(results['P (pu)'], results['Q (pu)'])
 
-    # Full path to the CSV file
-    csv_path = os.path.join(docs_dir, f'data_{control_mode}.csv')
+    # Create a DataFrame with the data
+    data = {
+        'Time (s)': np.repeat(results['Time (s)'], n_ders),
+        'DER': np.tile(names, npts),
+        'Bus': np.tile(buses, npts),
+        'Va (pu)': results['Va (pu)'].ravel(),
+        'Vb (pu)': results['Vb (pu)'].ravel(),
+        'Vc (pu)': results['Vc (pu)'].ravel(),
+        'Vm (pu)': results['Vm (pu)'].ravel(),
+        'P (pu)': results['P (pu)'].ravel(),
+        'Q (pu)': results['Q (pu)'].ravel(),
+        'PF': pf_data.ravel(),
+        'Status': results['Status'].ravel()
+    }
 
-    # Export the DataFrame to the CSV file in the 'docs' directory
-    df.to_csv(csv_path, index=False)
+    df = pd.DataFrame(data)
 
-    print(f"File saved at: {csv_path}")
+    # Export the DataFrame, by default to the 'docs' directory
+    if file_path is None:
+        file_path = docs_path('data_fleet')
+    file_path = write_data(df, file_path, export_format, scenario)
 
-def plotter_without_der(bus):
-    # Get the current directory
-    current_dir = os.path.abspath(__file__)
+    print(f"File saved at: {file_path}")
 
-    # Path to the CSV file (adjust as needed)
-    csv_path = os.path.join(current_dir, f'../docs/data_without_der.csv')
+    return df
 
-    # Read the CSV file
-    data = pd.read_csv(csv_path)
+def plotter_without_der(bus, data):
+    # Plot the bus voltages of a simulation without DER from its results DataFrame
+    # Matplotlib is imported on demand so that runs without plots start quickly and without a display
+    import matplotlib.pyplot as plt
 
     plt.figure()
     plt.clf()
-    plt.plot(data['Time (s)'], data['Va (pu)'], label='Va')
-    plt.plot(data['Time (s)'], data['Vb (pu)'], label='Vb')
-    plt.plot(data['Time (s)'], data['Vc (pu)'], label='Vc')
-    plt.plot(data['Time (s)'], data['Vm (pu)'], label='V Mean')
+    # Long runs are drawn from a few points per pixel, chosen again when zooming
+    traces = DownsampledLines(data['Time (s)'])
+    traces.plot(plt.gca(), data['Va (pu)'], label='Va')
+    traces.plot(plt.gca(), data['Vb (pu)'], label='Vb')
+    traces.plot(plt.gca(), data['Vc (pu)'], label='Vc')
+    traces.plot(plt.gca(), data['Vm (pu)'], label='V Mean')
     plt.tick_params(axis='x', labelsize=16)
     plt.tick_params(axis='y', labelsize=16)
     plt.grid(True)
@@ -115,15 +247,11 @@ def plotter_without_der(bus):
     plt.suptitle(f'Voltage at Bus {bus}', fontsize=20, fontweight='bold')
     plt.show()
 
-def plotter_with_der(control_mode, title, der_obj, aux):
-    # Get the current directory
-    current_dir = os.path.abspath(__file__)
-
-    # Path to the CSV file (adjust as needed)
-    csv_path = os.path.join(current_dir, f'../docs/data_{control_mode}.csv')
-
-    # Read the CSV file
-    data = pd.read_csv(csv_path)
+def plotter_with_der(control_mode, title, der_obj, aux, data):
+    # Plot the DER results DataFrame of a simulation
+    # Matplotlib and Tkinter are imported on demand so that runs without plots start quickly and without a display
+    import matplotlib.pyplot as plt
+    from tkinter import Label, Entry, Button, Toplevel
 
     # Create a figure and axes with subplots in 2 columns
     fig, axs = plt.subplots(3, 2, figsize=(15, 20), sharex='col')
@@ -133,27 +261,30 @@ def plotter_with_der(control_mode, title, der_obj, aux):
     for ax in axs.flat:
         ax.grid(True)
 
+    # Long runs are drawn from a few points per pixel, chosen again when zooming
+    traces = DownsampledLines(data['Time (s)'])
+
     # First column - Voltages and Currents
-    axs[0, 0].plot(data['Time (s)'], data['Va (pu)'], label='Va')
-    axs[0, 0].plot(data['Time (s)'], data['Vb (pu)'], label='Vb')
-    axs[0, 0].plot(data['Time (s)'], data['Vc (pu)'], label='Vc')
-    axs[0, 0].plot(data['Time (s)'], data['Vm (pu)'], label='V Mean')
+    traces.plot(axs[0, 0], data['Va (pu)'], label='Va')
+    traces.plot(axs[0, 0], data['Vb (pu)'], label='Vb')
+    traces.plot(axs[0, 0], data['Vc (pu)'], label='Vc')
+    traces.plot(axs[0, 0], data['Vm (pu)'], label='V Mean')
     axs[0, 0].set_ylabel('Voltage (pu)', fontsize=16)
     axs[0, 0].legend(fontsize=11)
     axs[0, 0].tick_params(axis='x', length=20)
     axs[0, 0].tick_params(axis='y', labelsize=12)
 
-    axs[1, 0].plot(data['Time (s)'], data['Ia (pu)'], label='Ia')
-    axs[1, 0].plot(data['Time (s)'], data['Ib (pu)'], label='Ib')
-    axs[1, 0].plot(data['Time (s)'], data['Ic (pu)'], label='Ic')
+    traces.plot(axs[1, 0], data['Ia (pu)'], label='Ia')
+    traces.plot(axs[1, 0], data['Ib (pu)'], label='Ib')
+    traces.plot(axs[1, 0], data['Ic (pu)'], label='Ic')
     axs[1, 0].set_ylabel('Current (pu)', fontsize=16)
     axs[1, 0].legend(fontsize=11)
     axs[1, 0].tick_params(axis='x', length=20)
     axs[1, 0].tick_params(axis='y', labelsize=12)
 
-    axs[2, 0].plot(data['Time (s)'], data['Ia Angle (rad)'], label='Ia Angle')
-    axs[2, 0].plot(data['Time (s)'], data['Ib Angle (rad)'], label='Ib Angle')
-    axs[2, 0].plot(data['Time (s)'], data['Ic Angle (rad)'], label='Ic Angle')
+    traces.plot(axs[2, 0], data['Ia Angle (rad)'], label='Ia Angle')
+    traces.plot(axs[2, 0], data['Ib Angle (rad)'], label='Ib Angle')
+    traces.plot(axs[2, 0], data['Ic Angle (rad)'], label='Ic Angle')
     axs[2, 0].set_xlabel('Time (s)', fontsize=16)
     axs[2, 0].set_ylabel('Current Angle (rad)', fontsize=16)
     axs[2, 0].legend(fontsize=11)
@@ -165,8 +296,8 @@ def plotter_with_der(control_mode, title, der_obj, aux):
     ax1 = axs[0, 1]
     ax2 = ax1.twinx()
     # Plot P and Q on the primary axis (ax1) and Q on the secondary axis (ax2)
-    ax1.plot(data['Time (s)'], data['P (pu)'], label='Active Power')
-    ax2.plot(data['Time (s)'], data['Q (pu)'], color='#ff7f0e', label='Reactive Power')
+    traces.plot(ax1, data['P (pu)'], label='Active Power')
+    traces.plot(ax2, data['Q (pu)'], color='#ff7f0e', label='Reactive Power')
     ax1.set_ylabel('Active Power (pu)', fontsize=16)  # Active Power with left axis
     ax2.set_ylabel('Reactive Power (pu)', fontsize=16)  # Reactive Power with right axis
     # Combine legends from both axes
@@ -177,12 +308,16 @@ def plotter_with_der(control_mode, title, der_obj, aux):
     ax1.tick_params(axis='y', labelsize=12)
     ax2.tick_params(axis='y', labelsize=12)
 
-    axs[1, 1].plot(data['Time (s)'], data['PF'])
+    traces.plot(axs[1, 1], data['PF'])
     axs[1, 1].set_ylabel('Power Factor', fontsize=16)
     axs[1, 1].tick_params(axis='x', length=20)
     axs[1, 1].tick_params(axis='y', labelsize=12)
 
-    axs[2, 1].plot(data['Time (s)'], [s.replace(" ", "\n") for s in data['Status']], label='Status')
+    # Status as integer codes, labelled with the status texts, instead of a categorical axis of every row
+    codes, statuses = status_codes(data['Status'])
+    traces.plot(axs[2, 1], codes, label='Status')
+    axs[2, 1].set_yticks(range(len(statuses)))
+    axs[2, 1].set_yticklabels([status.replace(" ", "\n") for status in statuses])
     axs[2, 1].set_xlabel('Time (s)', fontsize=16)
     axs[2, 1].legend(fontsize=11)
     axs[2, 1].tick_params(axis='x', labelsize=12)
@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+from opender import DER
+import data_export_plot
+import dss_controls
+import dss_session
+import opender_opendss_integration
+
+# Number of units from which read() takes the terminal voltages from the node voltages of the
+# whole circuit: on the 8500-node feeder, reading them costs about as much as activating and
+# reading the terminal of 300 PVSystems
+BATCH_READ_UNITS = 300
+
+def load_fleet(file_path):
+    # Read a fleet definition from a CSV file with one DER per row and the columns
+    # bus, V_rated, control_mode, S_rated (MVA), PF_rated, CONST_Q, normal_op_CAT and abnormal_op_CAT
+    return pd.read_csv(file_path, dtype={'bus': str, 'normal_op_CAT': str, 'abnormal_op_CAT': str}).to_dict('records')
+
+class DERFleet:
+    # Group of DERs, each one modelled by an OpenDER object and an OpenDSS PVSystem. Measurements
+    # and setpoints of the whole fleet are exchanged with OpenDSS as arrays: large fleets take their
+    # terminal voltages from one read of the node voltages of the whole circuit, indexed by unit,
+    # small ones activate each PVSystem by its index, and only the setpoints that changed are
+    # written, in one pass over the fleet.
+    def __init__(self, units):
+        self.units = [dict(unit) for unit in units]
+        self.names = [f'DER_{k + 1}' for k in range(len(self.units))]
+        self.buses = [unit['bus'] for unit in self.units]
+
+        # Ratings of each unit (VA, W, var)
+        self.S_rated = np.array([unit['S_rated'] * 1E6 for unit in self.units])
+        self.PF_rated = np.array([unit['PF_rated'] for unit in self.units])
+        self.P_rated = self.S_rated * self.PF_rated
+        self.Q_rated = np.sqrt(self.S_rated ** 2 - self.P_rated ** 2)
+
+        # Create the OpenDER objects for the selected control modes
+        self.ders = []
+        for k, unit in enumerate(self.units):
+            der_obj, title = opender_opendss_integration.create_der(self.S_rated[k], unit['PF_rated'], unit['V_rated'],
+                                                                    unit['control_mode'], unit.get('CONST_Q'),
+                                                                    unit['normal_op_CAT'], unit['abnormal_op_CAT'])
+            self.ders.append(der_obj)
+
+        # Measurements of the present step: phase voltages (V), angles (rad) and delivered power (kW, kvar)
+        self.V = np.zeros((len(self.units), 3))
+        self.Theta = np.zeros((len(self.units), 3))
+        self.P = np.zeros(len(self.units))
+        self.Q = np.zeros(len(self.units))
+
+        # Last setpoints written to each PVSystem
+        self.pf = np.full(len(self.units), np.nan)
+        self.kvar = np.full(len(self.units), np.nan)
+
+    def define(self, session):
+        # Add one PVSystem per unit and look up its index in the OpenDSS PVSystem list
+        for k, unit in enumerate(self.units):
+            session.define(f'PVSystem.{self.names[k]}',
+                           f"phases=3 bus1={unit['bus']} kV={unit['V_rated']} kva={self.S_rated[k] / 1000} "
+                           f"kvar={self.Q_rated[k] / 1000} Pmpp={self.S_rated[k] / 1000} PF={self.PF_rated[k] / 1000} "
+                           'irradiance=0.98 %cutin=0.1 %cutout=0.1 effcurve=Eff P-TCurve=PvsT daily=Irrad Tdaily=Temp')
+
+        self.controls = dss_controls.FeederControls(session.dss, self.names)
+
+        # Position of the three phase nodes of each unit's bus in the node voltages of the circuit,
+        # for read(). Fleets with a unit on a bus without the three phases read each PVSystem instead.
+        self.nodes = None
+        if len(self.units) >= BATCH_READ_UNITS:
+            node_order = {node.lower(): k for k, node in enumerate(session.dss.circuit.y_node_order)}
+            nodes = [[node_order.get(f"{bus.split('.')[0].lower()}.{phase}") for phase in (1, 2, 3)]
+                     for bus in self.buses]
+            if all(None not in unit_nodes for unit_nodes in nodes):
+                self.nodes = np.array(nodes)
+
+        self.pf[:] = np.nan
+        self.kvar[:] = np.nan
+
+    def read(self, dss, powers=True):
+        # Read the present step's terminal voltages of every unit and, with powers, their delivered
+        # powers. The powers are only available from each PVSystem, so they are read with the voltages
+        # of its terminal; without them, a large fleet indexes the node voltages of the whole circuit.
+        n_units = len(self.units)
+        if not powers and self.nodes is not None:
+            voltages = np.asarray(dss.circuit.y_node_varray)
+            voltages = (voltages[0::2] + 1j * voltages[1::2])[self.nodes]
+            self.V[:] = np.abs(voltages)
+            self.Theta[:] = np.angle(voltages)
+            return
+
+        v_mag_ang = np.empty((n_units, 6))
+        for k, name in enumerate(self.names):
+            self.controls.activate_pv(name)
+            v_mag_ang[k] = dss.cktelement.voltages_mag_ang[:6]
+            if powers:
+                # Element powers are positive into the terminal, so generation is negative
+                self.P[k], self.Q[k] = np.negative(dss.cktelement.total_powers[:2])
+
+        self.V[:] = v_mag_ang[:, 0::2]
+        self.Theta[:] = np.deg2rad(v_mag_ang[:, 1::2])
+
+    def write(self, dss, pf, kvar):
+        # Send the new power factor and reactive power setpoints to the PVSystems whose values changed.
+        # OpenDSS has no array setter for PVSystems, so each changed unit is written by its index.
+        changed = np.flatnonzero((pf != self.pf) | (kvar != self.kvar))
+        for k in changed:
+            self.controls.set_pv(self.names[k], pf[k], kvar[k])
+
+        self.pf[changed] = pf[changed]
+        self.kvar[changed] = kvar[changed]
+
+def fleet_feeder(simulation_time, number_steps, npts, units, session=None, export=True, export_format='csv',
+                 file_path=None, step_callback=None):
+    # Co-simulate a fleet of DERs on the 8500-node feeder and return the results as arrays
+    # with one row per time step and one column per DER. With export, they are written to
+    # file_path (see data_export_plot.csv_data_fleet()). step_callback(i, npts, sample) is called
+    # after every point with the time of the point, as the progress callback of run_scenario().
+    fleet = DERFleet(units)
+    n_ders = len(fleet.units)
+
+    # Prepare arrays for storing simulation results
+    t_data = np.zeros(npts)
+    vm_data = np.zeros((npts, n_ders))
+    va_data = np.zeros((npts, n_ders))
+    vb_data = np.zeros((npts, n_ders))
+    vc_data = np.zeros((npts, n_ders))
+    p_data = np.zeros((npts, n_ders))
+    q_data = np.zeros((npts, n_ders))
+    status_data = np.empty((npts, n_ders), dtype=object)
+    p_meas = np.zeros((npts, n_ders))
+    q_meas = np.zeros((npts, n_ders))
+
+    # Compile the feeder, or bring an already compiled session back to its baseline
+    if session is None:
+        session = dss_session.FeederSession()
+    else:
+        session.reset()
+    dss = session.dss
+
+    # Time step and load multiplier for each point of the simulation
+    t_s, per_load = opender_opendss_integration.load_profile(simulation_time, number_steps, npts)
+    DER.t_s = t_s
+
+    # Define irradiance and temperature profiles and the PV systems
+    opender_opendss_integration.define_der_profiles(session, number_steps, npts, t_s)
+    fleet.define(session)
+
+    # Set simulation mode to daily and configure step size
+    dss.text('set mode=daily')
+    dss.text(f'set stepsize={t_s / 3600}h')
+    dss.text('set number=1')
+
+    pf = np.zeros(n_ders)
+    kvar = np.zeros(n_ders)
+    for i in range(npts):
+        # Set load condition based on per_load data
+        fleet.controls.set_load_mult(per_load[i])
+
+        # Solve the simulation
+        dss.solution.solve()
+
+        # Read the measurements of the whole fleet; the delivered powers are only needed for the
+        # results of the steady-state (24-hour) simulation
+        fleet.read(dss, powers=number_steps == 0)
+        p_meas[i] = fleet.P
+        q_meas[i] = fleet.Q
+
+        # Run every DER with its own measurements
+        for k, der_obj in enumerate(fleet.ders):
+            p_dc_w = opender_opendss_integration.der_dc_power(der_obj, fleet.P_rated[k], i, npts, number_steps)
+            der_obj.update_der_input(v=fleet.V[k].tolist(), theta=fleet.Theta[k].tolist(), p_dc_w=p_dc_w)
+            der_obj.run()
+
+            p_data[i, k] = der_obj.p_out_pu
+            q_data[i, k] = der_obj.q_out_pu
+            kvar[k] = der_obj.q_out_kvar
+            vm_data[i, k] = der_obj.der_input.v_meas_pu
+            va_data[i, k] = der_obj.der_input.v_a_pu
+            vb_data[i, k] = der_obj.der_input.v_b_pu
+            vc_data[i, k] = der_obj.der_input.v_c_pu
+            status_data[i, k] = der_obj.der_status
+
+        # Update the PV system settings
+        pf[:] = dss_controls.power_factor(p_data[i], q_data[i])
+        fleet.write(dss, pf, kvar)
+
+        t_data[i] = i * t_s
+
+        if step_callback is not None:
+            step_callback(i, npts, {'t': t_data[i]})
+
+    if number_steps == 0:
+        # If number_steps is zero, compute results from steady-state simulation
+        p_data = 1000 * p_meas / fleet.S_rated
+        q_data = 1000 * q_meas / fleet.S_rated
+
+    results = {
+        'Time (s)': t_data,
+        'Va (pu)': va_data,
+        'Vb (pu)': vb_data,
+        'Vc (pu)': vc_data,
+        'Vm (pu)': vm_data,
+        'P (pu)': p_data,
+        'Q (pu)': q_data,
+        'Status': status_data
+    }
+
+    # Export data to the selected format
+    if export:
+        scenario = {'simulation_time': simulation_time, 'number_steps': number_steps, 'npts': npts, 'units': fleet.units}
+        data_export_plot.csv_data_fleet(results, fleet.names, fleet.buses, export_format, scenario, file_path)
+
+    return results
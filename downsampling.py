@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Points kept per pixel column of the axes: the first, lowest, highest and last point of each column,
+# so the drawn line covers the same pixels as the full trace. Ranges with fewer points than this per
+# pixel are drawn in full.
+POINTS_PER_PIXEL = 4
+
+def min_max_indices(x, y, buckets, x_range=None):
+    # Indices of the points of y (over x, increasing) to draw in buckets pixel columns: the first,
+    # last, lowest and highest point of each column of x_range (default: all of x), plus one point
+    # on each side of the range so the line continues to the edges of the axes
+    start, stop = 0, len(x)
+    if x_range is not None:
+        start = max(np.searchsorted(x, x_range[0], 'left') - 1, 0)
+        stop = min(np.searchsorted(x, x_range[1], 'right') + 1, len(x))
+    if stop - start <= POINTS_PER_PIXEL * buckets:
+        return np.arange(start, stop)
+
+    # Columns of equal width in x; columns without points are left out
+    x_view = x[start:stop]
+    y_view = y[start:stop]
+    edges = np.searchsorted(x_view, np.linspace(x_view[0], x_view[-1], buckets + 1)[:-1], 'left')
+    starts = np.unique(edges)
+    ends = np.append(starts[1:], len(x_view)) - 1
+    column = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(x_view))))
+
+    # First point of each column at its lowest and highest value (none where the column has a NaN)
+    lowest = np.flatnonzero(y_view == np.minimum.reduceat(y_view, starts)[column])
+    highest = np.flatnonzero(y_view == np.maximum.reduceat(y_view, starts)[column])
+    lowest = lowest[np.unique(column[lowest], return_index=True)[1]]
+    highest = highest[np.unique(column[highest], return_index=True)[1]]
+
+    return start + np.unique(np.concatenate([starts, ends, lowest, highest]))
+
+def status_codes(status):
+    # Integer code of each DER status and the status texts, in the order they first appear, from the
+    # Status column of the results (text, or a Categorical as recorded by feeder())
+    codes, categories = pd.factorize(status)
+    return codes, [str(category) for category in categories]
+
+class DownsampledLines:
+    # Lines over the same x values (e.g. the time of a simulation) drawn from a few points per pixel
+    # column, chosen by min_max_indices() so the shape of each trace is kept. The lines are
+    # downsampled again for the visible range each time the x limits of their axes change (zoom,
+    # pan), so plots of millions of points stay responsive and still show every detail when zoomed.
+    def __init__(self, x):
+        self.x = np.asarray(x)
+        self.lines = []  # (line, y) of every line drawn
+        self.axes = []  # Axes whose x limits are watched
+
+    def plot(self, ax, y, *args, **kwargs):
+        # Draw y over x on ax (same arguments as ax.plot()) and return the line
+        y = np.asarray(y)
+        indices = min_max_indices(self.x, y, self.buckets(ax))
+        line, = ax.plot(self.x[indices], y[indices], *args, **kwargs)
+        self.lines.append((line, y))
+        if ax not in self.axes:
+            self.axes.append(ax)
+            # Matplotlib keeps bound methods as weak references; the function keeps the lines alive
+            # as long as the axes
+            ax.callbacks.connect('xlim_changed', lambda ax: self.update(ax))
+        return line
+
+    @staticmethod
+    def buckets(ax):
+        # Pixel columns of the axes
+        return max(int(ax.bbox.width), 1)
+
+    def update(self, ax):
+        # Downsample again the lines of ax and of the axes sharing its x axis for their new x limits
+        x_range = sorted(ax.get_xlim())
+        shared = ax.get_shared_x_axes()
+        for line, y in self.lines:
+            if line.axes is ax or shared.joined(ax, line.axes):
+                indices = min_max_indices(self.x, y, self.buckets(line.axes), x_range)
+                line.set_data(self.x[indices], y[indices])
@@ -0,0 +1,60 @@
+import numpy as np
+
+def power_factor(p, q):
+    # Power factor of an output (p, q), with the sign of OpenDSS: negative when reactive power is
+    # absorbed. It is 0 where there is reactive power without active power, which a power factor
+    # cannot express (see FeederControls.set_pv()). A unity power factor keeps its sign whatever
+    # the round-off of q.
+    p, q = np.asarray(p, dtype=np.float64), np.asarray(q, dtype=np.float64)
+    pf = np.where(p > 0, np.cos(np.arctan2(q, np.maximum(p, 0))), np.where(q == 0, 1.0, 0.0))
+    return np.where((q < 0) & (pf < 1), -pf, pf)
+
+class FeederControls:
+    # Typed fast path for the settings changed at every point of a simulation: the load multiplier,
+    # the PVSystem power factor and reactive power, and the activation of the PVSystem whose terminal
+    # is read. They go straight through the OpenDSS API instead of the text command parser, and each
+    # PVSystem is activated by its index in the PVSystem list, looked up once, instead of by name or
+    # by relying on the element left active by a previous call. Text commands are kept for the setup.
+    #
+    # The typed PVSystems.kvar setter is ignored by OpenDSS, so the power factor sets the output of
+    # the PVSystem. Text commands are only used where the typed setter falls short: a DER with
+    # reactive but no active power needs its kvar, written with an Edit command (a power factor of
+    # 0 makes the solution fail), after which the PVSystem ignores the typed power factor until one
+    # is written with an Edit command again; and the typed power factor only takes effect at the
+    # next time step, so a point solved again with new setpoints needs them edited.
+    def __init__(self, dss, pv_names=()):
+        self.dss = dss
+
+        # Index (1-based) of each controlled PVSystem in the OpenDSS PVSystem list
+        all_names = [name.lower() for name in dss.pvsystems.names]
+        self.pv_index = {name.lower(): all_names.index(name.lower()) + 1 for name in pv_names}
+
+        # PVSystems left at a kvar setpoint by set_pv()
+        self.kvar_mode = set()
+
+    def set_load_mult(self, value):
+        self.dss.solution.load_mult = float(value)
+
+    def activate_pv(self, name):
+        # Make the PVSystem both the active PVSystem and the active circuit element
+        self.dss.pvsystems.idx = self.pv_index[name.lower()]
+
+    def set_pv(self, name, pf, kvar, immediate=False):
+        # Write the setpoints of a PVSystem: the power factor (negative when absorbing, see
+        # power_factor()) or, when it is 0, the reactive power in kvar. With immediate, they already apply to the present point when
+        # it is solved again (solve_no_control()).
+        key = name.lower()
+        if pf == 0:
+            self.dss.text(f'Edit PVSystem.{name} kvar={float(kvar)!r}')
+            self.kvar_mode.add(key)
+        elif immediate or key in self.kvar_mode:
+            self.dss.text(f'Edit PVSystem.{name} pf={float(pf)!r}')
+            self.kvar_mode.discard(key)
+        else:
+            self.activate_pv(name)
+            self.dss.pvsystems.pf = pf
+
+    def set_pv_output(self, name, p_pu, q_pu, kvar, immediate=False):
+        # Setpoints from the per-unit output of an OpenDER object: the power factor of (p_pu, q_pu)
+        # and the reactive power in kvar
+        self.set_pv(name, float(power_factor(p_pu, q_pu)), kvar, immediate)
@@ -0,0 +1,129 @@
+import os
+import pathlib
+import py_dss_interface
+
+class FeederSession:
+    # Long-lived OpenDSS session for the 8500-node feeder. The feeder is compiled and configured
+    # once, its baseline state is recorded, and reset() brings the circuit back to that baseline
+    # so repeated runs skip the compile step.
+    def __init__(self, dss_file=None):
+        if dss_file is None:
+            # Determine the path to the OpenDSS DSS file
+            script_path = os.path.dirname(os.path.abspath(__file__))
+            dss_file = pathlib.Path(script_path).joinpath("feeders", "8500-Node", "Master.dss")
+
+        self.dss_file = dss_file
+
+        # Elements created by simulation runs on top of the baseline circuit
+        self.run_elements = set()
+
+        # Initialize the OpenDSS interface
+        self.dss = py_dss_interface.DSS()
+        self.dss.text(f'compile [{dss_file}]')  # Compile the DSS file
+
+        # Add and configure various elements in the simulation
+        self.dss.text('New Energymeter.m1 Line.ln5815900-1 1')  # Add an energy meter
+        self.dss.text('batchedit capacitor..* enabled=no')      # Disable all capacitors
+        self.dss.text('batchedit load..* mode=1')               # Set load mode
+        self.dss.text('batchedit load..* vmaxpu=1.25')          # Set maximum voltage per unit for loads
+        self.dss.text('batchedit load..* vminpu=0.75')          # Set minimum voltage per unit for loads
+        self.dss.text('set maxiterations=100')                  # Set maximum iterations
+        self.dss.text('set maxcontrolit=100')                    # Set maximum control iterations
+        self.dss.text('AddBusMarker bus=l3104830 color=red size=8 code=15')  # Add a bus marker for visualization
+
+        # Define performance and efficiency curves for the PV system
+        self.dss.text('New XYCurve.PvsT npts=4 xarray=[0 25 75 100] yarray=[1.2 1 .8 .6]')
+        self.dss.text('New XYCurve.Eff npts=4 xarray=[.1 .2 .4 1.0] yarray=[.86 .9 .93 .97]')
+
+        self.snapshot()
+
+    def snapshot(self):
+        # Record the state that simulation runs modify: load setpoints, regulator taps
+        # and capacitor steps
+        self.load_setpoints = []
+        if self.dss.loads.first():
+            while True:
+                self.load_setpoints.append((self.dss.loads.name, self.dss.loads.kw, self.dss.loads.kvar))
+                if not self.dss.loads.next():
+                    break
+
+        # Regulated winding of each regulator with its band (voltage setting and bandwidth on the
+        # 120 V base of the PT ratio), for regulators_in_band()
+        self.regulator_taps = []
+        self.regulator_bands = []
+        if self.dss.regcontrols.first():
+            while True:
+                self.regulator_taps.append((self.dss.regcontrols.transformer, self.dss.regcontrols.winding))
+                self.regulator_bands.append((self.dss.regcontrols.transformer, self.dss.regcontrols.winding,
+                                             self.dss.regcontrols.forward_vreg, self.dss.regcontrols.forward_band,
+                                             self.dss.regcontrols.pt_ratio))
+                if not self.dss.regcontrols.next():
+                    break
+        self.regulator_taps = [(transformer, winding, self.get_tap(transformer, winding))
+                               for transformer, winding in self.regulator_taps]
+
+        # The capacitors are taken by name: first()/next() skip the disabled banks, whose steps the
+        # capacitor controls still switch during a run
+        self.capacitor_states = []
+        for name in self.dss.capacitors.names:
+            self.dss.capacitors.name = name
+            self.capacitor_states.append((name, self.dss.capacitors.states))
+
+    def get_tap(self, transformer, winding):
+        self.dss.transformers.name = transformer
+        self.dss.transformers.wdg = winding
+        return self.dss.transformers.tap
+
+    def regulators_in_band(self):
+        # Whether the regulated voltage of every regulator is within its band in the present
+        # solution, i.e. no regulator will move its tap while the circuit does not change
+        for transformer, winding, vreg, band, pt_ratio in self.regulator_bands:
+            self.dss.circuit.set_active_element(f'Transformer.{transformer}')
+            conductors = self.dss.cktelement.num_conductors
+            voltage = self.dss.cktelement.voltages_mag_ang[2 * conductors * (winding - 1)]
+            if abs(voltage / pt_ratio - vreg) > band / 2:
+                return False
+        return True
+
+    def reset(self):
+        # Return the circuit to the baseline recorded after compilation
+        for name, kw, kvar in self.load_setpoints:
+            self.dss.loads.name = name
+            if self.dss.loads.kw != kw or self.dss.loads.kvar != kvar:
+                self.dss.loads.kw = kw
+                self.dss.loads.kvar = kvar
+
+        for transformer, winding, tap in self.regulator_taps:
+            if self.get_tap(transformer, winding) != tap:
+                self.dss.transformers.tap = tap
+
+        for name, states in self.capacitor_states:
+            self.dss.capacitors.name = name
+            self.dss.capacitors.states = states
+
+        # Take the PV systems and monitors of previous runs out of service
+        for element in self.run_elements:
+            if not element.startswith('loadshape.') and not element.startswith('tshape.'):
+                self.dss.text(f'{element}.enabled=no')
+
+        # Clear recorded data, pending control actions and the solution state
+        self.dss.monitors.reset_all()
+        self.dss.meters.reset_all()
+        self.dss.ctrlqueue.clear_queue()
+        self.dss.text('set mode=snap')
+        self.dss.text('set loadmult=1')
+        self.dss.solution.hour = 0
+        self.dss.solution.seconds = 0
+
+    def define(self, element, properties):
+        # Create the element on its first run and edit it on later runs, so repeated runs
+        # neither duplicate elements nor trigger redefinition warnings
+        key = element.lower()
+        if key in self.run_elements:
+            if key.startswith('loadshape.') or key.startswith('tshape.'):
+                self.dss.text(f'Edit {element} {properties}')
+            else:
+                self.dss.text(f'Edit {element} enabled=yes {properties}')
+        else:
+            self.dss.text(f'New {element} {properties}')
+            self.run_elements.add(key)
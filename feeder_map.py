@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import bus_index
+import data_export_plot
+import result_cache
+from branch_loading import BranchLoading
+from feeder_snapshots import FeederSnapshots, bus_starts
+
+# Power flow (kW) drawn with the widest line, and widths (points) of the lines without and with that
+# flow, as in "plot circuit Power max=2000" of DSSView
+MAX_KW = 2000.0
+MIN_WIDTH = 1.0
+MAX_WIDTH = 7.0
+
+# Voltages (pu) at the ends of the color scale: ANSI C84.1 range A, the limits of hosting_capacity.py
+V_MIN = 0.95
+V_MAX = 1.05
+
+class FeederMap:
+    # Map of the lines and transformers of the feeder, drawn with matplotlib without a display. The
+    # geometry (a segment between the two buses of each element, in the order of
+    # branch_loading.BranchLoading) is built once from a compiled session and kept by cached() in
+    # 'docs/feeder_map', so maps of recordings are drawn without compiling the feeder. The figure and
+    # its line collection are created on the first draw(); later frames only set the widths and
+    # colors of the lines. Elements with a bus without coordinates are left out of the map.
+    def __init__(self, elements, buses, x, y, bus1, bus2):
+        self.elements = np.asarray(elements, dtype=str)
+        self.buses = np.asarray(buses, dtype=str)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.bus1 = np.asarray(bus1, dtype=np.int64)
+        self.bus2 = np.asarray(bus2, dtype=np.int64)
+
+        located = ~np.isnan(self.x) & ~np.isnan(self.y)
+        self.drawn = np.flatnonzero((self.bus1 >= 0) & (self.bus2 >= 0) & located[self.bus1] & located[self.bus2])
+        bus1, bus2 = self.bus1[self.drawn], self.bus2[self.drawn]
+        self.segments = np.stack([np.column_stack([self.x[bus1], self.y[bus1]]),
+                                  np.column_stack([self.x[bus2], self.y[bus2]])], axis=1)
+
+        self.branches = None  # branch_loading.BranchLoading of a session, for the power flows
+        self.figure = None
+        self.collection = None
+        self.colorbar = None
+
+    @classmethod
+    def from_session(cls, session):
+        # Geometry of the lines and transformers of a compiled feeder session
+        dss = session.dss
+        index = bus_index.BusIndex.cached(session)
+        branches = BranchLoading(dss, [transformer for transformer, winding, tap in session.regulator_taps])
+        bus1 = []
+        bus2 = []
+        for name in branches.names:
+            dss.circuit.set_active_element(name)
+            buses = [bus.split('.')[0] for bus in dss.cktelement.bus_names]
+            bus1.append(buses[0])
+            bus2.append(buses[-1])
+        feeder_map = cls(branches.names, index.names, index.x, index.y, index.lookup(bus1), index.lookup(bus2))
+        feeder_map.branches = branches
+        return feeder_map
+
+    def save(self, file_path):
+        # Uncompressed NPZ file, written under a temporary name and then renamed
+        tmp_path = f'{file_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, elements=self.elements, buses=self.buses, x=self.x, y=self.y, bus1=self.bus1, bus2=self.bus2)
+        os.replace(tmp_path, file_path)
+        print(f"File saved at: {file_path}")
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(data['elements'], data['buses'], data['x'], data['y'], data['bus1'], data['bus2'])
+
+    @classmethod
+    def cached(cls, session=None, dss_file=None):
+        # Map of the session's feeder (the default feeder without session), built once from a compiled
+        # session and then reused while the feeder scripts do not change. Without session, a feeder
+        # that was never mapped is compiled. The power flows (show_power()) need the session.
+        if session is not None:
+            dss_file = session.dss_file
+
+        cache_dir = data_export_plot.docs_path('feeder_map')
+        os.makedirs(cache_dir, exist_ok=True)
+
+        feeder = {name: digest for name, digest in result_cache.feeder_fingerprint(dss_file).items()
+                  if not name.endswith('.py')}
+        content = {'feeder': feeder, 'code': result_cache.cached_digest(os.path.abspath(__file__))}
+        key = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+        file_path = os.path.join(cache_dir, f'{key}.npz')
+        if os.path.exists(file_path) and session is None:
+            return cls.load(file_path)
+
+        if session is None:
+            import dss_session
+            session = dss_session.FeederSession(dss_file)
+        if os.path.exists(file_path):
+            # The geometry is read from the cache, only the admittances come from the session
+            feeder_map = cls.load(file_path)
+            feeder_map.branches = BranchLoading(session.dss, [transformer for transformer, winding, tap
+                                                              in session.regulator_taps])
+            return feeder_map
+
+        feeder_map = cls.from_session(session)
+        feeder_map.save(file_path)
+        return feeder_map
+
+    def draw(self, widths=None, values=None, color='blue', cmap='coolwarm', vmin=None, vmax=None, label='',
+             title=''):
+        # Draw the map with one line width (points) and one value to color (or the single color) per
+        # element, in the order of elements, and return the figure. The figure is created on the first
+        # call and updated afterwards.
+        if self.figure is None:
+            # The figure is not managed by pyplot, so maps are drawn without a display
+            from matplotlib.collections import LineCollection
+            from matplotlib.figure import Figure
+
+            self.figure = Figure(figsize=(10, 10))
+            ax = self.figure.add_subplot()
+            self.collection = LineCollection(self.segments, capstyle='round')
+            ax.add_collection(self.collection)
+            ax.autoscale_view()
+            ax.set_aspect('equal')
+            ax.set_axis_off()
+
+        if widths is None:
+            self.collection.set_linewidths(MIN_WIDTH)
+        else:
+            self.collection.set_linewidths(np.asarray(widths)[self.drawn])
+
+        if values is None:
+            self.collection.set_array(None)
+            self.collection.set_color(color)
+        else:
+            self.collection.set_array(np.asarray(values)[self.drawn])
+            self.collection.set_cmap(cmap)
+            self.collection.set_clim(vmin, vmax)
+            if self.colorbar is None:
+                self.colorbar = self.figure.colorbar(self.collection, ax=self.figure.axes[0], shrink=0.6)
+            self.colorbar.set_label(label)
+
+        self.figure.axes[0].set_title(title)
+        return self.figure
+
+    def power_widths(self, powers, max_kw=MAX_KW):
+        # Line width of each element for its power flow (kW + j kvar, as BranchLoading.powers())
+        return MIN_WIDTH + (MAX_WIDTH - MIN_WIDTH) * np.clip(np.abs(np.real(powers)) / max_kw, 0, 1)
+
+    def element_voltages(self, bus_voltages):
+        # Voltage of each element (the lowest voltage of its first bus), from one value per bus
+        # in the order of buses
+        return np.asarray(bus_voltages)[self.bus1]
+
+    def show_power(self, dss, max_kw=MAX_KW, color='blue', title=''):
+        # Draw the active power flow of the present solution as the width of the lines
+        return self.draw(self.power_widths(self.branches.powers(dss), max_kw), color=color, title=title)
+
+    def show_voltage(self, dss, v_min=V_MIN, v_max=V_MAX, title=''):
+        # Draw the voltage of the present solution as the color of the lines and the power flow as their width
+        voltages = np.asarray(dss.circuit.buses_vmag_pu)
+        bus_voltages = np.minimum.reduceat(np.where(voltages > 0, voltages, np.inf),
+                                           bus_starts(np.array(dss.circuit.nodes_names))[:-1])
+        return self.draw(self.power_widths(self.branches.powers(dss)),
+                         self.element_voltages(np.where(np.isinf(bus_voltages), 0, bus_voltages)),
+                         vmin=v_min, vmax=v_max, label='Voltage (pu)', title=title)
+
+    def show_snapshot(self, snapshots, row, loading=False, v_min=V_MIN, v_max=V_MAX):
+        # Draw a point of a feeder_snapshots.FeederSnapshots recording with the voltages as the color of
+        # the elements or, with loading (recorded with lines), the loadings up to the rating
+        if not np.array_equal(np.char.lower(snapshots.buses), np.char.lower(self.buses)):
+            raise ValueError('The recording is not of the mapped feeder')
+        title = f't = {snapshots.t[row]:g} s'
+        if loading:
+            if not len(snapshots.elements):
+                raise ValueError('The loadings of the lines were not recorded')
+            loadings = np.zeros(len(self.elements))
+            ids = {name.lower(): k for k, name in enumerate(snapshots.elements.tolist())}
+            recorded = np.array([ids.get(name.lower(), -1) for name in self.elements.tolist()])
+            loadings[recorded >= 0] = snapshots.loadings[row, recorded[recorded >= 0]]
+            return self.draw(values=loadings, cmap='YlOrRd', vmin=0, vmax=1, label='Loading', title=title)
+        v_max_bus, v_min_bus = snapshots.bus_extremes(slice(row, row + 1))
+        return self.draw(values=self.element_voltages(v_min_bus[0]), vmin=v_min, vmax=v_max, label='Voltage (pu)',
+                         title=title)
+
+    def save_figure(self, file_path, dpi=100):
+        self.figure.savefig(file_path, dpi=dpi)
+        print(f"File saved at: {file_path}")
+
+    def animate(self, snapshots, file_path, rows=None, loading=False, fps=5, dpi=80):
+        # Write the points of a recording (every point by default) as an animated GIF
+        from matplotlib.animation import PillowWriter
+
+        if rows is None:
+            rows = range(snapshots.rows)
+        writer = PillowWriter(fps=fps)
+        self.show_snapshot(snapshots, rows[0], loading)  # The writer takes the size of the figure
+        with writer.saving(self.figure, file_path, dpi):
+            for row in rows:
+                self.show_snapshot(snapshots, row, loading)
+                writer.grab_frame()
+        print(f"File saved at: {file_path}")
+
+def plot_circuit(session, file_path=None, max_kw=MAX_KW):
+    # Map of the power flows of the present solution of a session, written to file_path (by default
+    # feeder_map.png in 'docs'); replaces "plot circuit Power max=2000" of DSSView
+    if file_path is None:
+        file_path = data_export_plot.docs_path('feeder_map.png')
+    feeder_map = FeederMap.cached(session)
+    feeder_map.show_power(session.dss, max_kw, title='Power flow')
+    feeder_map.save_figure(file_path)
+    return file_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Draw maps of the feeder: the power flow and voltages of a solution, '
+                                                 'or the points of a recording of run_batch.py --snapshots.')
+    parser.add_argument('-o', '--output', default='feeder_map.png',
+                        help='image file of the map, or a .gif file for the points of a recording '
+                             '(default: feeder_map.png)')
+    parser.add_argument('--snapshots', default=None,
+                        help='recording of the feeder voltages to draw instead of a solution')
+    parser.add_argument('--every', type=int, default=1,
+                        help='draw one point of the recording out of this number (default: 1)')
+    parser.add_argument('--row', type=int, default=None,
+                        help='single point of the recording to draw to an image')
+    parser.add_argument('--loading', action='store_true',
+                        help='color the lines of the recording by their loading instead of the voltage '
+                             '(recorded with --snapshots lines)')
+    parser.add_argument('--load-mult', type=float, default=1.0,
+                        help='load multiplier of the solution (default: 1.0)')
+    parser.add_argument('--voltage', action='store_true',
+                        help='color the lines by voltage (default: the power flow only)')
+    parser.add_argument('--max-kw', type=float, default=MAX_KW,
+                        help=f'power flow drawn with the widest line (default: {MAX_KW:g} kW)')
+    args = parser.parse_args()
+
+    # Paths are resolved before OpenDSS changes the working directory to the feeder folder
+    output = os.path.abspath(args.output)
+    start = time.perf_counter()
+
+    if args.snapshots is not None:
+        snapshots = FeederSnapshots.load(os.path.abspath(args.snapshots))
+        feeder_map = FeederMap.cached()
+        if args.row is not None or not output.lower().endswith('.gif'):
+            feeder_map.show_snapshot(snapshots, args.row or 0, args.loading)
+            feeder_map.save_figure(output)
+        else:
+            feeder_map.animate(snapshots, output, range(0, snapshots.rows, args.every), args.loading)
+    else:
+        import dss_session
+        session = dss_session.FeederSession()
+        session.dss.solution.load_mult = args.load_mult
+        session.dss.solution.solve()
+        feeder_map = FeederMap.cached(session)
+        if args.voltage:
+            feeder_map.show_voltage(session.dss, title=f'Load multiplier {args.load_mult:g}')
+        else:
+            feeder_map.show_power(session.dss, args.max_kw, title=f'Load multiplier {args.load_mult:g}')
+        feeder_map.save_figure(output)
+
+    print(f"{len(feeder_map.drawn)} of {len(feeder_map.elements)} lines and transformers drawn in "
+          f"{time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
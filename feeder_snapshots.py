@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from branch_loading import BranchLoading
+
+def bus_starts(nodes):
+    # Column of the first node of each bus, and the number of nodes at the end, for node names
+    # ('bus.node') grouped by bus
+    bus_of_node = np.char.lower(np.char.partition(nodes, '.')[:, 0])
+    return np.append(np.flatnonzero(np.append(True, bus_of_node[1:] != bus_of_node[:-1])), len(nodes))
+
+class FeederSnapshots:
+    # Voltage magnitude (pu) of every node of the feeder at each point of a simulation and, with
+    # lines, the loading of every line and transformer (highest conductor current over its normal
+    # rating, see branch_loading.BranchLoading), filled by feeder() when passed as snapshots=.
+    # Each point is one row of float32 values read from the whole circuit at once, written to a
+    # memory-mapped file_path as the simulation runs; the node, bus and element names, the time of
+    # each row and the row count are written to file_path + '.json' on close(). Nodes are stored in
+    # the order of the circuit, where the nodes of each bus are contiguous, so the voltages of a bus
+    # are a slice of the columns. FeederSnapshots.load() opens a recording read-only.
+    def __init__(self, file_path, lines=False):
+        # The path is resolved now, before OpenDSS changes the working directory to the feeder folder
+        self.file_path = os.path.abspath(file_path)
+        self.lines = lines
+        self.nodes = np.zeros(0, dtype=str)
+        self.buses = np.zeros(0, dtype=str)
+        self.bus_start = np.zeros(1, dtype=np.int64)
+        self.elements = np.zeros(0, dtype=str)
+        self.t = np.zeros(0)
+        self.data = np.zeros((0, 0), dtype=np.float32)
+        self.rows = 0
+        self.branches = None
+
+    def begin(self, session, npts):
+        # Take the nodes, buses and elements of a compiled session and allocate the file for npts points
+        dss = session.dss
+        self.nodes = np.array(dss.circuit.nodes_names)
+        self.buses = np.array(dss.circuit.buses_names)
+        self.bus_start = bus_starts(self.nodes)
+        if len(self.bus_start) != len(self.buses) + 1:
+            raise ValueError('The nodes of the circuit are not grouped by bus')
+
+        if self.lines:
+            # The admittances of the regulators are read again at every point, as their taps move
+            self.branches = BranchLoading(dss, [transformer for transformer, winding, tap in session.regulator_taps])
+            self.elements = self.branches.names
+
+        self.t = np.zeros(npts)
+        self.data = np.memmap(self.file_path, dtype=np.float32, mode='w+',
+                              shape=(max(npts, 1), len(self.nodes) + len(self.elements)))
+        self.rows = 0
+
+    def record(self, dss, t):
+        # Store the voltages (and loadings) of the present solution as the row of time t (s)
+        self.data[self.rows, :len(self.nodes)] = dss.circuit.buses_vmag_pu
+        if self.branches is not None:
+            self.data[self.rows, len(self.nodes):] = self.branches.loading(dss)
+        self.t[self.rows] = t
+        self.rows += 1
+
+    def repeat(self, t):
+        # Store the last row again for a point that was not solved (steady points of adaptive runs)
+        self.data[self.rows] = self.data[self.rows - 1]
+        self.t[self.rows] = t
+        self.rows += 1
+
+    def close(self):
+        # Write the rows to disk and the description of the file
+        self.data.flush()
+        with open(self.file_path + '.json', 'w') as f:
+            json.dump({'rows': self.rows, 'nodes': self.nodes.tolist(), 'buses': self.buses.tolist(),
+                       'elements': self.elements.tolist(), 't': self.t[:self.rows].tolist()}, f)
+        self.data = self.data[:self.rows]
+        print(f"File saved at: {self.file_path}")
+
+    @classmethod
+    def load(cls, file_path):
+        # Open a recording written by close(), memory-mapped read-only
+        with open(file_path + '.json', 'r') as f:
+            description = json.load(f)
+
+        snapshots = cls(file_path, bool(description['elements']))
+        snapshots.nodes = np.array(description['nodes'])
+        snapshots.buses = np.array(description['buses'])
+        snapshots.bus_start = bus_starts(snapshots.nodes)
+        snapshots.elements = np.array(description['elements'])
+        snapshots.t = np.array(description['t'])
+        snapshots.rows = description['rows']
+        width = len(snapshots.nodes) + len(snapshots.elements)
+        if snapshots.rows == 0:
+            snapshots.data = np.zeros((0, width), dtype=np.float32)
+        else:
+            snapshots.data = np.memmap(snapshots.file_path, dtype=np.float32, mode='r', shape=(snapshots.rows, width))
+        return snapshots
+
+    @property
+    def voltages(self):
+        # Node voltages (pu), one row per point and one column per node
+        return self.data[:self.rows, :len(self.nodes)]
+
+    @property
+    def loadings(self):
+        # Loading of the lines and transformers, one row per point and one column per element
+        return self.data[:self.rows, len(self.nodes):]
+
+    def bus(self, name):
+        # Voltages (pu) of the nodes of a bus, one column per node
+        k = self.bus_id(name)
+        return self.voltages[:, self.bus_start[k]:self.bus_start[k + 1]]
+
+    def bus_id(self, name):
+        # Position of a bus (a name with nodes, e.g. 'l3104830.1.2.3', is taken by its bus)
+        ids = np.flatnonzero(np.char.lower(self.buses) == name.split('.')[0].lower())
+        if len(ids) == 0:
+            raise KeyError(f'Bus {name} is not in the recording')
+        return ids[0]
+
+    def loading(self, element):
+        # Loading of a line or transformer (e.g. 'Line.ln5815900-1') at each point
+        ids = np.flatnonzero(np.char.lower(self.elements) == element.lower())
+        if len(ids) == 0:
+            raise KeyError(f'{element} is not in the recording')
+        return self.loadings[:, ids[0]]
+
+    def bus_extremes(self, rows=slice(None)):
+        # Highest and lowest node voltage of each bus at the selected points, one column per bus.
+        # Nodes without voltage (de-energized) are left out of the lowest.
+        voltages = np.asarray(self.voltages[rows])
+        starts = self.bus_start[:-1]
+        v_max = np.maximum.reduceat(voltages, starts, axis=1)
+        v_min = np.minimum.reduceat(np.where(voltages > 0, voltages, np.inf), starts, axis=1)
+        return v_max, np.where(np.isinf(v_min), 0, v_min)
+
+    def summary(self):
+        # Highest and lowest voltage of each bus over the whole run, with the time they happen
+        if self.rows == 0:
+            return pd.DataFrame(columns=['Bus', 'V max (pu)', 't max (s)', 'V min (pu)', 't min (s)'])
+        v_max, v_min = self.bus_extremes()
+        columns = np.arange(len(self.buses))
+        row_max = v_max.argmax(axis=0)
+        row_min = np.where(v_min > 0, v_min, np.inf).argmin(axis=0)
+        return pd.DataFrame({'Bus': self.buses, 'V max (pu)': v_max[row_max, columns], 't max (s)': self.t[row_max],
+                             'V min (pu)': v_min[row_min, columns], 't min (s)': self.t[row_min]})
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a recording of the feeder voltages written with '
+                                                 'run_batch.py --snapshots.')
+    parser.add_argument('file_path', help='recording file (without the .json extension)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of buses listed with the highest and the lowest voltages (default: 10)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='CSV file for the highest and lowest voltage of every bus')
+    args = parser.parse_args()
+
+    snapshots = FeederSnapshots.load(args.file_path)
+    print(f"{snapshots.rows} points of {len(snapshots.nodes)} nodes on {len(snapshots.buses)} buses and "
+          f"{len(snapshots.elements)} lines and transformers")
+
+    summary = snapshots.summary()
+    print(summary.sort_values('V max (pu)', ascending=False).head(args.top).to_string(index=False))
+    print(summary.sort_values('V min (pu)').head(args.top).to_string(index=False))
+    if len(snapshots.elements) and snapshots.rows:
+        loadings = snapshots.loadings.max(axis=0)
+        order = np.argsort(loadings)[::-1][:args.top]
+        print(pd.DataFrame({'Element': snapshots.elements[order], 'Loading max': loadings[order]}).to_string(index=False))
+
+    if args.output is not None:
+        summary.to_csv(args.output, index=False)
+        print(f"File saved at: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,27 @@
-# before running this script, in OpenDSS,
-#  redirect Master.dss
-#  show buses
+# Write coordinates for the buses of the feeder that have none in Buscoords.dss: secondary buses
+# next to their primary bus in SecondaryBuses.xy, the others and every primary bus (above 0.5 kV)
+# in ManualBuses.xy to be filled in by manual inspection. The bus list comes from the compiled
+# feeder through bus_index.BusIndex, so the output of "show buses" is no longer needed.
+import os
+import sys
 
-buses = {}
-missing = []
-nmanual = 0
+FEEDER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(FEEDER_DIR)))
 
-# shift the transformer secondary bus by this much from the primary bus
-dxt = 5
-dyt = 0
+import bus_index
+import dss_session
 
-# shift the secondary load bus by this much from the primary bus
-dxm = 45
-dym = 40
+index = bus_index.BusIndex.from_session(dss_session.FeederSession(os.path.join(FEEDER_DIR, 'Master.dss')))
+secondary, manual = index.missing_coordinates()
 
-mp = open('ManualBuses.xy', mode='w')
-print ('// fill these primary bus coordinates in by manual inspection', file=mp)
+with open(os.path.join(FEEDER_DIR, 'ManualBuses.xy'), mode='w') as mp:
+  print('// fill these primary bus coordinates in by manual inspection', file=mp)
+  for bus in manual:
+    print(bus + ',0,0', file=mp)
 
-with open('IEEE8500_Buses.Txt', mode='r') as infile:
-  for i in range(6):
-    next (infile)
-  for line in infile:
-    row = line.split()
-    bus = row[0].strip('"')
-    kV = float(row[1])
-    if 'NA' not in row[3]:
-      x = float(row[3])
-      y = float(row[5])
-    else:
-      x = 'NA'
-      y = 'NA'
-    if x == 'NA':
-      if kV > 0.5:
-        print (bus + ',0,0', file=mp)
-        nmanual += 1
-      else:
-        missing.append (bus)
-    else:
-      buses[bus] = [x, y]
-
-nsecondary = 0
-op = open('SecondaryBuses.xy', mode='w')
-for bus in missing:
-  key = 'l' + bus.strip('sxabc')
-  if key in buses:
-    primary = buses[key]
-    if 'sx' in bus.lower():  # load bus
-      x = primary[0] + dxm
-      y = primary[1] + dym
-    else:  # transformer bus
-      x = primary[0] + dxt
-      y = primary[1] + dyt
-    print (bus.upper() + ',' + '{:.4f}'.format(x) + ',' + '{:.4f}'.format(y), file=op)
-    nsecondary += 1
-  else:
-    print (bus + ',0,0', file=mp)
-    nmanual += 1
-
-print (nsecondary, 'secondary buses with XY coordinates now')
-print (nmanual, 'buses need manual coordinates')
-op.close()
-mp.close()
+with open(os.path.join(FEEDER_DIR, 'SecondaryBuses.xy'), mode='w') as op:
+  for bus, x, y in secondary:
+    print(bus.upper() + ',' + '{:.4f}'.format(x) + ',' + '{:.4f}'.format(y), file=op)
 
+print(len(secondary), 'secondary buses with XY coordinates now')
+print(len(manual), 'buses need manual coordinates')
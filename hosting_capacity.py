@@ -0,0 +1,264 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import pandas as pd
+import dss_session
+import voltage_sensitivity
+from branch_loading import BranchLoading
+
+# Limits of the service voltage (pu, ANSI C84.1 range A, at the buses of the loads) and largest loading
+# of lines and transformers (fraction of their normal rating) allowed with the DER. The primary is not
+# held to range A: the substation regulator keeps the feeder head at up to 1.0625 pu on its own.
+V_MAX = 1.05
+V_MIN = 0.95
+MAX_LOADING = 1.0
+
+# Largest DER size tried (MW) and width of the interval where the bisection stops (MW)
+MAX_MW = 10.0
+RESOLUTION = 0.05
+
+# Margin (pu of voltage or of rating) below which a load or element already beyond a limit in the base
+# case is not made worse by the DER; the solutions of the same case differ by about 1e-4 pu
+TOLERANCE = 1e-3
+
+# Hosting capacity evaluator of the current worker process, set by the pool initializer
+worker_capacity = None
+
+def load_nodes(dss):
+    # Indices, in the order of the node voltages of the circuit, of the nodes that serve loads
+    node_index = {node.lower(): k for k, node in enumerate(dss.circuit.nodes_names)}
+    nodes = set()
+    for name in dss.loads.names:
+        dss.circuit.set_active_element(f'Load.{name}')
+        bus = dss.cktelement.bus_names[0].split('.')[0].lower()
+        for node in dss.cktelement.node_order[:dss.cktelement.num_conductors]:
+            if node != 0:
+                nodes.add(node_index[f'{bus}.{node}'])
+    return np.array(sorted(nodes), dtype=np.int64)
+
+class HostingCapacity:
+    # Hosting capacity of the buses of a compiled feeder session: the largest three-phase DER at
+    # unity power factor, found by bisection, that keeps the voltage of every load within v_min and
+    # v_max and every line and transformer within max_loading of its rating. The feeder is solved at
+    # load_mult once for the base case, and each DER size is then solved from the regulator taps of
+    # the base case, with the control actions (steady state after the regulators respond) or, with
+    # fixed_taps, without them (the worst case for the voltage rise). Loads and elements already
+    # beyond a limit in the base case only count as violations when the DER makes them worse.
+    # The bisection assumes that a DER larger than one that violates a limit violates it too.
+    def __init__(self, session, load_mult=1.0, v_max=V_MAX, v_min=V_MIN, max_loading=MAX_LOADING,
+                 fixed_taps=False):
+        self.session = session
+        self.load_mult = float(load_mult)
+        self.v_max = v_max
+        self.v_min = v_min
+        self.max_loading = max_loading
+        self.fixed_taps = fixed_taps
+
+        session.reset()
+        dss = session.dss
+        dss.solution.load_mult = self.load_mult
+        dss.solution.solve()
+
+        self.taps = [(transformer, winding, session.get_tap(transformer, winding))
+                     for transformer, winding, tap in session.regulator_taps]
+        self.nodes = load_nodes(dss)
+        self.nodes = self.nodes[np.asarray(dss.circuit.buses_vmag_pu)[self.nodes] > 0]
+        self.node_names = np.array(dss.circuit.nodes_names)[self.nodes]
+        self.v0 = np.asarray(dss.circuit.buses_vmag_pu)[self.nodes]
+        self.branches = BranchLoading(dss, [transformer for transformer, winding, tap in self.taps])
+        self.loading0 = self.branches.loading(dss)
+
+        # Limits of each load and element: the base case, with a margin, where it is already beyond them
+        self.v_high = np.where(self.v0 > v_max, self.v0 + TOLERANCE, v_max)
+        self.v_low = np.where(self.v0 < v_min, self.v0 - TOLERANCE, v_min)
+        self.loading_high = np.where(self.loading0 > max_loading, self.loading0 + TOLERANCE, max_loading)
+        self.bus = None
+
+    def connect(self, bus):
+        # Move the DER to a bus; it stays there, with its size edited, until another bus is connected
+        dss = self.session.dss
+        if int(dss.circuit.set_active_bus(bus)) < 0:
+            raise ValueError(f'Bus {bus} is not a bus of the feeder')
+        if dss.bus.num_nodes != 3:
+            raise ValueError(f'Bus {bus} is not a three-phase bus')
+
+        self.session.define('Generator.hosting_der', f'phases=3 bus1={bus} kV={dss.bus.kv_base * np.sqrt(3)} '
+                                                     f'kW=0 kvar=0 model=1')
+        self.bus = bus
+
+    def evaluate(self, p_mw):
+        # Solve the feeder with a DER of p_mw at the connected bus and return the limit it violates
+        # (an empty string when none), the highest and lowest load voltages and the highest loading
+        dss = self.session.dss
+        for transformer, winding, tap in self.taps:
+            if self.session.get_tap(transformer, winding) != tap:
+                dss.transformers.tap = tap
+
+        dss.text(f'Edit Generator.hosting_der kW={float(p_mw) * 1000}')
+        if self.fixed_taps:
+            dss.solution.solve_no_control()
+        else:
+            dss.solution.solve()
+
+        v = np.asarray(dss.circuit.buses_vmag_pu)[self.nodes]
+        loading = self.branches.loading(dss)
+        if not dss.solution.converged:
+            limit = 'Convergence'
+        elif (v > self.v_high).any():
+            limit = 'Overvoltage'
+        elif (v < self.v_low).any():
+            limit = 'Undervoltage'
+        elif (loading > self.loading_high).any():
+            limit = 'Thermal'
+        else:
+            limit = ''
+
+        k = int(np.argmax(loading))
+        return limit, {'V max (pu)': float(v.max()), 'V min (pu)': float(v.min()),
+                       'Loading max (%)': float(loading[k] * 100), 'Element': self.branches.names[k]}
+
+    def capacity(self, bus, max_mw=MAX_MW, resolution=RESOLUTION):
+        # Hosting capacity (MW) of a bus, the limit that bounds it (empty when max_mw is allowed),
+        # the voltages and loading at the capacity and the number of solutions it took
+        start = time.perf_counter()
+        self.connect(bus)
+
+        limit, state = self.evaluate(max_mw)
+        solutions = 1
+        low, high = 0.0, max_mw
+        if limit:
+            # A DER of size zero is the base case, within the limits by construction
+            high_limit = limit
+            state = None
+            while high - low > resolution:
+                middle = (low + high) / 2
+                middle_limit, middle_state = self.evaluate(middle)
+                solutions += 1
+                if middle_limit:
+                    high, high_limit = middle, middle_limit
+                else:
+                    low, state = middle, middle_state
+            limit = high_limit
+            if state is None:
+                state = self.evaluate(low)[1]
+                solutions += 1
+        else:
+            low = max_mw
+
+        # Leave the feeder as in the base case for the next bus
+        self.session.dss.text('Edit Generator.hosting_der kW=0')
+        return {'Bus': bus, 'Capacity (MW)': low, 'Limit': limit, **state, 'Solutions': solutions,
+                'Time (s)': time.perf_counter() - start}
+
+def init_worker(dss_file=None, load_mult=1.0, v_max=V_MAX, v_min=V_MIN, max_loading=MAX_LOADING, fixed_taps=False):
+    # Compile the feeder and solve its base case once per worker process
+    global worker_capacity
+    worker_capacity = HostingCapacity(dss_session.FeederSession(dss_file), load_mult, v_max, v_min, max_loading,
+                                      fixed_taps)
+
+def worker_buses(min_kv, max_kv):
+    # Candidate buses of the worker's feeder
+    return voltage_sensitivity.three_phase_buses(worker_capacity.session.dss, min_kv, max_kv)
+
+def run_worker(buses, max_mw, resolution):
+    # Rows of a chunk of buses; a bus that is not a three-phase bus of the feeder gets a row with the
+    # error instead of aborting the rest of the chunk
+    rows = []
+    for bus in buses:
+        try:
+            rows.append(worker_capacity.capacity(bus, max_mw, resolution))
+        except ValueError as error:
+            rows.append({'Bus': bus, 'Capacity (MW)': np.nan, 'Limit': 'Error', 'Error': str(error)})
+    return rows
+
+def run_hosting_capacity(buses=None, workers=None, dss_file=None, load_mult=1.0, v_max=V_MAX, v_min=V_MIN,
+                         max_loading=MAX_LOADING, fixed_taps=False, max_mw=MAX_MW, resolution=RESOLUTION,
+                         min_kv=1.0, max_kv=35.0, chunk_size=4):
+    # Find the hosting capacity of the buses (by default every three-phase bus with a line-to-neutral
+    # base between min_kv and max_kv) on a pool of worker processes, each with its own OpenDSS
+    # instance, compiled feeder and base case, and yield the row of each bus as soon as its chunk
+    # of chunk_size buses finishes. At most two chunks per worker are queued.
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Workers are started fresh (spawn) rather than forked, so they do not inherit the OpenDSS
+    # state of a parent process that already compiled a feeder
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker,
+                             initargs=(dss_file, load_mult, v_max, v_min, max_loading, fixed_taps)) as executor:
+        if buses is None:
+            buses = executor.submit(worker_buses, min_kv, max_kv).result()
+
+        buses = list(buses)
+        pending = (buses[k:k + chunk_size] for k in range(0, len(buses), chunk_size))
+        running = set()
+        for chunk in itertools.islice(pending, 2 * workers):
+            running.add(executor.submit(run_worker, chunk, max_mw, resolution))
+
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+                # Keep the workers busy with the next chunk
+                for chunk in itertools.islice(pending, 1):
+                    running.add(executor.submit(run_worker, chunk, max_mw, resolution))
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the largest DER each bus of the feeder can host within '
+                                                 'the voltage and thermal limits.')
+    parser.add_argument('--buses', nargs='+',
+                        help='buses to study (default: every three-phase primary bus)')
+    parser.add_argument('--min-kv', type=float, default=1.0,
+                        help='lowest line-to-neutral base (kV) of the default buses (default: 1.0)')
+    parser.add_argument('--max-kv', type=float, default=35.0,
+                        help='highest line-to-neutral base (kV) of the default buses (default: 35.0)')
+    parser.add_argument('-o', '--output', default='hosting_capacity.csv',
+                        help='CSV file for the capacity table (default: hosting_capacity.csv)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--load-mult', type=float, default=1.0,
+                        help='load multiplier of the base case (default: 1.0)')
+    parser.add_argument('--v-max', type=float, default=V_MAX,
+                        help=f'highest load voltage in pu (default: {V_MAX})')
+    parser.add_argument('--v-min', type=float, default=V_MIN,
+                        help=f'lowest load voltage in pu (default: {V_MIN})')
+    parser.add_argument('--max-loading', type=float, default=MAX_LOADING,
+                        help=f'highest loading of lines and transformers, as a fraction of their normal rating '
+                             f'(default: {MAX_LOADING})')
+    parser.add_argument('--fixed-taps', action='store_true',
+                        help='keep the regulator taps of the base case instead of letting the regulators respond')
+    parser.add_argument('--max-mw', type=float, default=MAX_MW,
+                        help=f'largest DER size tried in MW (default: {MAX_MW})')
+    parser.add_argument('--resolution', type=float, default=RESOLUTION,
+                        help=f'resolution of the capacity in MW (default: {RESOLUTION})')
+    args = parser.parse_args()
+
+    # The path is resolved before OpenDSS changes the working directory to the feeder folder
+    file_path = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    start = time.perf_counter()
+    rows = []
+    for row in run_hosting_capacity(args.buses, args.workers, load_mult=args.load_mult, v_max=args.v_max,
+                                    v_min=args.v_min, max_loading=args.max_loading, fixed_taps=args.fixed_taps,
+                                    max_mw=args.max_mw, resolution=args.resolution, min_kv=args.min_kv,
+                                    max_kv=args.max_kv):
+        rows.append(row)
+        if row['Limit'] == 'Error':
+            print(f"{row['Bus']}: {row['Error']}")
+        else:
+            print(f"{row['Bus']}: {row['Capacity (MW)']:.2f} MW {row['Limit']}")
+
+    table = pd.DataFrame(rows).sort_values('Capacity (MW)', kind='stable').reset_index(drop=True)
+    print(f"{len(table)} buses in {time.perf_counter() - start:.1f} s")
+
+    table.to_csv(file_path, index=False)
+    print(f"File saved at: {file_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import time
+import numpy as np
+from dss_controls import power_factor
+
+# Traces of the live view: panel, label and the sample values they are computed from
+TRACES = [(0, 'Va', 'va'), (0, 'Vb', 'vb'), (0, 'Vc', 'vc'), (0, 'V Mean', 'vm'),
+          (1, 'Active Power', 'p'), (1, 'Reactive Power', 'q'),
+          (2, 'Power Factor', 'pf'),
+          (3, 'Ia', 'ia'), (3, 'Ib', 'ib'), (3, 'Ic', 'ic')]
+PANEL_LABELS = ['Voltage (pu)', 'Power (pu)', 'Power Factor', 'Current (pu)']
+
+class LivePlot:
+    # Figure with the voltage, P/Q, power factor and current traces of a running DER simulation,
+    # updated while the steps complete. It can be passed directly as step_callback of feeder() or
+    # run_scenario(), or fed by another thread's samples from the Tkinter main loop.
+    #
+    # Memory and drawing cost stay bounded however long the run is: at most `capacity` points are
+    # kept, halving the resolution (every other point is dropped) each time the buffer fills, and
+    # the figure is redrawn at most every `interval` seconds. Only the lines are redrawn (blitting)
+    # on top of a saved background, the axes are drawn again only when the data leaves their limits.
+    def __init__(self, title='', capacity=2000, interval=0.1):
+        # Matplotlib is imported on demand so that runs without plots start quickly and without a display
+        import matplotlib.pyplot as plt
+
+        self.capacity = capacity
+        self.interval = interval
+
+        # Decimated buffers: one sample out of `stride` is kept
+        self.data = {key: np.zeros(capacity) for key in ['t'] + [key for panel, label, key in TRACES]}
+        self.size = 0
+        self.stride = 1
+        self.received = 0
+        self.last_draw = 0.0
+        self.background = None
+
+        self.fig, self.axs = plt.subplots(4, 1, figsize=(10, 9), sharex=True)
+        self.fig.suptitle(title, fontsize=16, fontweight='bold')
+        self.lines = {}
+        for panel, label, key in TRACES:
+            self.lines[key], = self.axs[panel].plot([], [], label=label, animated=True)
+        for ax, label in zip(self.axs, PANEL_LABELS):
+            ax.set_ylabel(label)
+            ax.grid(True)
+            ax.legend(fontsize=9, loc='upper right')
+        self.scaled = [False] * len(self.axs)  # Panels whose limits were set from the data
+        self.axs[-1].set_xlabel('Time (s)')
+
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        plt.show(block=False)
+
+    def __call__(self, i, npts, sample):
+        # Step callback: add the sample and redraw if the last drawing is older than the interval
+        if i == 1:
+            # Whole time range of the run, known from the time step
+            self.axs[0].set_xlim(0, sample['t'] * (npts - 1))
+            self.background = None
+        self.append(sample)
+        self.refresh()
+
+    def append(self, sample):
+        # Add the values of one step (as recorded by feeder()) to the buffers
+        self.received += 1
+        if (self.received - 1) % self.stride:
+            return
+
+        if self.size == self.capacity:
+            # Buffer full: keep every other point and halve the rate at which new points are kept
+            for values in self.data.values():
+                values[:self.capacity // 2] = values[0:self.capacity:2]
+            self.size = self.capacity // 2
+            self.stride *= 2
+            if (self.received - 1) % self.stride:
+                return
+
+        k = self.size
+        self.data['t'][k] = sample['t']
+        for key in ['va', 'vb', 'vc', 'vm', 'p', 'q']:
+            self.data[key][k] = sample[key]
+        self.data['pf'][k] = power_factor(sample['p'], sample['q'])
+        self.data['ia'][k], self.data['ib'][k], self.data['ic'][k] = sample['i']
+        self.size += 1
+
+    def refresh(self, force=False):
+        # Redraw the lines, limited to one drawing per interval unless forced
+        now = time.perf_counter()
+        if not force and now - self.last_draw < self.interval:
+            return
+        self.last_draw = now
+
+        t = self.data['t'][:self.size]
+        for key, line in self.lines.items():
+            line.set_data(t, self.data[key][:self.size])
+
+        if self.rescale() or self.background is None:
+            # Limits changed: draw everything; on_draw saves the new background
+            self.fig.canvas.draw()
+        else:
+            self.fig.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+
+    def rescale(self):
+        # Widen the y limits of the panels whose data left them; return whether any changed
+        changed = False
+        for panel, ax in enumerate(self.axs):
+            keys = [key for trace_panel, label, key in TRACES if trace_panel == panel]
+            values = np.concatenate([self.data[key][:self.size] for key in keys])
+            if values.size == 0:
+                continue
+            low, high = ax.get_ylim()
+            margin = 0.1 * max(values.max() - values.min(), 0.01)
+            if not self.scaled[panel]:
+                ax.set_ylim(values.min() - margin, values.max() + margin)
+                self.scaled[panel] = True
+                changed = True
+            elif values.min() < low or values.max() > high:
+                ax.set_ylim(min(low, values.min() - margin), max(high, values.max() + margin))
+                changed = True
+        if self.axs[0].get_xlim()[1] < self.data['t'][max(self.size - 1, 0)]:
+            self.axs[0].set_xlim(0, 2 * self.data['t'][self.size - 1])
+            changed = True
+        return changed
+
+    def on_draw(self, event):
+        # Save the background (axes without the lines) after every full drawing and draw the lines on it
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+        for panel, label, key in TRACES:
+            self.axs[panel].draw_artist(self.lines[key])
+
+    def close(self):
+        # Final drawing with every buffered point
+        self.refresh(force=True)
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import numpy as np
+import data_export_plot
+
+# Measured 1-second irradiance profile shipped with the 8500-node feeder
+MEASURED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feeders', '8500-Node',
+                             'Normalized-1s-2900-pts.CSV')
+
+def profile_path(name):
+    # Path of a binary profile in the 'docs/profiles' directory
+    profiles_dir = data_export_plot.docs_path('profiles')
+    os.makedirs(profiles_dir, exist_ok=True)
+    return os.path.join(profiles_dir, f'{name}.dbl')
+
+def load_series(file_path=MEASURED_FILE):
+    # Memory-map a measured time series given as a text file with one value per line. The text is
+    # parsed only the first time (or when it changes): its values are kept in a raw float64 .dbl
+    # file in 'docs/profiles', which OpenDSS can also read directly as a loadshape.
+    dbl_path = profile_path(os.path.splitext(os.path.basename(file_path))[0])
+    if not os.path.exists(dbl_path) or os.path.getmtime(dbl_path) < os.path.getmtime(file_path):
+        values = np.loadtxt(file_path, dtype=np.float64, delimiter=',', ndmin=2)[:, 0]
+        tmp_path = f'{dbl_path}.{os.getpid()}.tmp'
+        values.tofile(tmp_path)
+        os.replace(tmp_path, dbl_path)
+
+    return np.memmap(dbl_path, dtype=np.float64, mode='r')
+
+def define_shape(session, element, values, interval, prop='mult'):
+    # Define a Loadshape (prop='mult') or Tshape (prop='temp') with one value every `interval`
+    # seconds without writing the values into the command: a constant profile becomes a single
+    # point, any other is passed to OpenDSS as a binary file (dblfile) that is not kept
+    values = np.asarray(values, dtype=np.float64)
+
+    if values.size == 1 or np.all(values == values[0]):
+        session.define(element, f'npts=1 sinterval={interval} {prop}=[{values[0]}]')
+        return
+
+    # OpenDSS reads the file when the element is defined, so it is written to a temporary file of its
+    # own (runs in other processes never share it) and removed right after the definition
+    handle, dbl_path = tempfile.mkstemp(suffix='.dbl', prefix=f"{element.replace('.', '_')}_")
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            values.tofile(f)
+
+        # npts must come before the values, so the arrays are allocated with their final length
+        session.define(element, f'npts={values.size} sinterval={interval} {prop}=(dblfile="{dbl_path}")')
+    finally:
+        os.remove(dbl_path)
+
+def check_length(name, values, npts, single=False):
+    # Raise a ValueError unless a series has one value per point of a simulation of npts points or,
+    # with single, a single value for the whole simulation
+    size = np.size(values)
+    if size != npts and not (single and size == 1):
+        expected = f'{npts} values or a single one' if single else f'{npts} values'
+        raise ValueError(f'The {name} series has {size} values; the simulation has {npts} points and needs {expected}')
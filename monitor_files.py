@@ -0,0 +1,224 @@
+import argparse
+import csv
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Monitor stream of OpenDSS: four int32 (signature, version, channels per record, monitor mode), the
+# channel names as comma-separated text in 256 bytes, then one record of float32 per sample: hour,
+# seconds and the channels
+MONITOR_SIGNATURE = 43756
+MONITOR_HEADER_SIZE = 16 + 256
+
+class PlotData:
+    # Plot exported by OpenDSS for DSSView: a .DSV script and, for the circuit plots (profile,
+    # voltage, power, losses), a .dbl file with the phasors of the elements it draws. Each Line record
+    # of the script gives an element, its two buses, the byte offset of its data in the .dbl file and
+    # its number of conductors (both terminals): the complex voltages of the conductors are followed
+    # by their complex currents, as complex128. The .dbl file is memory-mapped, so opening a plot only
+    # parses the script and the phasors of an element are a view of the file.
+    #
+    # Monitor plots keep their samples in the script itself as Curve records (npts x values then npts
+    # y values, with an empty .dbl file); those are parsed into curves.
+    def __init__(self, file_path):
+        base, extension = os.path.splitext(file_path)
+        self.dsv_path = base + '.DSV' if extension.lower() != '.dsv' else file_path
+        self.dbl_path = base + '.dbl'
+
+        self.caption = ''
+        self.xlabel = ''
+        self.ylabel = ''
+        self.curves = []
+        elements = []
+        with open(self.dsv_path, 'r', newline='') as f:
+            for row in csv.reader(f, skipinitialspace=True):
+                if not row:
+                    continue
+                kind = row[0].strip()
+                if kind == 'Line':
+                    elements.append(row[1:6])
+                elif kind == 'Curve':
+                    npts = int(row[1])
+                    values = np.array(row[8:8 + 2 * npts], dtype=np.float64)
+                    self.curves.append((row[7].strip(), values[:npts], values[npts:]))
+                elif kind == 'ChartCaption':
+                    self.caption = row[1].strip()
+                elif kind == 'Xlabel':
+                    self.xlabel = row[1].strip()
+                elif kind == 'Ylabel':
+                    self.ylabel = row[1].strip()
+
+        self.elements = np.array([element[0] for element in elements], dtype=str)
+        self.bus1 = np.array([element[1] for element in elements], dtype=str)
+        self.bus2 = np.array([element[2] for element in elements], dtype=str)
+        self.conductors = np.array([int(element[4]) for element in elements], dtype=np.int64)
+        self.start = np.array([int(element[3]) for element in elements], dtype=np.int64) // 16
+        # Elements drawn more than once (once per phase in profiles of all phases) are looked up at their
+        # first record
+        self.ids = {}
+        for k, name in enumerate(self.elements.tolist()):
+            self.ids.setdefault(name.lower(), k)
+
+        if os.path.exists(self.dbl_path) and os.path.getsize(self.dbl_path) > 0:
+            self.data = np.memmap(self.dbl_path, dtype='<c16', mode='r')
+        else:
+            self.data = np.empty(0, dtype=np.complex128)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def index(self, element):
+        try:
+            return self.ids[element.lower()]
+        except KeyError:
+            raise KeyError(f'{element} is not in {os.path.basename(self.dsv_path)}') from None
+
+    def voltages(self, element):
+        # Complex voltages (V) of the conductors of both terminals of an element
+        k = self.index(element)
+        return self.data[self.start[k]:self.start[k] + self.conductors[k]]
+
+    def currents(self, element):
+        # Complex currents (A) into the conductors of both terminals of an element
+        k = self.index(element)
+        return self.data[self.start[k] + self.conductors[k]:self.start[k] + 2 * self.conductors[k]]
+
+    def same_layout(self, other):
+        # Whether both plots store the same elements at the same positions
+        return (len(self) == len(other)
+                and np.array_equal(np.char.lower(self.elements), np.char.lower(other.elements))
+                and np.array_equal(self.start, other.start) and np.array_equal(self.conductors, other.conductors))
+
+    def difference(self, other):
+        # Largest difference of the voltage and current magnitudes of every element present in both
+        # plots, as a DataFrame sorted from the largest; plots of the same circuit are compared as
+        # whole arrays, others element by element
+        if self.same_layout(other):
+            common = np.arange(len(self))
+            delta = np.abs(np.abs(self.data) - np.abs(other.data[:len(self.data)]))
+            starts = np.repeat(self.start, 2) + np.tile([0, 1], len(self)) * np.repeat(self.conductors, 2)
+            dv, di = np.maximum.reduceat(delta, starts).reshape(-1, 2).T if len(delta) else ([], [])
+        else:
+            common = np.array(sorted(k for name, k in self.ids.items() if name in other.ids), dtype=np.int64)
+            dv = [np.abs(np.abs(self.voltages(name)) - np.abs(other.voltages(name))).max()
+                  for name in self.elements[common]]
+            di = [np.abs(np.abs(self.currents(name)) - np.abs(other.currents(name))).max()
+                  for name in self.elements[common]]
+
+        difference = pd.DataFrame({'Element': self.elements[common], 'dV max (V)': dv, 'dI max (A)': di})
+        return difference.sort_values('dV max (V)', ascending=False, kind='stable').reset_index(drop=True)
+
+class MonitorStream:
+    # Samples of an OpenDSS monitor in its binary stream format (see MONITOR_SIGNATURE), from the
+    # stream of a compiled session or from a file where it was saved. The records are a float32 view
+    # of the buffer, memory-mapped for files, so channels are read without copying or parsing text.
+    # names replaces the channel names of the header, which some OpenDSS versions leave empty.
+    def __init__(self, buffer, names=None):
+        signature, self.version, record_size, self.mode = np.frombuffer(buffer, dtype='<i4', count=4)
+        if signature != MONITOR_SIGNATURE:
+            raise ValueError('Not an OpenDSS monitor stream')
+
+        if names is None:
+            header = bytes(buffer[16:MONITOR_HEADER_SIZE]).split(b'\x00')[0].decode('latin-1')
+            names = [name.strip() for name in header.split(',')][2:2 + record_size]
+        self.names = [name.strip() for name in names]
+        if len(self.names) != record_size:
+            self.names = [f'ch{k + 1}' for k in range(record_size)]
+
+        samples = (len(buffer) - MONITOR_HEADER_SIZE) // (4 * (record_size + 2))
+        self.records = np.frombuffer(buffer, dtype='<f4', count=samples * (record_size + 2),
+                                     offset=MONITOR_HEADER_SIZE).reshape(samples, record_size + 2)
+        self.hour = self.records[:, 0]
+        self.seconds = self.records[:, 1]
+        self.channels = self.records[:, 2:]
+
+    @classmethod
+    def from_file(cls, file_path):
+        return cls(np.memmap(file_path, dtype=np.uint8, mode='r'))
+
+    @classmethod
+    def from_session(cls, dss, name):
+        # Stream of a monitor of a compiled feeder; py-dss-interface returns it as single bytes,
+        # with the zero bytes empty
+        dss.monitors.name = name
+        return cls(b''.join(byte or b'\x00' for byte in dss.monitors.byte_stream), dss.monitors.header)
+
+    def save(self, file_path):
+        # Write the stream to a file that from_file() memory-maps
+        header = np.array([MONITOR_SIGNATURE, self.version, len(self.names), self.mode], dtype='<i4').tobytes()
+        names = ', '.join(['hour', 't(sec)'] + self.names).encode('latin-1')[:256].ljust(256, b'\x00')
+        with open(file_path, 'wb') as f:
+            f.write(header + names)
+            f.write(np.ascontiguousarray(self.records, dtype='<f4').tobytes())
+        print(f"File saved at: {file_path}")
+
+    @property
+    def time(self):
+        # Time of each sample (s)
+        return self.hour.astype(np.float64) * 3600 + self.seconds
+
+    def channel(self, name):
+        # Samples of a channel, by name (e.g. 'V1') or 1-based number as in dss.monitors.channel()
+        if not isinstance(name, str):
+            return self.channels[:, name - 1]
+        for k, channel in enumerate(self.names):
+            if channel.lower() == name.strip().lower():
+                return self.channels[:, k]
+        raise KeyError(f'Channel {name} is not one of {", ".join(self.names)}')
+
+    def frame(self):
+        # Copy of the samples as a DataFrame with the time and a column per channel
+        data = pd.DataFrame(self.channels, columns=self.names)
+        data.insert(0, 't(sec)', self.time)
+        return data
+
+def open_file(file_path):
+    # Monitor stream or DSSView plot, by the signature of the file
+    with open(file_path, 'rb') as f:
+        head = f.read(4)
+    if len(head) == 4 and int.from_bytes(head, 'little') == MONITOR_SIGNATURE:
+        return MonitorStream.from_file(file_path)
+    return PlotData(file_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Read OpenDSS monitor streams and DSSView plot files (.DSV/.dbl) '
+                                                 'and compare two of them.')
+    parser.add_argument('files', nargs='+',
+                        help='monitor stream files or plot files (.DSV or .dbl)')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the first file with each of the others')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of elements printed for each comparison (default: 10)')
+    args = parser.parse_args()
+
+    files = []
+    for file_path in args.files:
+        start = time.perf_counter()
+        data = open_file(file_path)
+        elapsed = (time.perf_counter() - start) * 1000
+        if isinstance(data, MonitorStream):
+            print(f"{file_path}: {len(data.records)} samples of {', '.join(data.names)} ({elapsed:.1f} ms)")
+        else:
+            print(f"{file_path}: {data.caption or os.path.basename(data.dsv_path)}, {len(data)} elements, "
+                  f"{len(data.data)} phasors, {len(data.curves)} curves ({elapsed:.1f} ms)")
+        files.append(data)
+
+    if args.compare:
+        reference = files[0]
+        for file_path, data in zip(args.files[1:], files[1:]):
+            if isinstance(reference, MonitorStream) and isinstance(data, MonitorStream):
+                samples = min(len(reference.records), len(data.records))
+                delta = np.abs(reference.channels[:samples] - data.channels[:samples]).max(axis=0)
+                print(f"{file_path}: " + ', '.join(f'{name} {value:g}' for name, value in zip(data.names, delta)))
+            elif isinstance(reference, PlotData) and isinstance(data, PlotData):
+                start = time.perf_counter()
+                difference = reference.difference(data)
+                print(f"{file_path}: {len(difference)} common elements compared in "
+                      f"{(time.perf_counter() - start) * 1000:.1f} ms")
+                print(difference.head(args.top).to_string(index=False))
+            else:
+                print(f"{file_path}: a monitor stream and a plot cannot be compared")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+import dss_controls
+import dss_session
+import opender_opendss_integration
+import profiling
+from scenario import Scenario, load_scenarios
+
+# Solutions of each load multiplier, at most, until the controls of the feeder stop acting
+MAX_CONTROL_SOLVES = 10
+
+# Current (A) added to each phase of the DER bus, in phase and in quadrature, to measure the
+# response of the feeder voltages
+PROBE_CURRENT = 10.0
+
+# Newton iterations of the voltages at the DER bus and their tolerance (relative to the voltage)
+MAX_ITERATIONS = 20
+VOLTAGE_TOLERANCE = 1e-9
+
+# Results compared by the validation report, and the voltages among them
+VALIDATED = ['P (pu)', 'Q (pu)', 'Vm (pu)', 'Va (pu)', 'Vb (pu)', 'Vc (pu)']
+VOLTAGES = ['Vm (pu)', 'Va (pu)', 'Vb (pu)', 'Vc (pu)']
+
+# Largest voltage error (pu) of an equivalent accepted by validate(), by default
+VALID_VOLTAGE_ERROR = 1e-2
+
+# Scenario keys (DER.txt) of the validations of NetworkEquivalent.accepts(): the DER bus and
+# rating, the control mode and the load pulses
+VALIDATION_KEYS = ['bus', 'V_rated', 'S_rated', 'PF_rated', 'control_mode', 'simulation_time', 'number_steps',
+                   'pts_per_steps']
+
+def real_parts(values):
+    # Complex phase values as the real vector [real parts, imaginary parts]
+    return np.concatenate([values.real, values.imag])
+
+def complex_parts(values):
+    return values[:3] + 1j * values[3:]
+
+class NetworkEquivalent:
+    # Reduced model of the 8500-node feeder seen from the terminal of a three-phase PVSystem, to
+    # explore DER settings without solving the whole network at every point. For each load
+    # multiplier it holds a Thevenin equivalent at the DER bus: the phase voltages are
+    #     V = E + Z I
+    # where I are the currents injected by the PVSystem, E the source voltages and Z the
+    # impedance, measured on the full feeder by extract(). The constant-power loads make the
+    # response of the feeder to a current depend on its angle, so Z is a real 6x6 matrix acting on
+    # the real and imaginary parts of the currents rather than a complex 3x3 matrix; it is the
+    # linearization around the PVSystem at its available power and unity power factor.
+    #
+    # The PVSystem injects the same power on each phase: its available active power (measured
+    # with the equivalent) and the reactive power of its setpoints, which takes precedence within
+    # the kVA rating. The controls of the feeder (regulators) keep the positions they had at
+    # extraction, so the equivalent departs from the full feeder wherever it would retap; validate()
+    # measures by how much for a scenario.
+    #
+    # It stands in for both the OpenDSS interface and the dss_controls.FeederControls of a run:
+    # feeder() sets the load multiplier and the PVSystem setpoints, solves with solution.solve()
+    # and reads the DER terminal with read_terminal(). Levels missing from a later run are
+    # extracted then, so one equivalent can serve every run on the same bus and DER rating.
+    # accepts() gates its use on a passing validate() for each bus, DER rating, control mode and
+    # load pulses.
+    def __init__(self):
+        # Verdicts of accepts(), kept when the levels are discarded for another bus or rating
+        self.verdicts = {}
+        self.clear()
+
+    def clear(self):
+        # Discard the extracted levels and the solution
+        self.key = None
+        self.levels = np.zeros(0)
+        self.E = np.zeros((0, 3), dtype=complex)
+        self.Z = np.zeros((0, 6, 6))
+        self.p_available = np.zeros(0)
+        self.kva = 0.0
+
+        # Setpoints and solution of the present point
+        self.level = 0
+        self.pf = 1.0
+        self.kvar = 0.0
+        self.kvar_mode = False
+        self.V = np.zeros(3, dtype=complex)
+        self.P = self.Q = 0.0
+
+        # Counters read by profiling.SimulationProfiler, as for an OpenDSS solution
+        self.iterations = 0
+        self.control_iterations = 0
+        self.converged = True
+
+    @property
+    def solution(self):
+        return self
+
+    def extract(self, session, pv_name, load_mults):
+        # Measure the equivalent for the load multipliers not extracted yet, on a session where the
+        # PVSystem pv_name has been defined by feeder(). A PVSystem on another bus or with another
+        # rating discards the levels extracted before. The feeder is left at the start of the run.
+        dss = session.dss
+        dss.pvsystems.name = pv_name
+        bus = dss.cktelement.bus_names[0]
+        key = (str(session.dss_file), bus.lower(), dss.pvsystems.kva, dss.pvsystems.pmpp,
+               dss.pvsystems.irradiance)
+        if key != self.key:
+            self.clear()
+            self.key = key
+        self.kva = dss.pvsystems.kva
+
+        # Initial setpoints of the PVSystem as defined (the power factor is given last)
+        self.pf = dss.pvsystems.pf
+        self.kvar_mode = False
+        kvar = dss.pvsystems.kvar
+
+        # The levels are extracted in the order of the run, so the regulators move from one level
+        # to the next as they would in the run
+        missing = [m for m in dict.fromkeys(np.asarray(load_mults, dtype=np.float64).tolist())
+                   if m not in self.levels]
+        if not missing:
+            return self
+
+        # One current source per phase, in service only while the PVSystem is replaced by them
+        probes = [f'ISource.{pv_name}_probe{phase}' for phase in (1, 2, 3)]
+        for phase, probe in enumerate(probes, 1):
+            session.define(probe, f'bus1={bus}.{phase} phases=1 amps=0 angle=0 enabled=no')
+
+        E = np.zeros((len(missing), 3), dtype=complex)
+        Z = np.zeros((len(missing), 6, 6))
+        p_available = np.zeros(len(missing))
+        for k, load_mult in enumerate(missing):
+            # Operating point: the PVSystem at unity power factor, controls settled
+            dss.solution.load_mult = float(load_mult)
+            dss.text(f'Edit PVSystem.{pv_name} pf=1 kvar=0')
+            for _ in range(MAX_CONTROL_SOLVES):
+                dss.solution.solve()
+                if dss.solution.control_iterations <= 1:
+                    break
+            dss.pvsystems.name = pv_name
+            I0 = -terminal_phasors(dss.cktelement.currents_mag_ang)
+            p_available[k] = -sum(dss.cktelement.powers[0:6:2])
+
+            # Same injection from the current sources, then each current moved in both directions
+            dss.text(f'Edit PVSystem.{pv_name} enabled=no')
+            for probe, current in zip(probes, I0):
+                set_probe(dss, probe, current, enabled=True)
+            dss.solution.solve_no_control()
+            V0 = bus_phasors(dss, bus)
+
+            for column in range(6):
+                phase = column % 3
+                step = PROBE_CURRENT * (1 if column < 3 else 1j)
+                set_probe(dss, probes[phase], I0[phase] + step)
+                dss.solution.solve_no_control()
+                Z[k, :, column] = real_parts(bus_phasors(dss, bus) - V0) / PROBE_CURRENT
+                set_probe(dss, probes[phase], I0[phase])
+
+            E[k] = V0 - complex_parts(Z[k] @ real_parts(I0))
+
+            for probe in probes:
+                dss.text(f'Edit {probe} enabled=no')
+            dss.text(f'Edit PVSystem.{pv_name} enabled=yes')
+
+        # Back to the start of the run, with the PVSystem setpoints as defined
+        dss.text(f'Edit PVSystem.{pv_name} kvar={kvar} pf={self.pf}')
+        dss.solution.dbl_hour = 0.0
+
+        order = np.argsort(np.concatenate([self.levels, missing]))
+        self.levels = np.concatenate([self.levels, missing])[order]
+        self.E = np.concatenate([self.E, E])[order]
+        self.Z = np.concatenate([self.Z, Z])[order]
+        self.p_available = np.concatenate([self.p_available, p_available])[order]
+        return self
+
+    def accepts(self, der_data, session, tolerance=VALID_VOLTAGE_ERROR):
+        # Whether the equivalent may replace the feeder for a scenario (dictionary with the DER.txt
+        # keys), with a warning when it may not. Scenarios without DER or in the 24-hour mode are
+        # not supported. Otherwise validate() runs the first scenario of each bus, DER rating,
+        # control mode and load pulses (VALIDATION_KEYS) both ways, and its verdict is kept for the
+        # scenarios that only differ in the settings of the mode (CONST_Q, categories).
+        if der_data.get('DER') != 'True' or der_data.get('number_steps') == 0:
+            print(f"Warning: the network equivalent needs a DER with constant irradiance and temperature, so "
+                  f"the scenario {'without DER' if der_data.get('DER') != 'True' else 'in the 24-hour mode'} "
+                  f"runs on the full feeder")
+            return False
+
+        key = tuple(der_data.get(name) for name in VALIDATION_KEYS) + (tolerance,)
+        if key not in self.verdicts:
+            self.verdicts[key] = validate(der_data, session, self, tolerance=tolerance)['valid']
+        if not self.verdicts[key]:
+            print(f"Warning: the network equivalent at bus {der_data.get('bus')} ({der_data.get('control_mode')}) "
+                  f"differs from the full feeder by more than {tolerance:g} pu, so the scenario runs on the "
+                  f"full feeder")
+        return self.verdicts[key]
+
+    def set_load_mult(self, value):
+        # Select the equivalent extracted for this load multiplier
+        k = np.searchsorted(self.levels, value)
+        if k == len(self.levels) or self.levels[k] != value:
+            raise KeyError(f'No network equivalent extracted for the load multiplier {value}')
+        self.level = k
+
+    def activate_pv(self, name):
+        # Only one PVSystem is modeled
+        pass
+
+    def set_pv(self, name, pf, kvar, immediate=False):
+        # Power factor and reactive power (kvar) setpoints, applied from the next solution; as for
+        # the PVSystem through dss_controls.FeederControls, kvar is applied only with a power factor of 0
+        self.pf = float(pf)
+        self.kvar = float(kvar)
+        self.kvar_mode = self.pf == 0
+
+    def set_pv_output(self, name, p_pu, q_pu, kvar, immediate=False):
+        self.set_pv(name, dss_controls.power_factor(p_pu, q_pu), kvar)
+
+    def pv_output(self):
+        # Active and reactive power (kW, kvar) of the PVSystem for the present setpoints
+        p = self.p_available[self.level]
+        if self.kvar_mode:
+            q = self.kvar
+        else:
+            q = math.copysign(p * math.tan(math.acos(min(abs(self.pf), 1.0))), self.pf)
+        q = min(max(q, -self.kva), self.kva)
+        return min(p, math.sqrt(self.kva ** 2 - q ** 2)), q
+
+    def solve(self):
+        # Voltages at the DER bus for the present load multiplier and setpoints: V = E + Z I with
+        # the currents I = conj(S / V) of a constant-power injection, solved by Newton's method on
+        # the real and imaginary parts
+        self.P, self.Q = self.pv_output()
+        S = (self.P + 1j * self.Q) * 1000 / 3
+        E, Z = self.E[self.level], self.Z[self.level]
+
+        V = E if not self.V.any() else self.V
+        self.converged = False
+        for self.iterations in range(1, MAX_ITERATIONS + 1):
+            mismatch = real_parts(V - E) - Z @ real_parts(np.conj(S / V))
+            if np.abs(mismatch).max() < VOLTAGE_TOLERANCE * np.abs(V).max():
+                self.converged = True
+                break
+
+            # Derivative of the currents: dI = m (dV_re - j dV_im) with m = -conj(S) / conj(V)^2
+            m = -np.conj(S) / np.conj(V) ** 2
+            dI = np.block([[np.diag(m.real), np.diag(m.imag)], [np.diag(m.imag), np.diag(-m.real)]])
+            V = V - complex_parts(np.linalg.solve(np.eye(6) - Z @ dI, mismatch))
+        self.V = V
+
+    def solve_no_control(self):
+        # The equivalent has no control actions
+        self.solve()
+
+    def read_terminal(self):
+        # Same readout as opender_opendss_integration.read_active_terminal(): phase voltages (V),
+        # angles (rad) and delivered powers (kW, kvar)
+        return np.abs(self.V).tolist(), np.angle(self.V).tolist(), self.P, self.Q
+
+def terminal_phasors(mag_ang):
+    # Phasors of the three phases of the first terminal from an OpenDSS magnitude/angle (degrees) list
+    return np.asarray(mag_ang[0:6:2]) * np.exp(1j * np.deg2rad(mag_ang[1:6:2]))
+
+def bus_phasors(dss, bus):
+    dss.circuit.set_active_bus(bus)
+    voltages = dss.bus.voltages
+    return np.asarray(voltages[0:6:2]) + 1j * np.asarray(voltages[1:6:2])
+
+def set_probe(dss, probe, current, enabled=None):
+    # Current (complex, A) of a probe current source
+    state = '' if enabled is None else f' enabled={"yes" if enabled else "no"}'
+    dss.text(f'Edit {probe}{state} amps={float(abs(current))!r} angle={float(np.degrees(np.angle(current)))!r}')
+
+def validate(der_data, session=None, equivalent=None, file_path=None, tolerance=VALID_VOLTAGE_ERROR):
+    # Run a scenario (dictionary with the DER.txt keys) on the full feeder and on its network
+    # equivalent and report the largest differences of the DER results (pu) and the time of each.
+    # The time of the equivalent run includes the extraction unless an equivalent extracted
+    # before is given. The equivalent is accepted ('valid') when its voltages are within tolerance
+    # (pu) of the full feeder at every point where the full solution converged; points where it did
+    # not converge are counted but give no reference. The report is returned and, with file_path,
+    # written as JSON.
+    if session is None:
+        session = dss_session.FeederSession()
+    if equivalent is None:
+        equivalent = NetworkEquivalent()
+
+    profiler = profiling.SimulationProfiler()
+    start = time.perf_counter()
+    full = opender_opendss_integration.run_scenario(der_data, session=session, export=False, plot_circuit=False,
+                                                    profiler=profiler)
+    full_s = time.perf_counter() - start
+    converged = profiler.steps['converged'][:profiler.rows]
+
+    start = time.perf_counter()
+    reduced = opender_opendss_integration.run_scenario(der_data, session=session, export=False,
+                                                       plot_circuit=False, equivalent=equivalent)
+    equivalent_s = time.perf_counter() - start
+
+    errors = {key: np.abs(reduced.data[key].to_numpy() - full.data[key].to_numpy()) for key in VALIDATED}
+    report = {'bus': der_data.get('bus'), 'control_mode': der_data.get('control_mode'),
+              'points': len(full.data), 'levels': len(equivalent.levels),
+              'full_s': full_s, 'equivalent_s': equivalent_s, 'speedup': full_s / equivalent_s,
+              'full_non_converged': int(np.count_nonzero(~converged)),
+              'max_error': {key: float(np.max(error)) for key, error in errors.items()},
+              'max_error_converged': {key: float(np.max(error[converged], initial=0.0))
+                                      for key, error in errors.items()},
+              'tolerance': tolerance}
+    report['valid'] = max(report['max_error_converged'][key] for key in VOLTAGES) <= tolerance
+
+    print(f"Network equivalent at bus {report['bus']} ({report['control_mode']}): "
+          f"{report['points']} points in {equivalent_s:.2f} s against {full_s:.2f} s ({report['speedup']:.1f}x)")
+    for key, error in report['max_error'].items():
+        print(f"  max {key} error: {error:.2e} ({report['max_error_converged'][key]:.2e} where the feeder converged)")
+    print(f"  {report['full_non_converged']} points of the full feeder not converged; equivalent "
+          f"{'within' if report['valid'] else 'NOT within'} {tolerance:g} pu")
+
+    if file_path is not None:
+        with open(file_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"File saved at: {file_path}")
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate the network equivalent of the feeder at the DER bus '
+                                                 'against the full feeder solution.')
+    parser.add_argument('scenario_files', nargs='+',
+                        help='scenario files: JSON (one object or a list of objects) or DER.txt format')
+    parser.add_argument('-o', '--output-dir', default='results',
+                        help='directory for the validation reports (default: results)')
+    parser.add_argument('--tolerance', type=float, default=VALID_VOLTAGE_ERROR,
+                        help='largest voltage error (pu) of a valid equivalent; the exit status is 1 when a '
+                             f'scenario exceeds it (default: {VALID_VOLTAGE_ERROR:g})')
+    args = parser.parse_args()
+
+    scenarios = []
+    for file_path in args.scenario_files:
+        scenarios.extend(load_scenarios(file_path))
+
+    # Paths are resolved before OpenDSS changes the working directory to the feeder folder
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    session = dss_session.FeederSession()
+    equivalent = NetworkEquivalent()
+    invalid = []
+    for k, scenario in enumerate(scenarios):
+        if not isinstance(scenario, Scenario):
+            scenario = Scenario.from_der_data(scenario)
+        name = scenario.name or f'scenario_{k + 1:03d}'
+        report = validate(scenario.as_der_data(), session, equivalent,
+                          os.path.join(output_dir, f'{name}_{scenario.control_mode}_equivalent.json'), args.tolerance)
+        if not report['valid']:
+            invalid.append(name)
+
+    if invalid:
+        print(f"The network equivalent exceeds {args.tolerance:g} pu for: {', '.join(invalid)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
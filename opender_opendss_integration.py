@@ -1,17 +1,23 @@
-import os
-import pathlib
+import copy
+import time
 import numpy as np
 from opender import DER, DER_PV
-import py_dss_interface
 import data_export_plot
+import dss_controls
+import dss_session
+import feeder_map
+import loadshapes
+from result_recorder import ResultRecorder
+from simulation_result import SimulationResult
 
-def data_processing(plot):
-    # Obtaining the current directory
-    current_dir = os.path.abspath(__file__)
+def data_processing(plot, session=None):
+    # Path to the DER.txt file in the 'docs' directory
+    file_path = data_export_plot.docs_path('DER.txt')
 
-    # Relative path to DER.txt file
-    file_path = os.path.join(current_dir, '../docs/DER.txt')
+    # Run the scenario stored in DER.txt
+    return run_scenario(load_der_config(file_path), plot, session)
 
+def load_der_config(file_path):
     # Dictionary to store DER.txt values
     der_data = {}
 
@@ -21,6 +27,25 @@ def data_processing(plot):
             key, value = line.strip().split()  # Split line into key and value
             der_data[key] = convert_value(value)  # Convert and store in dictionary
 
+    return der_data
+
+def run_scenario(der_data, plot=False, session=None, export=True, plot_circuit=True, export_format='csv',
+                 record_path=None, step_callback=None, profiler=None, cache=None, irradiance=None, temperature=None,
+                 load=None, adaptive=False, iterate=False, tolerance=1e-4, equivalent=None, snapshots=None):
+    # Run the simulation described by a dictionary with the DER.txt keys and return its results
+    # as a SimulationResult. The plots use the results in memory; export writes them to 'docs'.
+    # With record_path, the DER results are streamed to that file during the run, step_callback
+    # is called after every point and a profiling.SimulationProfiler collects timings (see feeder()).
+    # With a result_cache.ResultCache, a scenario simulated before is read from the cache instead;
+    # step_callback is then called for every cached point, the feeder map is the one stored with
+    # the results and the result is marked as cached. Runs with record_path or a profiler are not
+    # cached, as their file and timings come from the simulation itself. Measured irradiance, temperature and load multiplier
+    # series can replace the default profiles (see feeder()); runs with such series are not cached,
+    # nor are adaptive runs, which skip the solution of steady points, iterated runs, which iterate
+    # each step to convergence, or runs on a network_equivalent.NetworkEquivalent of the feeder at
+    # the DER bus (see feeder()). A feeder_snapshots.FeederSnapshots records the voltages of the
+    # whole feeder; such runs are not cached either.
+
     # Accessing corresponding variables
     simulation_time = der_data.get('simulation_time')
     number_steps = der_data.get('number_steps')
@@ -47,6 +72,86 @@ def data_processing(plot):
     P_rated = S_rated * PF_rated
     Q_rated = np.sqrt(S_rated ** 2 - P_rated ** 2)
 
+    # Create the OpenDER object for the selected control mode
+    der_obj, title = create_der(S_rated, PF_rated, V_rated, control_mode, CONST_Q, normal_op_CAT, abnormal_op_CAT)
+
+    # feeder() maps the power flow of the last step
+    map_path = data_export_plot.docs_path('feeder_map.png') if plot_circuit and number_steps > 0 else None
+
+    # Results of the same scenario on the same feeder, code and package versions
+    data = None
+    if (record_path is not None or profiler is not None or irradiance is not None or temperature is not None
+            or load is not None or adaptive or iterate or equivalent is not None or snapshots is not None):
+        cache = None
+    if cache is not None:
+        key = cache.key(der_data, session.dss_file if session is not None else None)
+        data = cache.get(key, with_map=map_path is not None)
+
+    cached = data is not None
+    if cached:
+        if map_path is not None:
+            cache.get_map(key, map_path)
+        if step_callback is not None:
+            replay_steps(data, step_callback)
+    else:
+        # Run the OpenDSS feeder simulation
+        if DER == 'True':
+            data = feeder(simulation_time, number_steps, npts, bus, V_rated, line, S_rated,
+                          PF_rated, P_rated, Q_rated, der_obj, control_mode, session, False, plot_circuit,
+                          record_path=record_path, step_callback=step_callback, profiler=profiler,
+                          irradiance=irradiance, temperature=temperature, load=load, adaptive=adaptive,
+                          iterate=iterate, tolerance=tolerance, equivalent=equivalent, snapshots=snapshots)
+        else:
+            data = feeder(simulation_time, number_steps, npts, bus, V_rated, line,
+                          None, None, None, None, None, None, session, False, plot_circuit,
+                          step_callback=step_callback, profiler=profiler, load=load, adaptive=adaptive,
+                          tolerance=tolerance, equivalent=equivalent, snapshots=snapshots)
+
+        if cache is not None:
+            cache.put(key, data, der_data, map_path)
+
+    if DER == 'True':
+        result = SimulationResult(data, bus, control_mode, title, der_obj, aux, der_data, cached=cached)
+    else:
+        result = SimulationResult(data, bus, scenario=der_data, cached=cached)
+
+    # Export data to the selected format
+    if export:
+        start = time.perf_counter()
+        result.export(export_format)
+        if profiler is not None:
+            profiler.add_phase('export', time.perf_counter() - start)
+
+    if plot == True:
+        result.plot()
+
+    return result
+
+def replay_steps(data, step_callback):
+    # Call step_callback(i, npts, sample) for every point of results read from the cache, with the
+    # samples feeder() gives it during a simulation
+    npts = len(data)
+    t = data['Time (s)'].to_numpy()
+    if 'P (pu)' not in data:
+        for i in range(npts):
+            step_callback(i, npts, {'t': t[i]})
+        return
+
+    columns = {key: data[column].to_numpy() for key, column in
+               [('p', 'P (pu)'), ('q', 'Q (pu)'), ('vm', 'Vm (pu)'), ('va', 'Va (pu)'), ('vb', 'Vb (pu)'),
+                ('vc', 'Vc (pu)')]}
+    currents = data[['Ia (pu)', 'Ib (pu)', 'Ic (pu)']].to_numpy()
+    angles = data[['Ia Angle (rad)', 'Ib Angle (rad)', 'Ic Angle (rad)']].to_numpy()
+    status = data['Status'].to_numpy()
+    for i in range(npts):
+        sample = {'t': t[i], **{key: values[i] for key, values in columns.items()},
+                  'i': currents[i].tolist(), 'i_angle': angles[i].tolist(), 'status': str(status[i])}
+        step_callback(i, npts, sample)
+
+def create_der(S_rated, PF_rated, V_rated, control_mode, CONST_Q, normal_op_CAT, abnormal_op_CAT):
+    # Create the OpenDER PV object for a DER rated S_rated (VA) and return it with the plot title
+    P_rated = S_rated * PF_rated
+
     # Set maximum injection and absorption based on operation category
     if normal_op_CAT == 'B':
         max_inj = 0.44  # Maximum injection for Category B
@@ -92,211 +197,499 @@ def data_processing(plot):
     der_obj.der_file.NP_NORMAL_OP_CAT = f'CAT_{normal_op_CAT}'
     der_obj.der_file.NP_ABNORMAL_OP_CAT = f'CAT_{abnormal_op_CAT}'
 
-    # Run the OpenDSS feeder simulation
-    if DER == 'True':
-        feeder(simulation_time, number_steps, npts, bus, V_rated, line, S_rated,
-               PF_rated, P_rated, Q_rated, der_obj, control_mode)
-
-        if plot == True:
-            data_export_plot.plotter_with_der(control_mode, title, der_obj, aux)
+    return der_obj, title
+
+def der_state(der_obj):
+    # Copy of the dynamic state of an OpenDER object (elapsed time, status, filters, delays and
+    # ramps), to run the same time step again. The object itself and its settings are not copied.
+    return copy.deepcopy(der_obj.__dict__, {id(der_obj): der_obj, id(der_obj.der_file): der_obj.der_file})
+
+def restore_der_state(der_obj, state):
+    # Bring an OpenDER object back to a state copied by der_state(); the copy can be restored again
+    der_obj.__dict__.update(copy.deepcopy(state, {id(der_obj): der_obj, id(der_obj.der_file): der_obj.der_file}))
+
+# Largest number of network/DER iterations of a point in iterated runs
+MAX_STEP_ITERATIONS = 20
+
+def feeder(simulation_time, number_steps, npts, bus, V_rated, line, S_rated, PF_rated, P_rated, Q_rated, der_obj, control_mode,
+           session=None, export=True, plot_circuit=True, export_format='csv', scenario=None, record_path=None,
+           chunk_size=3600, step_callback=None, profiler=None, irradiance=None, temperature=None, load=None,
+           adaptive=False, iterate=False, tolerance=1e-4, equivalent=None, snapshots=None):
+    # Simulate the feeder with or without the DER and return the results as a DataFrame. The DER
+    # results are recorded into preallocated arrays; with record_path, only chunk_size points are
+    # kept in memory and the rest are written to record_path, which the DataFrame memory-maps.
+    # step_callback(i, npts, sample) is called after each point with a dictionary of the values
+    # recorded for it (only the time 't' without DER), e.g. for progress reports or live plots.
+    # A profiling.SimulationProfiler passed as profiler receives the solve, readout, OpenDER run
+    # and update times and the solution counters of every point, and the time of each phase.
+    # irradiance, temperature and load are optional arrays with one value per point (e.g. measured
+    # series from loadshapes.load_series()) replacing the default PV profiles and load multipliers.
+    # With adaptive, a plateau of constant inputs (load multiplier, DC power, irradiance and
+    # temperature) is fast-forwarded once MIN_SETTLE_POINTS of its points are solved, the DER output
+    # and voltages have settled, i.e. their expected change until the end of the plateau is below
+    # tolerance (pu, see remaining_change()), and no regulator is out of its band: its remaining
+    # points keep the settled network solution without solving the feeder, so a pulse study costs
+    # about as much as its transitions. OpenDER still runs at these points on the settled terminal
+    # measurements, so its delays, filters and ramps advance; once its output moves by tolerance or
+    # its status changes, the feeder is solved again from the next point. Only the solved points
+    # are profiled.
+    # With iterate, the network and the DER are solved together at each point: the feeder is solved
+    # again with the new DER setpoints (without control actions, starting from the last solution)
+    # and OpenDER is run again from its state at the start of the point, until its reactive power
+    # and voltage change by less than tolerance (pu) or MAX_STEP_ITERATIONS is reached. Otherwise
+    # the setpoints computed at a point only take effect at the next one.
+    # With a network_equivalent.NetworkEquivalent as equivalent, the DER bus is solved on that
+    # reduced model of the feeder instead of the whole network (for a DER with constant irradiance
+    # and temperature); the levels of the load multiplier it lacks are extracted first. The
+    # feeder is not plotted.
+    # A feeder_snapshots.FeederSnapshots passed as snapshots records the voltage of every node of the
+    # feeder (and the loading of its lines and transformers) at each point, read from the whole
+    # circuit at once; steady points skipped by adaptive repeat the last solved one.
+    # Measured series need one value per point (irradiance and temperature may also be constant)
+    for name, values in [('irradiance', irradiance), ('temperature', temperature)]:
+        if values is not None:
+            loadshapes.check_length(name, values, npts, single=True)
+    if load is not None:
+        loadshapes.check_length('load', load, npts)
+
+    t_start = time.perf_counter()
+
+    # Compile the feeder, or bring an already compiled session back to its baseline
+    if session is None:
+        session = dss_session.FeederSession()
+        t_compiled = time.perf_counter()
     else:
-        feeder(simulation_time, number_steps, npts, bus, V_rated, line,
-               None, None, None, None, None, None)
-
-        if plot == True:
-            data_export_plot.plotter_without_der(bus)
-
-def feeder(simulation_time, number_steps, npts, bus, V_rated, line, S_rated, PF_rated, P_rated, Q_rated, der_obj, control_mode):
-    # Prepare arrays for storing simulation results
-    t_data = []
-    vm_data = []
-    va_data = []
-    vb_data = []
-    vc_data = []
-    p_data = []
-    q_data = []
-    status_data = []
-    i_data = []
-    i_angle_data = []
-
-    # Determine the path to the OpenDSS DSS file
-    script_path = os.path.dirname(os.path.abspath(__file__))
-    dss_file = pathlib.Path(script_path).joinpath("feeders", "8500-Node", "Master.dss")
-
-    # Initialize the OpenDSS interface
-    dss = py_dss_interface.DSS()
-    dss.text(f'compile [{dss_file}]')  # Compile the DSS file
-
-    # Add and configure various elements in the simulation
-    dss.text('New Energymeter.m1 Line.ln5815900-1 1')  # Add an energy meter
-    dss.text('batchedit capacitor..* enabled=no')      # Disable all capacitors
-    dss.text('batchedit load..* mode=1')               # Set load mode
-    dss.text('batchedit load..* vmaxpu=1.25')          # Set maximum voltage per unit for loads
-    dss.text('batchedit load..* vminpu=0.75')          # Set minimum voltage per unit for loads
-    dss.text('set maxiterations=100')                  # Set maximum iterations
-    dss.text('set maxcontrolit=100')                    # Set maximum control iterations
-    dss.text('AddBusMarker bus=l3104830 color=red size=8 code=15')  # Add a bus marker for visualization
-
-    # Define performance and efficiency curves for the PV system
-    dss.text('New XYCurve.PvsT npts=4 xarray=[0 25 75 100] yarray=[1.2 1 .8 .6]')
-    dss.text('New XYCurve.Eff npts=4 xarray=[.1 .2 .4 1.0] yarray=[.86 .9 .93 .97]')
+        t_compiled = t_start
+        session.reset()
+    dss = session.dss
 
-    if S_rated is not None:
-        if number_steps == 0:
-            # Configuration for dynamic simulation
-            t_s = simulation_time
-            DER.t_s = t_s
-
-            # Define irradiance and temperature profiles
-            dss.text('New Loadshape.Irrad npts=24 interval=1')
-            dss.text('~ mult=[0 0 0 0 0 0 .1 .2 .3 .5 .8 .9 1 1 .99 .9 .7 .4 .1 0 0 0 0 0]')
-            dss.text('New Tshape.Temp npts=24 interval=1')
-            dss.text('~ temp=[25 25 25 25 25 25 25 25 35 40 45 50 60 60 55 40 35 30 25 25 25 25 25 25]')
-
-            # Configure the PV system
-            dss.text(f'New PVSystem.PV phases=3 bus1={bus} kV={V_rated} kva={S_rated / 1000} kvar={Q_rated / 1000} Pmpp={S_rated / 1000} PF={PF_rated / 1000}')
-            dss.text("~ irradiance=0.98 %cutin=0.1 %cutout=0.1 effcurve=Eff P-TCurve=PvsT daily=Irrad Tdaily=Temp")
-
-            # Add monitors for voltage and power
-            dss.text('New Monitor.DER_voltage element=PVSystem.PV terminal=1 mode=0')
-            dss.text('New Monitor.DER_power element=PVSystem.PV terminal=1 mode=1 ppolar=no')
-
-            per_load = generate_output(-0.2, 24, 'list')
-        else:
-            # Configuration for dynamic simulation
-            t_s = simulation_time / npts
-            DER.t_s = t_s
-
-            # Define irradiance and temperature profiles
-            dss.text(f'New Loadshape.Irrad npts={npts} interval=1')
-            Irrad = generate_output(1, npts, 'string')
-            dss.text(f'~ mult=[{Irrad}]')
-            dss.text(f'New Tshape.Temp npts={npts} interval=1')
-            Temp = generate_output(25, npts, 'string')
-            dss.text(f'~ temp=[{Temp}]')
-
-            # Configure the PV system
-            dss.text(f'New PVSystem.PV phases=3 bus1=l3104830 kV={V_rated} kva={S_rated / 1000} kvar={Q_rated / 1000} Pmpp={S_rated / 1000} PF={PF_rated / 1000}')
-            dss.text("~ irradiance=0.98 %cutin=0.1 %cutout=0.1 effcurve=Eff P-TCurve=PvsT daily=Irrad Tdaily=Temp")
-
-            # Add monitors for voltage and power
-            dss.text('New Monitor.DER_voltage element=PVSystem.PV terminal=1 mode=0')
-            dss.text('New Monitor.DER_power element=PVSystem.PV terminal=1 mode=1 ppolar=no')
-
-            per_load = generate_numbers(0.5, -0.2, 1.2, number_steps, npts)  # Generate load data
-    else:
-        if number_steps == 0:
-            t_s = simulation_time
+    # Time step and load multiplier for each point of the simulation
+    t_s, per_load = load_profile(simulation_time, number_steps, npts)
+    if load is not None:
+        per_load = load
 
-            # Add a monitor for bus voltage
-            dss.text(f'New Monitor.BUS_voltage element=LINE.{line} terminal=1 mode=0')
+    if S_rated is not None:
+        # Configuration for dynamic simulation
+        DER.t_s = t_s
 
-            per_load = generate_output(-0.2, 24, 'list')
-        else:
-            t_s = simulation_time / npts
+        # Define irradiance and temperature profiles
+        irradiance, temperature = der_profiles(number_steps, irradiance, temperature)
+        define_der_profiles(session, number_steps, npts, t_s, irradiance, temperature)
 
-            # Add a monitor for bus voltage
-            dss.text(f'New Monitor.BUS_voltage element=LINE.{line} terminal=1 mode=0')
+        # Configure the PV system
+        session.define('PVSystem.PV', f'phases=3 bus1={bus} kV={V_rated} kva={S_rated / 1000} kvar={Q_rated / 1000} Pmpp={S_rated / 1000} PF={PF_rated / 1000} '
+                       'irradiance=0.98 %cutin=0.1 %cutout=0.1 effcurve=Eff P-TCurve=PvsT daily=Irrad Tdaily=Temp')
 
-            per_load = generate_numbers(0.5, -0.2, 1.2, number_steps, npts)
+        # Add monitors for voltage and power
+        session.define('Monitor.DER_voltage', 'element=PVSystem.PV terminal=1 mode=0')
+        session.define('Monitor.DER_power', 'element=PVSystem.PV terminal=1 mode=1 ppolar=no')
+    else:
+        # Add a monitor for bus voltage
+        session.define('Monitor.BUS_voltage', f'element=LINE.{line} terminal=1 mode=0')
 
     # Set simulation mode to daily and configure step size
     dss.text('set mode=daily')
     dss.text(f'set stepsize={t_s / 3600}h')
     dss.text('set number=1')
 
+    # Per-step settings go through the OpenDSS API instead of text commands
+    controls = dss_controls.FeederControls(dss, ['PV'] if S_rated is not None else [])
+    network = dss
+
+    if equivalent is not None:
+        # The network equivalent takes the settings and gives the solution instead of OpenDSS
+        if S_rated is None or np.unique(irradiance).size > 1 or np.unique(temperature).size > 1:
+            raise ValueError('A network equivalent needs a DER with constant irradiance and temperature')
+        if snapshots is not None:
+            raise ValueError('Feeder snapshots need the solution of the whole feeder, not a network equivalent')
+        controls = network = equivalent.extract(session, 'PV', per_load)
+        plot_circuit = False
+
+    if snapshots is not None:
+        snapshots.begin(session, npts)
+
+    # Points where the feeder is plotted are always solved
+    plot_points = [number_steps - 1] if plot_circuit and 0 < number_steps <= npts else []
+
+    if profiler is not None:
+        profiler.begin(npts)
+    t_loop = time.perf_counter()
+
+    # Adaptive stepping: last point of the plateau to fast-forward, points skipped since the last
+    # solution, points of the plateau solved so far and largest change of the outputs between the
+    # last two points
+    skip_to = -1
+    skipped = 0
+    solved_points = 0
+    change = None
+
     if der_obj is not None:
+        # Prepare arrays for storing simulation results
+        recorder = ResultRecorder([('t', 1), ('p', 1), ('q', 1), ('vm', 1), ('va', 1), ('vb', 1), ('vc', 1),
+                                   ('i', 3), ('i_angle', 3)], npts, record_path, chunk_size)
+
+        # Determine the active power of each point based on control mode
+        p_dc = [der_dc_power(der_obj, P_rated, i, npts, number_steps) for i in range(npts)]
+        if adaptive:
+            plateau_end = input_plateaus(npts, [per_load, p_dc, irradiance, temperature], plot_points)
+
         for i in range(npts):
+            if i <= skip_to:
+                # Steady network: OpenDER runs on the settled terminal measurements
+                der_obj.update_der_input(v=V, theta=Theta, p_dc_w=p_dc[i])
+                der_obj.run()
+                I, angle = der_obj.get_der_output('I_pu')
+                controls.set_pv_output('PV', der_obj.p_out_pu, der_obj.q_out_pu, der_obj.q_out_kvar)
+
+                sample = dict(settled_sample, t=i * t_s, i=I, i_angle=angle)
+                if number_steps != 0:
+                    sample['p'], sample['q'] = der_obj.p_out_pu, der_obj.q_out_pu
+                recorder.record(status=der_obj.der_status, **sample)
+                skipped += 1
+
+                # The feeder is solved again once the DER departs from the settled output
+                if (max(abs(der_obj.p_out_pu - settled_output[0]), abs(der_obj.q_out_pu - settled_output[1])) >= tolerance
+                        or der_obj.der_status != settled_status):
+                    skip_to = i
+                    solved_points = 0
+                    change = None
+
+                if snapshots is not None:
+                    snapshots.repeat(i * t_s)
+
+                if step_callback is not None:
+                    sample['status'] = der_obj.der_status
+                    step_callback(i, npts, sample)
+                continue
+
+            t_step = time.perf_counter()
+
+            if skipped:
+                # Move the OpenDSS clock over the skipped points
+                dss.solution.dbl_hour = dss.solution.dbl_hour + skipped * t_s / 3600
+                skipped = 0
+
             # Set load condition based on per_load data
-            dss.text(f'set loadmult={per_load[i]}')
+            controls.set_load_mult(per_load[i])
 
             # Solve the simulation
-            dss.solution.solve()
-
-            # Determine the active power based on control mode
-            if number_steps != 0 and (der_obj.der_file.CONST_PF_MODE_ENABLE == True or der_obj.der_file.QP_MODE_ENABLE == True or der_obj.der_file.CONST_Q_MODE_ENABLE == True):
-                if i < npts / 4:
-                    per = 0.3
-                elif i > npts * 3 / 4:
-                    per = 0
-                elif i < npts / 2:
-                    per = 1
+            network.solution.solve()
+            solve_s = time.perf_counter() - t_step
+            readout_s = der_run_s = update_s = 0.0
+
+            if iterate:
+                # Dynamic state of the DER at the start of the point
+                state = der_state(der_obj)
+
+            for iteration in range(MAX_STEP_ITERATIONS if iterate else 1):
+                if iteration > 0:
+                    # Solve the point again with the new setpoints
+                    t_solve = time.perf_counter()
+                    network.solution.solve_no_control()
+                    solve_s += time.perf_counter() - t_solve
+                t_solved = time.perf_counter()
+
+                # Read the present step's measurements at the DER terminal
+                if equivalent is None:
+                    controls.activate_pv('PV')
+                    V, Theta, P, Q = read_active_terminal(dss)
                 else:
-                    per = 0.6
-                p_dc_w = P_rated * per  # Active power adjusted
+                    V, Theta, P, Q = equivalent.read_terminal()
+                t_read = time.perf_counter()
+
+                if iteration > 0:
+                    # Run the point again from the state it started with
+                    restore_der_state(der_obj, state)
+
+                # Update DER input with monitoring data
+                der_obj.update_der_input(v=V, theta=Theta, p_dc_w=p_dc[i])
+                der_obj.run()
+
+                # Recover current from DER
+                I, angle = der_obj.get_der_output('I_pu')
+                t_run = time.perf_counter()
+
+                # Update the PV system settings; iterated points are solved again with them
+                controls.set_pv_output('PV', der_obj.p_out_pu, der_obj.q_out_pu, der_obj.q_out_kvar,
+                                       immediate=iterate)
+                t_updated = time.perf_counter()
+
+                readout_s += t_read - t_solved
+                der_run_s += t_run - t_read
+                update_s += t_updated - t_run
+
+                if iterate:
+                    # The network and the DER agree once the DER output and voltage stop changing;
+                    # iterating is pointless when the power flow itself does not converge
+                    q, v = der_obj.q_out_pu, der_obj.der_input.v_meas_pu
+                    if iteration > 0 and max(abs(q - last_q), abs(v - last_v)) < tolerance or not network.solution.converged:
+                        break
+                    last_q, last_v = q, v
+
+            if number_steps == 0:
+                # If number_steps is zero, save the power from the steady-state simulation
+                p_out = 1000 * P / S_rated
+                q_out = 1000 * Q / S_rated
             else:
-                p_dc_w = P_rated  # Use rated power if no control mode is enabled
-
-            # Retrieve monitoring data
-            dss.monitors.first()
-            V = [dss.monitors.channel(1), dss.monitors.channel(3), dss.monitors.channel(5)]
-            Theta = [np.deg2rad(dss.monitors.channel(2)), np.deg2rad(dss.monitors.channel(4)), np.deg2rad(dss.monitors.channel(6))]
-
-            dss.monitors.next()
-            P = -np.array(dss.monitors.channel(1)) - np.array(dss.monitors.channel(3)) - np.array(dss.monitors.channel(5))
-            Q = -np.array(dss.monitors.channel(2)) - np.array(dss.monitors.channel(4)) - np.array(dss.monitors.channel(6))
-
-            # Update DER input with monitoring data
-            der_obj.update_der_input(v=[V[0][i], V[1][i], V[2][i]],
-                                     theta=[Theta[0][i], Theta[1][i], Theta[2][i]],
-                                     p_dc_w=p_dc_w)
-            der_obj.run()
-
-            # Recover current from DER
-            I, angle = der_obj.get_der_output('I_pu')
-
-            # Update the PV system settings
-            dss.pvsystems.pf = np.cos(np.arctan2(np.array(der_obj.q_out_pu), np.array(der_obj.p_out_pu)))  # Set power factor
-            dss.pvsystems.kvar = der_obj.q_out_kvar  # Set reactive power
+                p_out = der_obj.p_out_pu
+                q_out = der_obj.q_out_pu
 
             # Save simulation results
-            t_data.append(i * t_s)
-            p_data.append(der_obj.p_out_pu)
-            q_data.append(der_obj.q_out_pu)
-            vm_data.append(der_obj.der_input.v_meas_pu)
-            va_data.append(der_obj.der_input.v_a_pu)
-            vb_data.append(der_obj.der_input.v_b_pu)
-            vc_data.append(der_obj.der_input.v_c_pu)
-            status_data.append(der_obj.der_status)
-            i_data.append(I)
-            i_angle_data.append(angle)
+            sample = {'t': i * t_s, 'p': p_out, 'q': q_out, 'vm': der_obj.der_input.v_meas_pu,
+                      'va': der_obj.der_input.v_a_pu, 'vb': der_obj.der_input.v_b_pu, 'vc': der_obj.der_input.v_c_pu,
+                      'i': I, 'i_angle': angle}
+            recorder.record(status=der_obj.der_status, **sample)
+            if snapshots is not None:
+                snapshots.record(dss, i * t_s)
+
+            if adaptive:
+                # Fast-forward the plateau once the outputs have settled; the status must not change
+                # either, and the regulators of the feeder (not modelled by an equivalent) must stay
+                if i > 0 and plateau_end[i - 1] == plateau_end[i] and der_obj.der_status == settled_status:
+                    solved_points += 1
+                    last_change = change
+                    change = max_change(settled_sample, sample, ['p', 'q', 'vm', 'va', 'vb', 'vc'])
+                    if (solved_points >= MIN_SETTLE_POINTS and remaining_change(last_change, change) < tolerance
+                            and (equivalent is not None or session.regulators_in_band())):
+                        skip_to = plateau_end[i]
+                else:
+                    solved_points = 1
+                    change = None
+                settled_sample = dict(sample)
+                settled_output = (der_obj.p_out_pu, der_obj.q_out_pu)
+                settled_status = der_obj.der_status
 
             # Plot feeder
-            if i == (number_steps - 1):
-                dss.text('Interpolate')
-                dss.text('plot circuit Power max=2000 n n C1=$00FF0000')
-
-        if number_steps == 0:
-            # If number_steps is zero, compute results from steady-state simulation
-            p_data = 1000 * P / S_rated
-            q_data = 1000 * Q / S_rated
-
-        # Export data to CSV
-        data_export_plot.csv_data_with_der(t_data, p_data, q_data, vm_data, va_data, vb_data, vc_data,
-                                           status_data, i_data, i_angle_data, control_mode)
+            if plot_circuit and i == (number_steps - 1):
+                feeder_map.plot_circuit(session)
+
+            if step_callback is not None:
+                sample['status'] = der_obj.der_status
+                step_callback(i, npts, sample)
+
+            if profiler is not None:
+                profiler.record_step(network, i * t_s, solve_s, time.perf_counter() - t_step,
+                                     readout_s, der_run_s, update_s, iteration + 1)
+
+        t_results = time.perf_counter()
+        recorder.close()
+        if snapshots is not None:
+            snapshots.close()
+        records = recorder.records()
+        status_data = recorder.status(records)
+
+        # Export data to the selected format
+        if export:
+            results = data_export_plot.csv_data_with_der(records['t'], records['p'], records['q'], records['vm'],
+                                                         records['va'], records['vb'], records['vc'], status_data,
+                                                         records['i'], records['i_angle'], control_mode,
+                                                         export_format, scenario)
+        else:
+            results = data_export_plot.data_with_der(records['t'], records['p'], records['q'], records['vm'],
+                                                     records['va'], records['vb'], records['vc'], status_data,
+                                                     records['i'], records['i_angle'])
     else:
+        # Row of the monitor recording each point: skipped points repeat the last solved one
+        rows = np.arange(npts)
+        if adaptive:
+            plateau_end = input_plateaus(npts, [per_load], plot_points)
+            v_base = V_rated * 1000 / np.sqrt(3)
+
         for i in range(npts):
+            if i <= skip_to:
+                # Steady state: repeat the settled values
+                rows[i] = rows[i - 1]
+                skipped += 1
+                if snapshots is not None:
+                    snapshots.repeat(i * t_s)
+                if step_callback is not None:
+                    step_callback(i, npts, {'t': i * t_s})
+                continue
+
+            t_step = time.perf_counter()
+
+            if skipped:
+                # Move the OpenDSS clock over the skipped points
+                dss.solution.dbl_hour = dss.solution.dbl_hour + skipped * t_s / 3600
+                skipped = 0
+            rows[i] = rows[i - 1] + 1 if i > 0 else 0
+
             # Set load condition based on per_load data
-            dss.text(f'set loadmult={per_load[i]}')
+            controls.set_load_mult(per_load[i])
 
             # Solve the simulation
             dss.solution.solve()
+            t_solved = time.perf_counter()
+
+            if snapshots is not None:
+                snapshots.record(dss, i * t_s)
+
+            if adaptive:
+                # Fast-forward the plateau once the bus voltages have settled and the regulators stay
+                V = read_der_terminal(dss, f'Line.{line}')[0]
+                sample = {'v': [v / v_base for v in V]}
+                if i > 0 and plateau_end[i - 1] == plateau_end[i]:
+                    solved_points += 1
+                    last_change = change
+                    change = max_change(settled_sample, sample, ['v'])
+                    if (solved_points >= MIN_SETTLE_POINTS and remaining_change(last_change, change) < tolerance
+                            and session.regulators_in_band()):
+                        skip_to = plateau_end[i]
+                else:
+                    solved_points = 1
+                    change = None
+                settled_sample = sample
 
             # Plot feeder
-            if i == (number_steps - 1):
-                dss.text('Interpolate')
-                dss.text('plot circuit Power max=2000 n n C1=$00FF0000')
-
-            # Save simulation results
-            t_data.append(i * t_s)
-
-        # Retrieve bus voltage data
-        va_data = dss.monitors.channel(1)
-        vb_data = dss.monitors.channel(3)
-        vc_data = dss.monitors.channel(5)
-
-        # Export data to CSV
-        data_export_plot.csv_data_without_der(t_data, va_data, vb_data, vc_data, V_rated)
+            if plot_circuit and i == (number_steps - 1):
+                feeder_map.plot_circuit(session)
+
+            if step_callback is not None:
+                step_callback(i, npts, {'t': i * t_s})
+
+            if profiler is not None:
+                profiler.record_step(dss, i * t_s, t_solved - t_step, time.perf_counter() - t_step)
+
+        t_results = time.perf_counter()
+        if snapshots is not None:
+            snapshots.close()
+
+        # Time of each point and bus voltage data
+        t_data = np.arange(npts) * t_s
+        dss.monitors.name = 'BUS_voltage'
+        va_data = np.asarray(dss.monitors.channel(1))[rows]
+        vb_data = np.asarray(dss.monitors.channel(3))[rows]
+        vc_data = np.asarray(dss.monitors.channel(5))[rows]
+
+        # Export data to the selected format
+        if export:
+            results = data_export_plot.csv_data_without_der(t_data, va_data, vb_data, vc_data, V_rated,
+                                                            export_format, scenario)
+        else:
+            results = data_export_plot.data_without_der(t_data, va_data, vb_data, vc_data, V_rated)
+
+    if profiler is not None:
+        # The results phase includes the export when it is done here
+        profiler.add_phase('compile', t_compiled - t_start)
+        profiler.add_phase('setup', t_loop - t_compiled)
+        profiler.add_phase('loop', t_results - t_loop)
+        profiler.add_phase('results', time.perf_counter() - t_results)
+
+    return results
+
+# Changes between points (pu) at the level of the solution round-off, counted as steady state
+SETTLED_CHANGE = 1e-9
+
+# Points of a plateau solved before adaptive runs may fast-forward it
+MIN_SETTLE_POINTS = 3
+
+def input_plateaus(npts, series, breaks=()):
+    # Last point of the plateau each point belongs to: the points up to the next change of any of
+    # the input series (one value per point, or a single value for a constant input). A plateau
+    # also starts at each point in breaks.
+    starts = np.zeros(npts, dtype=bool)
+    for values in series:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size > 1:
+            values = np.resize(values, npts)
+            starts[1:] |= values[1:] != values[:-1]
+    starts[list(breaks)] = True
+
+    ends = np.append(np.flatnonzero(starts[1:]), npts - 1)
+    return ends[np.searchsorted(ends, np.arange(npts))]
+
+def max_change(previous, sample, keys):
+    # Largest absolute change between two samples over the given keys (scalars or lists)
+    return max(np.max(np.abs(np.subtract(sample[key], previous[key]))) for key in keys)
+
+def remaining_change(last_change, change):
+    # Expected change of a settling output until the end of a plateau, from its last two changes
+    # between points. The DER responses are first-order, so the changes decay geometrically by
+    # r = change / last_change and add up to change * r / (1 - r). Zero when both changes are at
+    # round-off level; infinite (not settled) when only one change is known, the changes do not
+    # decrease or the output stops abruptly, which is not a decay to extrapolate from.
+    if change is None or last_change is None:
+        return np.inf
+    if change <= SETTLED_CHANGE:
+        return 0.0 if last_change <= SETTLED_CHANGE else np.inf
+    if change >= last_change:
+        return np.inf
+    ratio = change / last_change
+    return change * ratio / (1 - ratio)
+
+def read_der_terminal(dss, element):
+    # Read the phase voltages (V), angles (rad) and delivered powers (kW, kvar) at the first
+    # terminal of the given element for the present solution only. Reading the active element
+    # keeps the per-step cost constant, whereas monitor channels return the whole history.
+    dss.circuit.set_active_element(element)
+    return read_active_terminal(dss)
+
+def read_active_terminal(dss):
+    # Same readout for the active circuit element (e.g. activated by dss_controls.FeederControls)
+    v_mag_ang = dss.cktelement.voltages_mag_ang
+    powers = dss.cktelement.powers
+
+    V = v_mag_ang[0:6:2]
+    Theta = np.deg2rad(v_mag_ang[1:6:2]).tolist()
+
+    # Element powers are positive into the terminal, so generation is negative. Subtracting
+    # from 0.0 avoids a negative zero without output, which would turn the power factor to -1
+    P = 0.0 - (powers[0] + powers[2] + powers[4])
+    Q = 0.0 - (powers[1] + powers[3] + powers[5])
+
+    return V, Theta, P, Q
+
+# Hourly irradiance (pu) and temperature (degrees) of the 24-hour simulation
+IRRADIANCE_24H = [0, 0, 0, 0, 0, 0, .1, .2, .3, .5, .8, .9, 1, 1, .99, .9, .7, .4, .1, 0, 0, 0, 0, 0]
+TEMPERATURE_24H = [25, 25, 25, 25, 25, 25, 25, 25, 35, 40, 45, 50, 60, 60, 55, 40, 35, 30, 25, 25, 25, 25, 25, 25]
+
+def load_profile(simulation_time, number_steps, npts):
+    # Return the time step (s) and the load multiplier of each point: a constant 24-hour
+    # profile when number_steps is zero, otherwise the rectangular load pulses
+    if number_steps == 0:
+        t_s = simulation_time
+        per_load = generate_output(-0.2, 24, 'list')
+    else:
+        t_s = simulation_time / npts
+        per_load = generate_numbers(0.5, -0.2, 1.2, number_steps, npts)  # Generate load data
+
+    return t_s, per_load
+
+def der_profiles(number_steps, irradiance=None, temperature=None):
+    # Irradiance and temperature profiles of a simulation: the given arrays, or by default the daily
+    # profiles above in the 24-hour mode and a constant irradiance of 1 and temperature of 25 degrees
+    # in the pulse mode
+    if irradiance is None:
+        irradiance = IRRADIANCE_24H if number_steps == 0 else [1]
+    if temperature is None:
+        temperature = TEMPERATURE_24H if number_steps == 0 else [25]
+
+    return irradiance, temperature
+
+def define_der_profiles(session, number_steps, npts, t_s, irradiance=None, temperature=None):
+    # Define the irradiance (Loadshape.Irrad) and temperature (Tshape.Temp) profiles used by the PV
+    # systems, with one value per point of the simulation. Measured series (e.g. from
+    # loadshapes.load_series()) can be given as arrays, otherwise der_profiles() gives the defaults.
+    irradiance, temperature = der_profiles(number_steps, irradiance, temperature)
+
+    loadshapes.define_shape(session, 'Loadshape.Irrad', irradiance, t_s, 'mult')
+    loadshapes.define_shape(session, 'Tshape.Temp', temperature, t_s, 'temp')
+
+def der_dc_power(der_obj, P_rated, i, npts, number_steps):
+    # Available DC power at point i: in the pulse simulation the constant power factor, watt-var
+    # and constant var modes follow a power profile, otherwise the rated power is used
+    if number_steps != 0 and (der_obj.der_file.CONST_PF_MODE_ENABLE == True or der_obj.der_file.QP_MODE_ENABLE == True or der_obj.der_file.CONST_Q_MODE_ENABLE == True):
+        if i < npts / 4:
+            per = 0.3
+        elif i > npts * 3 / 4:
+            per = 0
+        elif i < npts / 2:
+            per = 1
+        else:
+            per = 0.6
+        return P_rated * per  # Active power adjusted
+    else:
+        return P_rated  # Use rated power if no control mode is enabled
 
 def convert_value(value):
     # Convert the value to an integer or float, or return it as a string if it cannot be converted
@@ -0,0 +1,151 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import fields
+import pandas as pd
+import data_export_plot
+import dss_session
+import opender_opendss_integration
+from result_cache import ResultCache
+from scenario import Scenario, load_scenarios
+
+# Feeder session and result cache of the current worker process, set by the pool initializer
+worker_session = None
+worker_cache = None
+
+def sweep_scenarios(base, **grid):
+    # Expand a base scenario (Scenario or dictionary with the DER.txt keys) over every combination
+    # of the values given per key, e.g. S_rated=[1, 2], control_mode=['volt_var', 'watt_var']
+    if isinstance(base, Scenario):
+        base = base.as_der_data()
+
+    keys = list(grid)
+    scenarios = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        scenario = dict(base)
+        scenario.update(zip(keys, values))
+        scenarios.append(scenario)
+
+    return scenarios
+
+def init_worker(dss_file=None, cache=None):
+    # Compile the feeder once per worker process
+    global worker_session, worker_cache
+    worker_session = dss_session.FeederSession(dss_file)
+    worker_cache = cache
+
+def run_worker(index, scenario):
+    # Run one scenario on the worker's session; the SimulationResult is returned instead of written to docs
+    if isinstance(scenario, Scenario):
+        scenario = scenario.as_der_data()
+
+    result = opender_opendss_integration.run_scenario(scenario, plot=False, session=worker_session,
+                                                      export=False, plot_circuit=False, cache=worker_cache)
+    return index, result
+
+def run_sweep(scenarios, workers=None, dss_file=None, cache=None):
+    # Run the scenarios on a pool of worker processes, each with its own OpenDSS instance and
+    # pre-compiled feeder, and yield (index, scenario, result) as soon as each run finishes.
+    # At most two scenarios per worker are queued, so results are streamed back while the
+    # remaining scenarios wait to be submitted. With a result_cache.ResultCache, scenarios
+    # already in the cache are yielded first without simulating them, and new results are stored.
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    scenarios = list(scenarios)
+    missing = []
+    for index, scenario in enumerate(scenarios):
+        if cache is not None and cache.has(cache.key(scenario, dss_file)):
+            if isinstance(scenario, Scenario):
+                scenario = scenario.as_der_data()
+            yield index, scenarios[index], opender_opendss_integration.run_scenario(
+                scenario, plot=False, export=False, plot_circuit=False, cache=cache)
+        else:
+            missing.append((index, scenario))
+
+    if not missing:
+        return
+
+    pending = iter(missing)
+    # Workers are started fresh (spawn) rather than forked, so they do not inherit the OpenDSS
+    # state of a parent process that already compiled a feeder
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(dss_file, cache)) as executor:
+        running = set()
+        for index, scenario in itertools.islice(pending, 2 * workers):
+            running.add(executor.submit(run_worker, index, scenario))
+
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, result = future.result()
+                yield index, scenarios[index], result
+
+                # Keep the workers busy with the next scenario
+                for next_index, next_scenario in itertools.islice(pending, 1):
+                    running.add(executor.submit(run_worker, next_index, next_scenario))
+
+def parse_grid(values):
+    # Grid of sweep_scenarios() from KEY=VALUE1,VALUE2,... arguments; the values stay text until
+    # they are converted to the types of the scenario fields by Scenario.from_der_data()
+    names = {field.name for field in fields(Scenario)} - {'name'}
+    grid = {}
+    for value in values:
+        key, _, items = value.partition('=')
+        if key not in names or not items:
+            raise ValueError(f"'{value}' is not KEY=VALUE1,VALUE2,... with a scenario key "
+                             f"({', '.join(sorted(names))})")
+        grid[key] = items.split(',')
+    return grid
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a scenario over every combination of the given parameter '
+                                                 'values on a pool of worker processes.')
+    parser.add_argument('base', nargs='?', default=None,
+                        help='scenario file (JSON or DER.txt format) whose first scenario is swept '
+                             '(default: the settings of the user interface)')
+    parser.add_argument('-s', '--set', dest='grid', action='append', required=True, metavar='KEY=VALUE1,VALUE2',
+                        help='values of a scenario key to sweep, e.g. S_rated=1,2 or control_mode=volt_var,watt_var; '
+                             'repeat it for more keys')
+    parser.add_argument('-o', '--output-dir', default='results',
+                        help='directory for the result files and the sweep.csv table (default: results)')
+    parser.add_argument('-f', '--format', default='csv', choices=list(data_export_plot.EXPORT_FORMATS),
+                        help='export format of the results (default: csv)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse the results of scenarios simulated before (stored in docs/cache)')
+    args = parser.parse_args()
+
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as error:
+        parser.error(str(error))
+
+    base = load_scenarios(args.base)[0] if args.base is not None else Scenario()
+    scenarios = [Scenario.from_der_data(scenario) for scenario in sweep_scenarios(base, **grid)]
+
+    # The path is resolved before OpenDSS changes the working directory to the feeder folder
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    cache = ResultCache() if args.cache else None
+    rows = []
+    for index, scenario, result in run_sweep(scenarios, args.workers, cache=cache):
+        name = f'sweep_{index + 1:03d}_{result.mode}'
+        file_path = result.export(args.format, os.path.join(output_dir, name))
+        rows.append({'Index': index + 1, **{key: getattr(scenario, key) for key in grid}, 'File': os.path.basename(file_path)})
+
+    table = pd.DataFrame(rows).sort_values('Index').reset_index(drop=True)
+    print(f"{len(table)} scenarios in {time.perf_counter() - start:.1f} s")
+
+    file_path = os.path.join(output_dir, 'sweep.csv')
+    table.to_csv(file_path, index=False)
+    print(f"File saved at: {file_path}")
+
+if __name__ == "__main__":
+    main()
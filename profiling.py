@@ -0,0 +1,98 @@
+import json
+import numpy as np
+import pandas as pd
+
+# Values recorded for each point of the simulation: times in seconds, OpenDSS solution
+# counters, the convergence flag and the number of network/DER iterations of the point
+STEP_DTYPE = np.dtype([('t', np.float64),
+                       ('solve_s', np.float64),
+                       ('iterations', np.int32),
+                       ('control_iterations', np.int32),
+                       ('converged', np.bool_),
+                       ('readout_s', np.float64),
+                       ('der_run_s', np.float64),
+                       ('update_s', np.float64),
+                       ('step_s', np.float64),
+                       ('der_iterations', np.int32)])
+
+# Phases of a run, in the order they happen
+PHASES = ['compile', 'setup', 'loop', 'results', 'export']
+
+class SimulationProfiler:
+    # Timings and counters of a simulation, filled by feeder() and run_scenario() when passed as
+    # profiler=. For every point it keeps the OpenDSS solve time, iteration and control iteration
+    # counts, convergence flag, DER terminal readout time, OpenDER run time and PVSystem update
+    # time; for the whole run, the total time of each phase (compile, setup, loop, results, export).
+    # Phase totals add up over the runs profiled with the same object, the steps are those of the last run.
+    def __init__(self):
+        self.phases = {}
+        self.steps = np.zeros(0, dtype=STEP_DTYPE)
+        self.rows = 0
+
+    def begin(self, npts):
+        # Allocate the step table of a run with npts points
+        self.steps = np.zeros(npts, dtype=STEP_DTYPE)
+        self.rows = 0
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record_step(self, dss, t, solve_s, step_s, readout_s=0.0, der_run_s=0.0, update_s=0.0, der_iterations=1):
+        # Store the times of the point just simulated and the counters of its OpenDSS solution
+        if self.rows == len(self.steps):
+            # More points than announced by begin(): grow the table
+            self.steps = np.concatenate([self.steps, np.zeros(max(len(self.steps), 1), dtype=STEP_DTYPE)])
+
+        self.steps[self.rows] = (t, solve_s, dss.solution.iterations, dss.solution.control_iterations,
+                                 dss.solution.converged, readout_s, der_run_s, update_s, step_s, der_iterations)
+        self.rows += 1
+
+    def steps_frame(self):
+        # Per-step values as a DataFrame
+        return pd.DataFrame(self.steps[:self.rows])
+
+    def summary(self):
+        # Phase totals and statistics of the per-step values
+        steps = self.steps[:self.rows]
+        summary = {'phases_s': {name: self.phases[name] for name in PHASES if name in self.phases},
+                   'points': int(self.rows),
+                   'non_converged': int(np.count_nonzero(~steps['converged'])),
+                   'iterations': int(steps['iterations'].sum()),
+                   'control_iterations': int(steps['control_iterations'].sum()),
+                   'der_iterations': int(steps['der_iterations'].sum())}
+
+        for name in ['solve_s', 'readout_s', 'der_run_s', 'update_s', 'step_s']:
+            values = steps[name]
+            summary[name] = {'total': float(values.sum()),
+                             'mean': float(values.mean()) if values.size else 0.0,
+                             'p50': float(np.percentile(values, 50)) if values.size else 0.0,
+                             'p99': float(np.percentile(values, 99)) if values.size else 0.0,
+                             'max': float(values.max()) if values.size else 0.0}
+
+        return summary
+
+    def report(self):
+        # Short text report of where the time was spent
+        summary = self.summary()
+        lines = [f"{name:<10}{seconds:>10.3f} s" for name, seconds in summary['phases_s'].items()]
+        loop = summary['phases_s'].get('loop') or summary['step_s']['total']
+        for name in ['solve_s', 'readout_s', 'der_run_s', 'update_s']:
+            share = 100 * summary[name]['total'] / loop if loop else 0.0
+            lines.append(f"{name:<10}{summary[name]['total']:>10.3f} s  {share:5.1f}% of loop  "
+                         f"p50 {1000 * summary[name]['p50']:.2f} ms  p99 {1000 * summary[name]['p99']:.2f} ms")
+        lines.append(f"{summary['points']} points, {summary['iterations']} iterations, "
+                     f"{summary['control_iterations']} control iterations, {summary['der_iterations']} network/DER iterations, "
+                     f"{summary['non_converged']} not converged")
+        return '\n'.join(lines)
+
+    def dump(self, file_path):
+        # Write the summary and the per-step values to a JSON file, or only the steps to a CSV file
+        if str(file_path).lower().endswith('.csv'):
+            self.steps_frame().to_csv(file_path, index=False)
+        else:
+            steps = self.steps_frame()
+            with open(file_path, 'w') as f:
+                json.dump({'summary': self.summary(),
+                           'steps': {column: steps[column].tolist() for column in steps.columns}}, f, indent=2)
+
+        print(f"File saved at: {file_path}")
@@ -0,0 +1,148 @@
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import data_export_plot
+import scenario
+
+# Modules whose code determines the simulation results; editing them invalidates the cache
+SOURCE_FILES = ['opender_opendss_integration.py', 'dss_session.py', 'dss_controls.py', 'loadshapes.py',
+                'result_recorder.py', 'data_export_plot.py', 'feeder_map.py']
+
+def default_dss_file():
+    # Master file compiled by dss_session.FeederSession when no other file is given
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    return pathlib.Path(script_path).joinpath("feeders", "8500-Node", "Master.dss")
+
+@functools.lru_cache(maxsize=None)
+def file_digest(file_path, size, mtime):
+    # SHA-256 of a file; the size and modification time are part of the memoized arguments
+    # so the hash is computed again only when the file changes
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cached_digest(file_path):
+    stat = os.stat(file_path)
+    return file_digest(str(file_path), stat.st_size, stat.st_mtime_ns)
+
+def feeder_fingerprint(dss_file=None):
+    # Hashes of every OpenDSS script in the feeder folder and of the simulation code
+    if dss_file is None:
+        dss_file = default_dss_file()
+
+    feeder_dir = os.path.dirname(os.path.abspath(dss_file))
+    fingerprint = {'master': os.path.basename(dss_file)}
+    for file_name in sorted(os.listdir(feeder_dir)):
+        if file_name.lower().endswith('.dss'):
+            fingerprint[file_name] = cached_digest(os.path.join(feeder_dir, file_name))
+
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    for file_name in SOURCE_FILES:
+        fingerprint[file_name] = cached_digest(os.path.join(script_path, file_name))
+
+    return fingerprint
+
+class ResultCache:
+    # On-disk cache of simulation results, addressed by a hash of everything they depend on:
+    # the scenario (DER.txt parameters), the feeder scripts, the simulation code and the
+    # opender/py-dss-interface versions. Entries are NPZ files written with
+    # data_export_plot.write_data(), with the PNG of the feeder map when their run drew it;
+    # the least recently used ones are removed when the cache grows beyond max_bytes.
+    def __init__(self, cache_dir=None, max_bytes=512 * 2 ** 20):
+        if cache_dir is None:
+            cache_dir = data_export_plot.docs_path('cache')
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, der_data, dss_file=None):
+        # Hash of a scenario (Scenario or dictionary with the DER.txt keys) on a feeder
+        if not isinstance(der_data, scenario.Scenario):
+            der_data = scenario.Scenario.from_der_data(der_data)
+
+        content = {'scenario': der_data.as_der_data(),
+                   'feeder': feeder_fingerprint(dss_file),
+                   'versions': data_export_plot.package_versions()}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def map_path(self, key):
+        # Feeder map drawn by the run of an entry
+        return os.path.join(self.cache_dir, key + '.png')
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key, with_map=False):
+        # Cached results DataFrame, or None when the scenario has not been simulated yet (or, with
+        # with_map, was simulated without drawing the feeder map)
+        file_path = self.path(key)
+        if with_map and not os.path.exists(self.map_path(key)):
+            return None
+        try:
+            data, metadata = data_export_plot.read_data(file_path)
+        except (OSError, ValueError, KeyError):
+            # Missing, or incomplete after an interrupted write
+            return None
+
+        # The modification time records the last use, for the LRU eviction
+        os.utime(file_path)
+        return data
+
+    def get_map(self, key, file_path):
+        # Copy the feeder map of an entry to file_path
+        shutil.copyfile(self.map_path(key), file_path)
+        os.utime(self.map_path(key))
+        print(f"File saved at: {file_path}")
+
+    def put(self, key, data, scenario=None, map_path=None):
+        # Store the results (and the feeder map drawn by their run) and evict the least recently
+        # used entries beyond max_bytes
+        tmp_path = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.tmp')
+        tmp_path = data_export_plot.write_data(data, tmp_path, 'npz', scenario)
+        os.replace(tmp_path, self.path(key))
+        if map_path is not None:
+            tmp_path = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.tmp.png')
+            shutil.copyfile(map_path, tmp_path)
+            os.replace(tmp_path, self.map_path(key))
+        self.evict()
+
+    def entries(self):
+        # (last use, size, key) of each entry, oldest first. The results of an entry and its feeder
+        # map count together, with the last use of either of them.
+        entries = {}
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(('.npz', '.png')) and not file_name.endswith(('.tmp.npz', '.tmp.png')):
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+                key = file_name.split('.')[0]
+                mtime, size = entries.get(key, (0, 0))
+                entries[key] = (max(mtime, stat.st_mtime_ns), size + stat.st_size)
+        return sorted((mtime, size, key) for key, (mtime, size) in entries.items())
+
+    def remove(self, key):
+        # Remove the results of an entry together with its feeder map
+        for file_path in (self.path(key), self.map_path(key)):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def evict(self):
+        # Remove whole entries, least recently used first, until the cache fits in max_bytes
+        entries = self.entries()
+        total = sum(size for mtime, size, key in entries)
+        for mtime, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+    def clear(self):
+        for mtime, size, key in self.entries():
+            self.remove(key)
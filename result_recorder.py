@@ -0,0 +1,90 @@
+import json
+import numpy as np
+import pandas as pd
+
+class ResultRecorder:
+    # Records one row of results per simulation step into a preallocated NumPy record array.
+    # Each field holds float64 values (fields with a width hold one value per phase) and the
+    # DER status is stored as a uint8 code into a table of the statuses seen so far.
+    #
+    # When file_path is given, only chunk_size rows are kept in memory: full chunks are
+    # appended to file_path as raw records and the dtype, row count and status table are
+    # written to file_path + '.json' on close(), so the results can be memory-mapped with
+    # load_records() however long the simulation is.
+    def __init__(self, fields, npts, file_path=None, chunk_size=3600):
+        self.dtype = np.dtype([(name, np.float64, width) if width > 1 else (name, np.float64)
+                               for name, width in fields] + [('status', np.uint8)])
+        self.npts = npts
+        self.file_path = file_path
+        self.buffer = np.zeros(min(npts, chunk_size) if file_path else npts, dtype=self.dtype)
+        self.columns = {name: self.buffer[name] for name in self.dtype.names}  # Views of each field
+        self.rows = 0  # Rows in the buffer
+        self.flushed = 0  # Rows already written to file_path
+        self.categories = []
+        self.codes = {}
+
+        if file_path is not None:
+            # Start a new file
+            open(file_path, 'wb').close()
+
+    def status_code(self, status):
+        # Code of a status text, adding it to the table the first time it is seen
+        code = self.codes.get(status)
+        if code is None:
+            code = self.codes[status] = len(self.categories)
+            self.categories.append(status)
+        return code
+
+    def record(self, status=None, **values):
+        # Store the values of the next step, e.g. record(t=0.5, v=[7200, 7190, 7210], status='Trip')
+        if self.rows == len(self.buffer):
+            if self.file_path is None:
+                raise IndexError(f"ResultRecorder is full ({self.npts} points)")
+            self.flush()
+
+        for name, value in values.items():
+            self.columns[name][self.rows] = value
+        if status is not None:
+            self.columns['status'][self.rows] = self.status_code(status)
+        self.rows += 1
+
+    def flush(self):
+        # Append the buffered rows to file_path and empty the buffer
+        if self.file_path is None or self.rows == 0:
+            return
+        with open(self.file_path, 'ab') as f:
+            self.buffer[:self.rows].tofile(f)
+        self.flushed += self.rows
+        self.rows = 0
+
+    def close(self):
+        # Write the remaining rows and the description of the records file
+        if self.file_path is None:
+            return
+        self.flush()
+        with open(self.file_path + '.json', 'w') as f:
+            json.dump({'dtype': self.dtype.descr, 'rows': self.flushed, 'status': self.categories}, f)
+
+    def records(self):
+        # Recorded rows: a view of the buffer, or a read-only memory map of file_path once closed
+        if self.file_path is None:
+            return self.buffer[:self.rows]
+        return load_records(self.file_path)[0]
+
+    def status(self, records=None):
+        # Status column as a pandas Categorical
+        if records is None:
+            records = self.records()
+        return pd.Categorical.from_codes(records['status'], self.categories)
+
+def load_records(file_path):
+    # Memory-map a records file written by ResultRecorder and return it with its status table
+    with open(file_path + '.json', 'r') as f:
+        description = json.load(f)
+
+    dtype = np.dtype([tuple(field) for field in description['dtype']])
+    if description['rows'] == 0:
+        return np.zeros(0, dtype=dtype), description['status']
+
+    records = np.memmap(file_path, dtype=dtype, mode='r', shape=(description['rows'],))
+    return records, description['status']
@@ -0,0 +1,165 @@
+import argparse
+import os
+import time
+import data_export_plot
+import der_fleet
+import dss_session
+import loadshapes
+import network_equivalent
+import opender_opendss_integration
+from feeder_snapshots import FeederSnapshots
+from profiling import SimulationProfiler
+from result_cache import ResultCache
+from scenario import Scenario, load_scenarios
+
+def run_batch(scenarios, output_dir=None, session=None, export_format='csv', profile=False, cache=None,
+              adaptive=False, iterate=False, tolerance=1e-4, equivalent=None, snapshots=None,
+              equivalent_tolerance=network_equivalent.VALID_VOLTAGE_ERROR, fleet=None, irradiance=None,
+              temperature=None, load=None):
+    # Run the scenarios one after the other on a single compiled feeder, without plots or any
+    # Tkinter import, and return their results. When output_dir is given, the results of each
+    # scenario are written to their own file in the selected export format and, with profile,
+    # the timings of each run to {name}_{mode}_profile.json. Scenarios found in the given
+    # result_cache.ResultCache are not simulated again. With adaptive, the steady points of each
+    # load pulse are not solved, and with iterate the network and the DER are solved together at
+    # every point (see opender_opendss_integration.feeder()). A network_equivalent.NetworkEquivalent
+    # given as equivalent replaces the feeder solution and is shared by the scenarios it accepts
+    # (see NetworkEquivalent.accepts(), with equivalent_tolerance); the others run on the full
+    # feeder. With snapshots
+    # set to 'voltages' or 'lines', the voltages of every node of the feeder (and with 'lines' the
+    # loading of every line and transformer) at each point are recorded to {name}_{mode}_snapshots.f32
+    # in output_dir (see feeder_snapshots.FeederSnapshots). With fleet, a list of units read by
+    # der_fleet.load_fleet(), each scenario gives the simulation time and load pulses of a
+    # co-simulation of the whole fleet instead (see der_fleet.fleet_feeder()), whose results are
+    # returned as arrays and written to {name}_fleet. irradiance, temperature and load are
+    # measured series with one value per point replacing the default profiles of every scenario
+    # (see opender_opendss_integration.feeder()).
+    if session is None:
+        session = dss_session.FeederSession()
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    scenarios = [scenario if isinstance(scenario, Scenario) else Scenario.from_der_data(scenario)
+                 for scenario in scenarios]
+
+    # The measured series are checked against every scenario before any of them runs
+    for scenario in scenarios:
+        for name, values in [('irradiance', irradiance), ('temperature', temperature)]:
+            if values is not None:
+                loadshapes.check_length(name, values, scenario.npts, single=True)
+        if load is not None:
+            loadshapes.check_length('load', load, scenario.npts)
+
+    all_results = []
+    for k, scenario in enumerate(scenarios):
+
+        name = scenario.name or f'scenario_{k + 1:03d}'
+        if fleet is not None:
+            file_path = os.path.join(output_dir, f'{name}_fleet') if output_dir is not None else None
+            all_results.append(der_fleet.fleet_feeder(scenario.simulation_time, scenario.number_steps, scenario.npts,
+                                                      fleet, session, export=file_path is not None,
+                                                      export_format=export_format, file_path=file_path))
+            continue
+
+        profiler = SimulationProfiler() if profile else None
+        recording = None
+        if snapshots is not None and output_dir is not None:
+            mode = scenario.control_mode if scenario.DER else 'without_DER'
+            recording = FeederSnapshots(os.path.join(output_dir, f'{name}_{mode}_snapshots.f32'), snapshots == 'lines')
+        der_data = scenario.as_der_data()
+        scenario_equivalent = equivalent
+        if equivalent is not None and not equivalent.accepts(der_data, session, equivalent_tolerance):
+            scenario_equivalent = None
+        result = opender_opendss_integration.run_scenario(der_data, plot=False, session=session,
+                                                          export=False, plot_circuit=False, profiler=profiler,
+                                                          cache=cache, adaptive=adaptive, iterate=iterate,
+                                                          tolerance=tolerance, equivalent=scenario_equivalent,
+                                                          snapshots=recording, irradiance=irradiance,
+                                                          temperature=temperature, load=load)
+        all_results.append(result)
+
+        if output_dir is not None:
+            result.export(export_format, os.path.join(output_dir, f'{name}_{result.mode}'))
+            if profiler is not None:
+                profiler.dump(os.path.join(output_dir, f'{name}_{result.mode}_profile.json'))
+
+    return all_results
+
+def main():
+    parser = argparse.ArgumentParser(description='Run OpenDER/OpenDSS scenarios without the user interface.')
+    parser.add_argument('scenario_files', nargs='+',
+                        help='scenario files: JSON (one object or a list of objects) or DER.txt format')
+    parser.add_argument('-o', '--output-dir', default='results',
+                        help='directory for the result files (default: results)')
+    parser.add_argument('-f', '--format', default='csv', choices=list(data_export_plot.EXPORT_FORMATS),
+                        help='export format of the results (default: csv)')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse the results of scenarios simulated before (stored in docs/cache)')
+    parser.add_argument('--profile', action='store_true',
+                        help='also write the solve, OpenDER and phase timings of each scenario')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='skip the solution of the points of a load pulse once the outputs have settled')
+    parser.add_argument('--iterate', action='store_true',
+                        help='iterate each point between the feeder solution and OpenDER until they agree')
+    parser.add_argument('--equivalent', action='store_true',
+                        help='solve the DER bus on a network equivalent extracted from the feeder instead of the '
+                             'whole feeder, for the scenarios where it passes its validation (the others, and '
+                             'scenarios without DER or in the 24-hour mode, run on the whole feeder)')
+    parser.add_argument('--equivalent-tolerance', type=float, default=network_equivalent.VALID_VOLTAGE_ERROR,
+                        help='largest voltage error (pu) of the network equivalent against the whole feeder for '
+                             f'--equivalent to use it (default: {network_equivalent.VALID_VOLTAGE_ERROR:g})')
+    parser.add_argument('--snapshots', choices=['voltages', 'lines'], default=None,
+                        help='record the voltage of every node of the feeder at each point, and with "lines" the '
+                             'loading of every line and transformer, to {name}_{mode}_snapshots.f32 '
+                             '(summarize it with feeder_snapshots.py)')
+    parser.add_argument('--fleet', default=None,
+                        help='CSV file of DER units (see der_fleet.load_fleet()) to co-simulate together with the '
+                             'simulation time and load pulses of each scenario, written to {name}_fleet')
+    parser.add_argument('--irradiance', default=None,
+                        help='text file with the irradiance (pu) of each point, one value per line (first column '
+                             'of a CSV file), e.g. feeders/8500-Node/Normalized-1s-2900-pts.CSV')
+    parser.add_argument('--temperature', default=None,
+                        help='text file with the PV temperature (degrees) of each point, one value per line')
+    parser.add_argument('--load', default=None,
+                        help='text file with the load multiplier of each point, one value per line')
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help='remaining change (pu) below which --adaptive considers the outputs settled, and '
+                             'change between iterations at which --iterate stops (default: 1e-4)')
+    args = parser.parse_args()
+    if args.equivalent and args.snapshots is not None:
+        parser.error('--snapshots needs the solution of the whole feeder and cannot be used with --equivalent')
+    if args.equivalent and (args.irradiance is not None or args.temperature is not None or args.load is not None):
+        parser.error('--equivalent is validated on the default profiles and needs constant irradiance and '
+                     'temperature, so it cannot be used with --irradiance, --temperature or --load')
+    fleet_options = [option for option, value in [('--cache', args.cache), ('--profile', args.profile),
+                                                  ('--adaptive', args.adaptive), ('--iterate', args.iterate),
+                                                  ('--equivalent', args.equivalent),
+                                                  ('--snapshots', args.snapshots is not None),
+                                                  ('--irradiance', args.irradiance is not None),
+                                                  ('--temperature', args.temperature is not None),
+                                                  ('--load', args.load is not None)] if value]
+    if args.fleet is not None and fleet_options:
+        parser.error(f"--fleet runs the fleet co-simulation, which does not support {', '.join(fleet_options)}")
+
+    scenarios = []
+    for file_path in args.scenario_files:
+        scenarios.extend(load_scenarios(file_path))
+
+    # Paths are resolved before OpenDSS changes the working directory to the feeder folder
+    output_dir = os.path.abspath(args.output_dir)
+    fleet = der_fleet.load_fleet(args.fleet) if args.fleet is not None else None
+    series = {name: loadshapes.load_series(os.path.abspath(file_path)) if file_path is not None else None
+              for name, file_path in [('irradiance', args.irradiance), ('temperature', args.temperature),
+                                      ('load', args.load)]}
+
+    start = time.perf_counter()
+    cache = ResultCache() if args.cache else None
+    equivalent = network_equivalent.NetworkEquivalent() if args.equivalent else None
+    run_batch(scenarios, output_dir, export_format=args.format, profile=args.profile, cache=cache,
+              adaptive=args.adaptive, iterate=args.iterate, tolerance=args.tolerance, equivalent=equivalent,
+              snapshots=args.snapshots, equivalent_tolerance=args.equivalent_tolerance, fleet=fleet, **series)
+    print(f"{len(scenarios)} scenarios completed in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import json
+from dataclasses import dataclass, fields
+import opender_opendss_integration
+
+@dataclass
+class Scenario:
+    # Typed description of one simulation run. The fields are the keys of docs/DER.txt and
+    # the defaults are the values shown by the user interface.
+    simulation_time: float = 90.0
+    number_steps: int = 7
+    pts_per_steps: int = 30
+    DER: bool = True
+    bus: str = 'l3104830'
+    V_rated: float = 12.47
+    line: str = 'LN5563901-2'
+    control_mode: str = 'constant_pf'
+    S_rated: float = 2.0
+    PF_rated: float = 0.92
+    CONST_Q: float = 0.3
+    normal_op_CAT: str = 'B'
+    abnormal_op_CAT: str = 'III'
+    name: str = ''  # Optional label used to name exported results
+
+    def __post_init__(self):
+        # Convert values read from text (DER.txt, JSON, UI entries) to the field types
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if field.type is bool:
+                value = value in (True, 1, 'True', 'true', '1')
+            else:
+                value = field.type(value)
+            setattr(self, field.name, value)
+
+    @classmethod
+    def from_der_data(cls, der_data):
+        # Create a scenario from a dictionary with the DER.txt keys, ignoring unknown keys
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in der_data.items() if key in names})
+
+    @property
+    def npts(self):
+        # Number of points of the simulation: the load pulses, or the 24 hours of the 24-hour mode
+        return self.pts_per_steps * self.number_steps if self.number_steps != 0 else 24
+
+    def as_der_data(self):
+        # Dictionary with the DER.txt keys, as expected by opender_opendss_integration.run_scenario()
+        der_data = {field.name: getattr(self, field.name) for field in fields(self) if field.name != 'name'}
+        der_data['DER'] = str(self.DER)
+        return der_data
+
+    def save(self, file_path):
+        # Write the scenario in the DER.txt format
+        with open(file_path, 'w') as f:
+            for key, value in self.as_der_data().items():
+                f.write(f"{key} {value}\n")
+
+def load_scenarios(file_path):
+    # Read the scenarios of a JSON file (one object or a list of objects) or of a DER.txt file
+    if str(file_path).lower().endswith('.json'):
+        with open(file_path, 'r') as file:
+            data = json.load(file)
+        if isinstance(data, dict):
+            data = [data]
+        return [Scenario.from_der_data(der_data) for der_data in data]
+
+    return [Scenario.from_der_data(opender_opendss_integration.load_der_config(file_path))]
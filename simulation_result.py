@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+import pandas as pd
+import data_export_plot
+
+@dataclass
+class SimulationResult:
+    # Results of one simulation run, kept in memory together with what the plots need
+    # (control mode, title, OpenDER object and points per step). Plotting uses the data
+    # directly; writing it to disk is optional and done with export().
+    data: pd.DataFrame
+    bus: str = ''
+    control_mode: str = None  # None when the feeder was simulated without DER
+    title: str = ''
+    der_obj: object = None
+    aux: int = 0
+    scenario: dict = None
+    file_path: str = None  # Set once the results are exported
+    cached: bool = False  # True when the results were read from a result_cache.ResultCache
+
+    @property
+    def with_der(self):
+        return self.control_mode is not None
+
+    @property
+    def mode(self):
+        # Name of the run used for the exported files, e.g. data_volt_var or data_without_DER
+        return self.control_mode if self.with_der else 'without_DER'
+
+    def plot(self):
+        # Show the figures of the run without reading any file
+        if self.with_der:
+            data_export_plot.plotter_with_der(self.control_mode, self.title, self.der_obj, self.aux, self.data)
+        else:
+            data_export_plot.plotter_without_der(self.bus, self.data)
+
+    def export(self, export_format='csv', file_path=None):
+        # Write the results to file_path (without extension), by default to the 'docs' directory
+        if file_path is None:
+            file_path = data_export_plot.docs_path(f'data_{self.mode}')
+
+        self.file_path = data_export_plot.write_data(self.data, file_path, export_format, self.scenario)
+
+        print(f"File saved at: {self.file_path}")
+
+        return self.file_path
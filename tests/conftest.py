@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+
+# The modules of the repository are imported from its root folder, wherever pytest is run from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dss_session
+
+@pytest.fixture(scope='session')
+def session():
+    # One compiled feeder for the simulations of all the tests
+    return dss_session.FeederSession()
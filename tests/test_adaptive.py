@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import opender_opendss_integration
+from opender_opendss_integration import SETTLED_CHANGE, input_plateaus, remaining_change
+from scenario import Scenario
+
+def test_input_plateaus():
+    # Every point maps to the last point before the next change of any series; constant series
+    # (a single value) never split a plateau, and breaks start a new one
+    load = [1, 1, 1, 2, 2, 3]
+    p_dc = [5, 5, 6, 6, 6, 6]
+    assert input_plateaus(6, [load, p_dc, [1], [25]]).tolist() == [1, 1, 2, 4, 4, 5]
+    assert input_plateaus(6, [load], breaks=[1]).tolist() == [0, 2, 2, 4, 4, 5]
+    assert input_plateaus(4, [[1], [25]]).tolist() == [3, 3, 3, 3]
+
+def test_remaining_change():
+    # Unknown, growing or abruptly stopping changes are not settled
+    assert remaining_change(None, 1e-3) == np.inf
+    assert remaining_change(1e-3, None) == np.inf
+    assert remaining_change(1e-3, 2e-3) == np.inf
+    assert remaining_change(1e-3, 1e-3) == np.inf
+    assert remaining_change(1e-2, SETTLED_CHANGE / 2) == np.inf
+
+    # Round-off changes are settled, and a geometric decay adds up to change * r / (1 - r)
+    assert remaining_change(SETTLED_CHANGE / 2, SETTLED_CHANGE / 4) == 0.0
+    assert remaining_change(4e-3, 2e-3) == pytest.approx(2e-3)
+    assert remaining_change(1e-3, 1e-4) == pytest.approx(1e-4 * 0.1 / 0.9)
+
+def run(session, scenario, **options):
+    # Results of a scenario, without exporting or plotting
+    return opender_opendss_integration.run_scenario(scenario.as_der_data(), False, session, export=False,
+                                                    plot_circuit=False, **options).data
+
+@pytest.mark.parametrize('control_mode', ['volt_watt', 'volt_var'])
+def test_adaptive_matches_full_run(session, control_mode):
+    # The volt-watt response only starts after its delay, with the DER output unchanged over the
+    # first points of the pulse: the fast-forwarded points must still follow it
+    scenario = Scenario(control_mode=control_mode)
+    full = run(session, scenario)
+    adaptive = run(session, scenario, adaptive=True, tolerance=1e-4)
+
+    for column in ['P (pu)', 'Q (pu)', 'Vm (pu)', 'Va (pu)', 'Vb (pu)', 'Vc (pu)']:
+        np.testing.assert_allclose(adaptive[column], full[column], rtol=0, atol=1e-4, err_msg=column)
+    assert (adaptive['Status'].astype(str) == full['Status'].astype(str)).all()
+
+def test_adaptive_without_der_matches_full_run(session):
+    scenario = Scenario(DER=False)
+    full = run(session, scenario)
+    adaptive = run(session, scenario, adaptive=True, tolerance=1e-4)
+
+    for column in ['Va (pu)', 'Vb (pu)', 'Vc (pu)']:
+        np.testing.assert_allclose(adaptive[column], full[column], rtol=0, atol=1e-4, err_msg=column)
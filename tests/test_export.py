@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import data_export_plot
+from dss_controls import power_factor
+
+def results():
+    # Results shaped like those of a simulation with DER: numeric columns and a text status
+    return pd.DataFrame({'Time (s)': np.arange(5) * 0.5,
+                         'P (pu)': np.linspace(0, 1, 5),
+                         'Q (pu)': np.linspace(-0.4, 0.4, 5),
+                         'Status': ['Normal', 'Normal', 'Trip', 'Normal', 'Trip']})
+
+@pytest.mark.parametrize('export_format', ['csv', 'npz', 'parquet'])
+def test_write_read_round_trip(tmp_path, export_format):
+    if export_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    scenario = {'bus': 'l3104830', 'S_rated': 2.0, 'number_steps': np.int64(7)}
+    file_path = data_export_plot.write_data(results(), str(tmp_path / 'data'), export_format, scenario)
+    assert file_path.endswith(data_export_plot.EXPORT_FORMATS[export_format])
+
+    # The binary formats keep the exact values; the CSV text is parsed back to the last digit
+    data, metadata = data_export_plot.read_data(file_path)
+    expected = results()
+    atol = 1e-15 if export_format == 'csv' else 0
+    for column in ['Time (s)', 'P (pu)', 'Q (pu)']:
+        np.testing.assert_allclose(data[column], expected[column], rtol=0, atol=atol, err_msg=column)
+    assert data['Status'].astype(str).tolist() == expected['Status'].tolist()
+
+    # The binary formats keep the scenario and the package versions with the data
+    if export_format == 'csv':
+        assert metadata == {}
+    else:
+        assert metadata['scenario'] == {'bus': 'l3104830', 'S_rated': 2.0, 'number_steps': 7}
+        assert set(metadata['versions']) == {'opender', 'py-dss-interface', 'numpy', 'pandas'}
+
+def test_write_data_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        data_export_plot.write_data(results(), str(tmp_path / 'data'), 'xlsx')
+
+def test_power_factor_sign():
+    # Negative when reactive power is absorbed, unity without reactive power (also for round-off),
+    # and 0 for reactive power without active power
+    pf = power_factor([1.0, 1.0, 1.0, 1.0, 0.0, 0.0], [0.0, 0.5, -0.5, -1e-17, 0.3, 0.0])
+    np.testing.assert_allclose(pf, [1.0, 2 / np.sqrt(5), -2 / np.sqrt(5), 1.0, 0.0, 1.0])
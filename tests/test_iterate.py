@@ -0,0 +1,20 @@
+import numpy as np
+import opender_opendss_integration
+from scenario import Scenario
+
+def run(session, scenario, **options):
+    # Results of a scenario, without exporting or plotting
+    return opender_opendss_integration.run_scenario(scenario.as_der_data(), False, session, export=False,
+                                                    plot_circuit=False, **options).data
+
+def test_iterated_points_reach_fine_simulation(session):
+    # With the network and the DER solved together, the second point of each load pulse already has
+    # the settled output of a simulation with sixty points per pulse. The 1.2 load multiplier pulse
+    # (the sixth) does not converge without iterating, and the last one starts from it.
+    fine = run(session, Scenario(control_mode='volt_var', pts_per_steps=60))
+    iterated = run(session, Scenario(control_mode='volt_var', pts_per_steps=2), iterate=True)
+
+    settled_fine = fine.iloc[59:300:60]
+    settled_iterated = iterated.iloc[1:10:2]
+    np.testing.assert_allclose(settled_iterated['Vm (pu)'], settled_fine['Vm (pu)'], rtol=0, atol=1e-5)
+    np.testing.assert_allclose(settled_iterated['Q (pu)'], settled_fine['Q (pu)'], rtol=0, atol=5e-4)
@@ -0,0 +1,247 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from opender import DER
+import data_export_plot
+import dss_session
+import opender_opendss_integration
+import result_cache
+from scenario import Scenario, load_scenarios
+
+# Three-phase injection (kW, then kvar) applied at each candidate bus to measure the sensitivities.
+# The voltages are far from linear in the injection, so the slope is taken over the size of the
+# DERs studied (2 MVA by default) rather than with a small perturbation.
+STEP_KW = 2000.0
+
+# Snapshot iterations between the linear feeder model and OpenDER, their tolerance (pu) and the
+# fraction of the voltage change applied at each one: the volt-var curves are steep enough for
+# the plain iteration to oscillate on weak buses
+MAX_ITERATIONS = 100
+VOLTAGE_TOLERANCE = 1e-6
+RELAXATION = 0.5
+
+def three_phase_buses(dss, min_kv=1.0, max_kv=35.0):
+    # Buses with three nodes and a line-to-neutral base between min_kv and max_kv: the buses of the
+    # distribution primary where a three-phase DER can be connected
+    buses = []
+    for bus in dss.circuit.buses_names:
+        dss.circuit.set_active_bus(bus)
+        if dss.bus.num_nodes == 3 and min_kv < dss.bus.kv_base < max_kv:
+            buses.append(bus)
+    return buses
+
+class VoltageSensitivity:
+    # Linear model of the voltage magnitude of every node of the feeder (pu) as a function of a
+    # balanced three-phase injection at one of a set of candidate buses:
+    #     v = v0 + dv_dp[bus] * P + dv_dq[bus] * Q    (P in MW, Q in Mvar)
+    # computed once from the compiled feeder by compute() around its solution at load_mult, with
+    # the controls (regulator taps) of that solution. The matrices are stored as float32, one row
+    # per candidate bus and one column per node, so the voltage impact of a DER at any candidate
+    # is a matrix-vector product instead of a co-simulation; cached() keeps them in 'docs/sensitivity'.
+    #
+    # der_output() runs OpenDER in snapshot mode against that model to find the steady-state
+    # output of a scenario's DER at a bus, and rank() screens all the candidates for a scenario.
+    def __init__(self, node_names, buses, kv_base, theta, v0, dv_dp, dv_dq, load_mult, step_kw):
+        self.node_names = np.asarray(node_names)
+        self.buses = np.asarray(buses)
+        self.kv_base = np.asarray(kv_base, dtype=np.float64)
+        self.theta = np.asarray(theta, dtype=np.float32)
+        self.v0 = np.asarray(v0, dtype=np.float32)
+        self.dv_dp = np.asarray(dv_dp, dtype=np.float32)
+        self.dv_dq = np.asarray(dv_dq, dtype=np.float32)
+        self.load_mult = float(load_mult)
+        self.step_kw = float(step_kw)
+
+        self.bus_index = {bus.lower(): k for k, bus in enumerate(self.buses)}
+        node_index = {node.lower(): k for k, node in enumerate(self.node_names)}
+        self.bus_nodes = np.array([[node_index[f'{bus.lower()}.{phase}'] for phase in (1, 2, 3)]
+                                   for bus in self.buses], dtype=np.int64).reshape(-1, 3)
+
+    @classmethod
+    def compute(cls, session, buses=None, load_mult=1.0, step_kw=STEP_KW):
+        # Measure the sensitivities of a compiled feeder session: its solution at load_mult (control
+        # actions included), then one solution without control actions for each injection at each
+        # candidate bus (by default every three-phase bus, see three_phase_buses())
+        start = time.perf_counter()
+        session.reset()
+        dss = session.dss
+        dss.solution.load_mult = load_mult
+        dss.solution.solve()
+
+        if buses is None:
+            buses = three_phase_buses(dss)
+        node_names = dss.circuit.nodes_names
+        v0 = np.asarray(dss.circuit.buses_vmag_pu)
+
+        kv_base = np.zeros(len(buses))
+        theta = np.zeros((len(buses), 3))
+        for k, bus in enumerate(buses):
+            dss.circuit.set_active_bus(bus)
+            kv_base[k] = dss.bus.kv_base
+            theta[k] = np.deg2rad(dss.bus.vmag_angle[1:6:2])
+
+        dv_dp = np.zeros((len(buses), len(node_names)), dtype=np.float32)
+        dv_dq = np.zeros((len(buses), len(node_names)), dtype=np.float32)
+        for k, bus in enumerate(buses):
+            # The probe generator is moved to each bus in turn
+            session.define('Generator.sensitivity_probe', f'phases=3 bus1={bus} kV={kv_base[k] * np.sqrt(3)} '
+                                                          f'kW={step_kw} kvar=0 model=1')
+            dss.solution.solve_no_control()
+            dv_dp[k] = (np.asarray(dss.circuit.buses_vmag_pu) - v0) * 1000 / step_kw
+
+            dss.text(f'Edit Generator.sensitivity_probe kW=0 kvar={step_kw}')
+            dss.solution.solve_no_control()
+            dv_dq[k] = (np.asarray(dss.circuit.buses_vmag_pu) - v0) * 1000 / step_kw
+        dss.text('Edit Generator.sensitivity_probe enabled=no')
+
+        print(f"Sensitivities of {len(buses)} buses computed in {time.perf_counter() - start:.1f} s")
+        return cls(node_names, buses, kv_base, theta, v0, dv_dp, dv_dq, load_mult, step_kw)
+
+    def save(self, file_path):
+        # Compressed NPZ file, written under a temporary name and then renamed so that readers never
+        # see an incomplete file
+        tmp_path = f'{file_path}.{os.getpid()}.tmp.npz'
+        np.savez_compressed(tmp_path, node_names=self.node_names, buses=self.buses, kv_base=self.kv_base,
+                            theta=self.theta, v0=self.v0, dv_dp=self.dv_dp, dv_dq=self.dv_dq,
+                            load_mult=self.load_mult, step_kw=self.step_kw)
+        os.replace(tmp_path, file_path)
+        print(f"File saved at: {file_path}")
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(data['node_names'], data['buses'], data['kv_base'], data['theta'], data['v0'],
+                       data['dv_dp'], data['dv_dq'], data['load_mult'], data['step_kw'])
+
+    @classmethod
+    def cached(cls, session=None, buses=None, load_mult=1.0, step_kw=STEP_KW):
+        # Sensitivities of the session's feeder (the default feeder without session), computed only
+        # the first time for the same feeder scripts, simulation code, candidate buses and operating
+        # point; the feeder is compiled only then
+        content = {'feeder': result_cache.feeder_fingerprint(session.dss_file if session is not None else None),
+                   'code': result_cache.cached_digest(os.path.abspath(__file__)),
+                   'versions': data_export_plot.package_versions(),
+                   'buses': None if buses is None else [bus.lower() for bus in buses],
+                   'load_mult': load_mult, 'step_kw': step_kw}
+        key = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+        cache_dir = data_export_plot.docs_path('sensitivity')
+        os.makedirs(cache_dir, exist_ok=True)
+        file_path = os.path.join(cache_dir, f'{key}.npz')
+        if os.path.exists(file_path):
+            return cls.load(file_path)
+
+        if session is None:
+            session = dss_session.FeederSession()
+        sensitivity = cls.compute(session, buses, load_mult, step_kw)
+        sensitivity.save(file_path)
+        return sensitivity
+
+    def index(self, bus):
+        try:
+            return self.bus_index[bus.lower()]
+        except KeyError:
+            raise KeyError(f'Bus {bus} is not one of the candidate buses') from None
+
+    def voltages(self, bus, p_mw, q_mvar):
+        # Voltage magnitude (pu) of every node with a three-phase injection of p_mw, q_mvar at bus
+        k = self.index(bus)
+        return self.v0 + self.dv_dp[k] * np.float32(p_mw) + self.dv_dq[k] * np.float32(q_mvar)
+
+    def der_output(self, bus, der_data):
+        # Steady-state output (MW, Mvar) of the DER of a scenario (dictionary with the DER.txt keys)
+        # connected at bus, the resulting node voltages (pu), the DER status and whether the DER and
+        # the linear model of the feeder agree. OpenDER runs in snapshot mode at its rated DC power.
+        # A DER that trips on the voltages its own output causes has no steady state: the output and
+        # voltages are those that trip it, with the status 'Trip'.
+        k = self.index(bus)
+        S_rated = der_data['S_rated'] * 1E6
+        der_obj, title = opender_opendss_integration.create_der(
+            S_rated, der_data['PF_rated'], der_data['V_rated'], der_data['control_mode'], der_data['CONST_Q'],
+            der_data['normal_op_CAT'], der_data['abnormal_op_CAT'])
+
+        # feeder() sets the time step of all OpenDER objects; a snapshot uses OpenDER's default
+        t_s = DER.t_s
+        DER.t_s = 100000
+        try:
+            p_mw = q_mvar = 0.0
+            v_bus = self.v0[self.bus_nodes[k]].astype(np.float64)
+            converged = False
+            for _ in range(MAX_ITERATIONS):
+                der_obj.update_der_input(v=(v_bus * self.kv_base[k] * 1000).tolist(), theta=self.theta[k].tolist(),
+                                         p_dc_w=S_rated * der_data['PF_rated'])
+                der_obj.run()
+                if der_obj.der_status == 'Trip':
+                    break
+                p_mw, q_mvar = der_obj.p_out_w / 1E6, der_obj.q_out_var / 1E6
+
+                v_next = (self.v0[self.bus_nodes[k]] + self.dv_dp[k, self.bus_nodes[k]] * p_mw
+                          + self.dv_dq[k, self.bus_nodes[k]] * q_mvar).astype(np.float64)
+                if np.abs(v_next - v_bus).max() < VOLTAGE_TOLERANCE:
+                    converged = True
+                    break
+                v_bus = v_bus + RELAXATION * (v_next - v_bus)
+        finally:
+            DER.t_s = t_s
+
+        return p_mw, q_mvar, self.voltages(bus, p_mw, q_mvar), der_obj.der_status, converged
+
+    def rank(self, der_data, buses=None):
+        # Predicted impact of the scenario's DER at each candidate bus (all by default): its output,
+        # status and bus voltage and the highest, lowest and largest change of the node voltages,
+        # with the buses whose highest voltage is lowest first and those where the DER trips last
+        rows = []
+        energized = self.v0 > 0
+        for bus in self.buses if buses is None else buses:
+            p_mw, q_mvar, v, status, converged = self.der_output(bus, der_data)
+            v_der = v[self.bus_nodes[self.index(bus)]]
+            rows.append({'Bus': bus, 'P (MW)': p_mw, 'Q (Mvar)': q_mvar, 'V DER (pu)': float(v_der.mean()),
+                         'V max (pu)': float(v[energized].max()), 'V min (pu)': float(v[energized].min()),
+                         'dV max (pu)': float(np.abs(v - self.v0).max()), 'Status': status, 'Converged': converged})
+
+        ranking = pd.DataFrame(rows)
+        order = np.lexsort((ranking['V max (pu)'], ranking['Status'] == 'Trip'))
+        return ranking.iloc[order].reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank the candidate buses of the feeder for the DER of each scenario '
+                                                 'with precomputed voltage sensitivities.')
+    parser.add_argument('scenario_files', nargs='+',
+                        help='scenario files: JSON (one object or a list of objects) or DER.txt format')
+    parser.add_argument('-o', '--output-dir', default='results',
+                        help='directory for the rankings (default: results)')
+    parser.add_argument('--load-mult', type=float, default=1.0,
+                        help='load multiplier of the operating point of the sensitivities (default: 1.0)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of buses printed for each scenario (default: 10)')
+    args = parser.parse_args()
+
+    scenarios = []
+    for file_path in args.scenario_files:
+        scenarios.extend(load_scenarios(file_path))
+
+    # Paths are resolved before OpenDSS changes the working directory to the feeder folder
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    sensitivity = VoltageSensitivity.cached(load_mult=args.load_mult)
+    for k, scenario in enumerate(scenarios):
+        if not isinstance(scenario, Scenario):
+            scenario = Scenario.from_der_data(scenario)
+        name = scenario.name or f'scenario_{k + 1:03d}'
+
+        start = time.perf_counter()
+        ranking = sensitivity.rank(scenario.as_der_data())
+        print(f"{name} ({scenario.control_mode}): {len(ranking)} buses ranked in {time.perf_counter() - start:.1f} s")
+        print(ranking.head(args.top).to_string(index=False))
+
+        file_path = os.path.join(output_dir, f'{name}_{scenario.control_mode}_ranking.csv')
+        ranking.to_csv(file_path, index=False)
+        print(f"File saved at: {file_path}")
+
+if __name__ == "__main__":
+    main()